@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+'''
+Prints traced memory of make_graph with archives of dnf and koji
+packages sources, which keep attributes in slots and rpms and requires
+as interned frozensets, and with plain records keeping attributes in
+instance dictionaries and names as they were parsed
+
+    PYTHONPATH=. python3 benchmarks/graph_memory.py [PACKAGES]
+'''
+import sys
+import tracemalloc
+
+from rebuild_tool.graph import PackageGraph
+from rebuild_tool.pkg_source_plugins.dnf import DnfArchive
+
+
+class PlainArchive(object):
+    '''
+    Record with the same attributes as DnfArchive keeping names
+    as they were parsed
+    '''
+    def __init__(self, package, srpm_file, rpms, dependencies):
+        self.package = package
+        self.pkg_dir = '/tmp/rebuild/{}/'.format(package)
+        self.srpm_file = srpm_file
+        self.spec_file = package + '.spec'
+        self.spec_digest = None
+        self.sources_extracted = False
+        self.rpms = set(rpms)
+        self.dependencies = set(dependencies)
+
+
+def dnf_archive(package, srpm_file, rpms, dependencies):
+    '''
+    Returns DnfArchive restored like archives fetched by fetch workers
+    '''
+    return DnfArchive.from_state({
+        'package': package, 'pkg_dir': '/tmp/rebuild/{}/'.format(package),
+        'srpm_file': srpm_file, 'spec_file': package + '.spec', 'spec_digest': None,
+        'sources_extracted': False, 'rpms': rpms, 'dependencies': dependencies})
+
+
+def distro_records(record, packages, subpackages=10, requires=30):
+    '''
+    Returns dictionary of records with names of rpms created separately
+    for each record like names parsed from output of rpm and dnf
+    '''
+    records = {}
+    for x in range(packages):
+        rpms = ['pkg{}-sub{}'.format(x, y) for y in range(subpackages)]
+        deps = ['pkg{}-sub{}'.format((x * 7 + y) % packages, y % subpackages)
+                for y in range(requires)]
+        records['pkg{}'.format(x)] = record('pkg{}'.format(x), None, rpms, deps)
+    return records
+
+
+def measure(record, packages):
+    tracemalloc.start()
+    try:
+        records = distro_records(record, packages)
+        graph = PackageGraph("rawhide", records)
+        graph.make_graph()
+        return tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+
+def main(packages=2000):
+    # The first run allocates caches of imported modules
+    measure(dnf_archive, 10)
+    for record in (PlainArchive, dnf_archive):
+        (current, peak) = measure(record, packages)
+        print("make_graph of {} packages, {}: {:.1f} MiB current, {:.1f} MiB peak".format(
+            packages, record.__name__, current / 2 ** 20, peak / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,6 @@
+#!/usr/bin/python3
+
+from rebuild_tool.bin import worker
+
+if __name__ == '__main__':
+    worker()
@@ -0,0 +1,101 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+
+from rebuild_tool.utils import cache_path
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS packages (
+    snapshot TEXT NOT NULL,
+    package TEXT NOT NULL,
+    srpm TEXT,
+    rpms TEXT NOT NULL,
+    requires TEXT NOT NULL,
+    PRIMARY KEY (snapshot, package)
+);
+CREATE TABLE IF NOT EXISTS cycles (
+    component TEXT PRIMARY KEY,
+    cycles TEXT NOT NULL
+);
+'''
+
+
+def default_cache_path():
+    '''
+    Returns path of analysis cache in user's cache directory
+    '''
+    return cache_path('analysis.db')
+
+
+class AnalysisCache(object):
+    '''
+    Keeps rpms and requires of packages and circular dependencies
+    found in strongly connected components of the graph between runs.
+    Records of packages are valid only for the same snapshot of
+    repository, cycles are stored under digest of component edges.
+    '''
+    def __init__(self, path=None):
+        self.path = path or default_cache_path()
+        self.lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def load(self, snapshot, packages):
+        '''
+        Returns dictionary package: (srpm, rpms, requires) of packages
+        found in cache for the snapshot
+        '''
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT package, srpm, rpms, requires FROM packages WHERE snapshot = ?',
+                (snapshot,)).fetchall()
+        return {package: (srpm, set(json.loads(rpms)), set(json.loads(requires)))
+                for (package, srpm, rpms, requires) in rows if package in packages}
+
+    def store(self, snapshot, archives):
+        '''
+        Stores rpms and requires of all archives in dictionary package: archive
+        '''
+        rows = [(snapshot, package, archive.srpm_file, json.dumps(sorted(archive.rpms)),
+                 json.dumps(sorted(archive.dependencies)))
+                for package, archive in archives.items()]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO packages (snapshot, package, srpm, rpms, requires) '
+                'VALUES (?, ?, ?, ?, ?)', rows)
+        logger.debug("Stored analysis of %d packages.", len(rows))
+
+    def cycles(self, component):
+        '''
+        Returns list of cycles stored for component digest, None if missing
+        '''
+        with self.lock:
+            row = self.connection.execute('SELECT cycles FROM cycles WHERE component = ?',
+                                          (component,)).fetchone()
+        if row is None:
+            return None
+        return [set(x) for x in json.loads(row[0])]
+
+    def store_cycles(self, component, cycles):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO cycles (component, cycles) VALUES (?, ?)',
+                (component, json.dumps([sorted(x) for x in cycles])))
@@ -0,0 +1,89 @@
+import logging
+import threading
+
+from rebuild_tool.builder_plugins import builder_loader
+from rebuild_tool.pkg_source_plugins import pkg_source_loader
+from rebuild_tool.exceptions import IncompleteMetadataException
+from rebuild_tool.slots import SlotPool
+
+logger = logging.getLogger(__name__)
+
+# Number of packages built at once by all Rebuild files of a batch
+DEFAULT_BUILD_SLOTS = 10
+
+
+def check_batch(batch_metadata):
+    '''
+    Checks that rebuild metadata of all Rebuild files can be processed
+    in one batch, packages sources keep repo, prefix and koji_tag as class
+    attributes shared by all packages
+    '''
+    for attr in ['repo', 'prefix']:
+        if len({metadata[attr] for metadata in batch_metadata}) > 1:
+            raise IncompleteMetadataException(
+                "All Rebuild files of a batch have to use the same {}.".format(attr))
+    if len({metadata['koji_tag'] for metadata in batch_metadata} - {None}) > 1:
+        raise IncompleteMetadataException(
+            "All Rebuild files of a batch have to use the same koji_tag.")
+
+
+class Batch(object):
+    '''
+    Rebuilds packages of several Rebuild files, packages shared by more
+    files are fetched and analysed only once, builds of all the files
+    take slots from one pool
+    '''
+    def __init__(self, batch_metadata, build_slots=DEFAULT_BUILD_SLOTS):
+        check_batch(batch_metadata)
+        self.batch_metadata = batch_metadata
+        self.slots = SlotPool(build_slots)
+        self.pkg_sources = {}  # packages_source: container shared by builders
+        self.builders = []
+        self.errors = {}  # index of builder: exception which stopped the rebuild
+
+    def pkg_source(self, name):
+        '''
+        Returns container of packages source plugin name shared by all
+        Rebuild files using the plugin
+        '''
+        if name not in self.pkg_sources:
+            module = pkg_source_loader.load_plugin(name)
+            self.pkg_sources[name] = module.PkgsContainer()
+            logger.info("Package source plugin {} loaded.".format(module))
+        return self.pkg_sources[name]
+
+    def create_builders(self):
+        '''
+        Creates builder of each Rebuild file and analyses relations
+        between its packages, packages fetched for previous Rebuild
+        files are reused. Gauges of each builder are labeled with index
+        of its Rebuild file.
+        '''
+        for (index, rebuild_metadata) in enumerate(self.batch_metadata):
+            builder_module = builder_loader.load_plugin(rebuild_metadata['build_system'])
+            builder = builder_module.RealBuilder(
+                rebuild_metadata, self.pkg_source(rebuild_metadata['packages_source']))
+            builder.slots.attach(self.slots)
+            builder.metrics_labels = {'rebuild': index}
+            builder.get_relations()
+            self.builders.append(builder)
+
+    def run_building(self):
+        '''
+        Runs rebuilds of all Rebuild files at once, returns True when
+        all of them finished without failed packages
+        '''
+        def run(index, builder):
+            try:
+                builder.run_building()
+            except BaseException as e:
+                logger.error("Rebuild {} failed:".format(index), exc_info=True)
+                self.errors[index] = e
+
+        threads = [threading.Thread(target=run, args=(index, builder))
+                   for index, builder in enumerate(self.builders)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return not self.errors and not any(x.failed_packages for x in self.builders)
@@ -1,22 +1,74 @@
 import sys
 import click
 import logging
-import getpass
 import threading
-from copr.exceptions import CoprNoConfException, CoprRequestException
 
-from rebuild_tool.rebuild_metadata import get_file_data, RebuildMetadata
+from rebuild_tool.rebuild_metadata import RebuildMetadata
 from rebuild_tool.builder_plugins import builder_loader
 from rebuild_tool.pkg_source_plugins import pkg_source_loader
-from rebuild_tool.logger import register_file_log_handler
+from rebuild_tool.logger import register_file_log_handler, file_formatter, JsonFormatter
+from rebuild_tool.metrics import start_metrics_server
+from rebuild_tool.history import BuildHistory
+from rebuild_tool.utils import cache_path
+from rebuild_tool.batch import Batch, DEFAULT_BUILD_SLOTS
 import rebuild_tool.exceptions as exc
 
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
+LOG_FORMATS = ['text', 'json']
+
+
+def setup_logging(log_file, log_format):
+    '''
+    Registers handler writing log to log_file in log_format
+    '''
+    fmt = JsonFormatter() if log_format == 'json' else file_formatter
+    if not register_file_log_handler(log_file, fmt=fmt):
+        click.echo("Failed to open log file {}.".format(log_file), err=True)
+
+
+def print_history(history_db, rebuild_files):
+    '''
+    Prints report of the slowest and the flakiest packages from build
+    history history_db or from history databases of rebuild_files
+    '''
+    if history_db is not None:
+        paths = [history_db]
+    else:
+        try:
+            paths = [RebuildMetadata.from_file(x).get('history_db') for x in rebuild_files]
+        except (exc.IncompleteMetadataException, exc.UnknownPluginException, IOError) as e:
+            sys.exit(e)
+    for path in sorted(set(paths or [None]), key=str):
+        click.echo(BuildHistory(path).report())
+
+
+def run_batch(batch_metadata, analyse, build_slots):
+    '''
+    Fetches and analyses packages of all Rebuild files at once
+    and runs their builds sharing build_slots
+    '''
+    logger = logging.getLogger(__name__)
+    try:
+        batch = Batch(batch_metadata, build_slots)
+        batch.create_builders()
+        if analyse:
+            return
+        if not batch.run_building():
+            logger.info('Rebuild finished with failed packages.')
+            sys.exit(1)
+        logger.info("Rebuild successfully completed.")
+    except (exc.UnknownRepoException, exc.IncompleteMetadataException,
+            exc.MissingRecipeException, exc.DownloadFailException,
+            exc.BuildSystemException) as e:
+        logger.error('Failed and exiting:', exc_info=True)
+        logger.info('Rebuild failed.')
+        sys.exit(e)
+
 
 @click.command(context_settings=CONTEXT_SETTINGS)
-@click.argument('rebuild_file', nargs=1)
+@click.argument('rebuild_files', nargs=-1)
 @click.option('--visual / --no-visual',
               default=False,
               help='Enable / disable visualization of relations between pacakges')
@@ -24,20 +76,124 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
               is_flag=True,
               help='Analyse relations between packages and print circular '
               'dependencies, disable execution of builds')
-def main(rebuild_file, visual, analyse):
-    register_file_log_handler('/tmp/sclbulider-{0}.log'.format(getpass.getuser()))
+@click.option('--history',
+              is_flag=True,
+              help='Print the slowest and the flakiest packages from build history of '
+              'the given Rebuild files or of --history-db and exit')
+@click.option('--history-db',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Build history database printed by --history  '
+              '[default: history_db of Rebuild files or ~/.cache/rebuild_tool/history.db]')
+@click.option('--metrics-port',
+              type=int,
+              default=None,
+              help='Expose rebuild progress in Prometheus text format on '
+              'http://localhost:PORT/metrics')
+@click.option('--graph-output',
+              type=click.Path(dir_okay=False, writable=True),
+              default=None,
+              help='Write graph of packages to FILE in DOT, SVG or HTML format '
+              'according to the extension, the file is refreshed during the build')
+@click.option('--build-slots',
+              type=click.IntRange(min=1),
+              default=DEFAULT_BUILD_SLOTS,
+              show_default=True,
+              help='Maximal number of packages built at once when more '
+              'Rebuild files are given')
+@click.option('--fetch-coordinator',
+              metavar='HOST:PORT',
+              default=None,
+              help='Listen on HOST:PORT for fetch workers and let them download '
+              'and repack packages instead of fetching them locally')
+@click.option('--shared-dir',
+              type=click.Path(file_okay=False),
+              default=None,
+              help='Directory shared with fetch workers where files of packages are stored')
+@click.option('--plan-output',
+              type=click.Path(dir_okay=False, writable=True),
+              default=None,
+              help='Write build plan to FILE after analysis, srpms are copied '
+              'to FILE without extension + _files directory')
+@click.option('--execute-plan',
+              type=click.Path(exists=True, dir_okay=False),
+              default=None,
+              help='Build packages of build plan written by --plan-output, '
+              'packages are not fetched and analysed again')
+@click.option('--only',
+              multiple=True,
+              metavar='PACKAGE',
+              help='Rebuild only PACKAGE, can be used more times')
+@click.option('--from', 'from_packages',
+              multiple=True,
+              metavar='PACKAGE',
+              help='Rebuild PACKAGE and all packages depending on it, '
+              'can be used more times')
+@click.option('--to', 'to_packages',
+              multiple=True,
+              metavar='PACKAGE',
+              help='Rebuild PACKAGE and all its dependencies, can be used more times')
+@click.option('--log-file',
+              type=click.Path(dir_okay=False, writable=True),
+              default=None,
+              help='Write log to FILE, rotated when it grows over 10 MiB  '
+              '[default: ~/.cache/rebuild_tool/rebuild_tool.log]')
+@click.option('--log-format',
+              type=click.Choice(LOG_FORMATS),
+              default='text',
+              show_default=True,
+              help='Format of log file, json writes one event per line')
+def main(rebuild_files, visual, analyse, history, history_db, metrics_port, graph_output, build_slots,
+         fetch_coordinator, shared_dir, plan_output, execute_plan, only, from_packages,
+         to_packages, log_file, log_format):
+    if history:
+        print_history(history_db, rebuild_files)
+        return
+    if not rebuild_files:
+        raise click.UsageError('Missing argument "REBUILD_FILES...".')
+
+    setup_logging(log_file or cache_path('rebuild_tool.log'), log_format)
 
     logger = logging.getLogger(__name__)
 
     logger.info('Sclbuilder initialized')
 
+    if metrics_port is not None:
+        try:
+            start_metrics_server(metrics_port)
+        except OSError as e:
+            logger.error('Failed to start metrics server:', exc_info=True)
+            sys.exit(e)
+
     try:
-        rebuild_metadata = RebuildMetadata(get_file_data(rebuild_file))
+        batch_metadata = [RebuildMetadata.from_file(x) for x in rebuild_files]
     except (exc.IncompleteMetadataException, exc.UnknownPluginException, IOError) as e:
         logger.error('Failed and exiting:', exc_info=True)
         logger.info('Rebuild failed.')
         sys.exit(e)
 
+    for rebuild_metadata in batch_metadata:
+        # Analysis only runs use analysis cache instead of downloading packages,
+        # build plan needs srpms of all the packages
+        rebuild_metadata['analysis_only'] = analyse and plan_output is None
+        if execute_plan is not None:
+            rebuild_metadata['build_plan'] = execute_plan
+        if only or from_packages or to_packages:
+            rebuild_metadata['select'] = {'only': only, 'from_packages': from_packages,
+                                          'to_packages': to_packages}
+        if fetch_coordinator is not None:
+            rebuild_metadata['fetch_coordinator'] = fetch_coordinator
+            rebuild_metadata['shared_dir'] = shared_dir
+
+    if len(batch_metadata) > 1:
+        if visual or graph_output or plan_output or execute_plan or \
+                only or from_packages or to_packages:
+            sys.exit("--visual, --graph-output, --plan-output, --execute-plan, --only, --from "
+                     "and --to can't be used with more Rebuild files.")
+        run_batch(batch_metadata, analyse, build_slots)
+        return
+    rebuild_metadata = batch_metadata[0]
+
     # Import of selected builder module
     builder_module = builder_loader.load_plugin(rebuild_metadata['build_system'])
     logger.info("Builder plugin {} loaded.".format(builder_module))
@@ -50,28 +206,82 @@ def main(rebuild_file, visual, analyse):
     try:
         builder = builder_module.RealBuilder(rebuild_metadata, pkg_source)
         builder.get_relations()
+        if plan_output is not None:
+            from rebuild_tool.build_plan import write_plan
+            write_plan(plan_output, builder)
     except (exc.UnknownRepoException, exc.IncompleteMetadataException,
-            exc.MissingRecipeException) as e:
+            exc.MissingRecipeException, exc.DownloadFailException,
+            exc.BuildSystemException, exc.BuildPlanException, OSError) as e:
         logger.error('Failed and exiting:', exc_info=True)
         logger.info('Rebuild failed.')
         sys.exit(e)
-    except CoprNoConfException:
-        print("Copr config file ~/.config/copr is missing.", file=sys.stderr)
-        sys.exit(1)
+
+    # Imported here to keep startup of the command fast
+    from rebuild_tool.visual import write_graph, draw, GraphWriter
+
+    writer = None
+    try:
+        if graph_output is not None:
+            write_graph(graph_output, builder.state.graph, builder.state.states)
+            if not analyse:
+                writer = GraphWriter(builder, graph_output)
+                writer.start()
+    except (ValueError, OSError) as e:
+        logger.error('Failed and exiting:', exc_info=True)
+        sys.exit(e)
 
     try:
         if analyse:
-            builder.graph.show()
+            if visual or (graph_output is None and plan_output is None):
+                builder.graph.show()
 
         elif visual:
             t = threading.Thread(target=builder.run_building)
             t.start()
-            builder.graph.show()
+            # The graph is drawn from published states, builder.graph is modified by the build
+            draw(builder.state.graph, builder.state.states, builder)
+            t.join()
 
         else:
             builder.run_building()
+            if builder.failed_packages:
+                logger.info('Rebuild finished with failed packages.')
+                sys.exit(1)
             logger.info("Rebuild successfully completed.")
-    except (KeyError, CoprRequestException) as e:
+    except (KeyError, exc.BuildSystemException, exc.BuildFailureException) as e:
         logger.error('Failed and exiting:', exc_info=True)
         logger.info('Rebuild failed.')
         sys.exit(e)
+    finally:
+        if writer is not None:
+            writer.stop()
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('coordinator', metavar='HOST:PORT')
+@click.option('--log-file',
+              type=click.Path(dir_okay=False, writable=True),
+              default=None,
+              help='Write log to FILE, rotated when it grows over 10 MiB  '
+              '[default: ~/.cache/rebuild_tool/fetch_worker.log]')
+@click.option('--log-format',
+              type=click.Choice(LOG_FORMATS),
+              default='text',
+              show_default=True,
+              help='Format of log file, json writes one event per line')
+def worker(coordinator, log_file, log_format):
+    '''
+    Fetches and repacks packages sent by fetch coordinator
+    '''
+    setup_logging(log_file or cache_path('fetch_worker.log'), log_format)
+
+    logger = logging.getLogger(__name__)
+
+    # Imported here to keep startup of the command fast
+    from rebuild_tool.distributed import run_worker
+
+    try:
+        run_worker(coordinator)
+    except (OSError, ValueError) as e:
+        logger.error('Failed and exiting:', exc_info=True)
+        sys.exit(e)
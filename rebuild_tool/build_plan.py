@@ -0,0 +1,131 @@
+import os
+import json
+import shutil
+import logging
+import networkx as nx
+
+from rebuild_tool.visual import condense
+from rebuild_tool.exceptions import BuildPlanException
+from rebuild_tool import utils
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+
+
+def plan_order(G):
+    '''
+    Returns topological layers of packages and priorities of packages,
+    packages of layer n depend only on packages of lower layers or on
+    packages of the same cycle, priority is length of the longest chain
+    of packages waiting for the package
+    '''
+    (C, members) = condense(G)
+    order = list(nx.topological_sort(C))  # dependent packages first
+    priority = {}
+    for node in order:
+        priority[node] = max([priority[x] + 1 for x in C.predecessors(node)] or [0])
+    layer = {}
+    for node in reversed(order):
+        layer[node] = max([layer[x] + 1 for x in C.successors(node)] or [0])
+    layers = [[] for x in range(max(layer.values()) + 1)] if layer else []
+    priorities = {}
+    for node, members_of_node in members.items():
+        layers[layer[node]] += members_of_node
+        for pkg in members_of_node:
+            priorities[pkg] = priority[node]
+    return ([sorted(x) for x in layers], priorities)
+
+
+def copy_files(archive, files_dir):
+    '''
+    Copies srpm and spec file of archive to its own directory in
+    files_dir, returns state of the archive with pkg_dir relative
+    to files_dir
+    '''
+    state = archive.state()
+    pkg_dir = os.path.join(files_dir, archive.package, '')
+    if not os.path.isdir(pkg_dir):
+        os.makedirs(pkg_dir)
+    for name in [archive.srpm_file, archive.spec_file]:
+        shutil.copy2(os.path.join(state['pkg_dir'], name), pkg_dir)
+    state['pkg_dir'] = archive.package + '/'
+    if 'sources_extracted' in state:
+        state['sources_extracted'] = False
+    return state
+
+
+def write_plan(path, builder):
+    '''
+    Writes build plan of builder to path as JSON, srpm and spec files
+    of packages are copied to directory path without extension + _files,
+    file is replaced atomically
+    '''
+    (layers, priorities) = plan_order(builder.full_graph)
+    files_dir = os.path.splitext(path)[0] + '_files'
+    packages = {}
+    for pkg in sorted(builder.packages):
+        archive = builder.pkg_source[pkg]
+        if not hasattr(archive, 'state'):
+            raise BuildPlanException(
+                "Files of {} were not fetched, build plan can't be written.".format(pkg))
+        state = copy_files(archive, files_dir)
+        packages[pkg] = {
+            'requires': sorted(builder.full_graph.successors(pkg)),
+            'priority': priorities[pkg],
+            'sha256': utils.file_digest(os.path.join(files_dir, state['pkg_dir'],
+                                                     state['srpm_file'])),
+            'state': state,
+        }
+    recipes = []
+    for recipe in builder.recipes or []:
+        requires = set()
+        for pkg in recipe.packages & builder.packages:
+            requires |= set(builder.full_graph.successors(pkg))
+        recipes.append({'steps': [list(step) for step in recipe.order],
+                        'requires': sorted(requires - recipe.packages)})
+    plan = {
+        'version': PLAN_VERSION,
+        'repo': builder.repo,
+        'prefix': builder.prefix,
+        'koji_tag': builder.koji_tag,
+        'packages_source': builder.packages_source,
+        'files_dir': os.path.basename(files_dir),
+        'layers': layers,
+        'recipes': recipes,
+        'packages': packages,
+    }
+    with open(path + '.tmp', 'w') as fo:
+        json.dump(plan, fo, indent=2, sort_keys=True)
+        fo.write('\n')
+    os.replace(path + '.tmp', path)
+    print("Build plan of {} packages in {} layers written to {}.".format(
+        len(packages), len(layers), path))
+
+
+def read_plan(path):
+    '''
+    Loads build plan from path, pkg_dir of each package is made absolute,
+    raises BuildPlanException when plan can't be used or srpm differs
+    from the analysed one
+    '''
+    try:
+        with open(path) as fi:
+            plan = json.load(fi)
+    except (IOError, ValueError) as e:
+        raise BuildPlanException("Failed to read build plan {}: {}".format(path, e))
+    if plan.get('version') != PLAN_VERSION:
+        raise BuildPlanException("Unsupported version of build plan {}: {}.".format(
+            path, plan.get('version')))
+    files_dir = os.path.join(os.path.dirname(os.path.abspath(path)), plan['files_dir'])
+    for pkg, info in plan['packages'].items():
+        state = info['state']
+        state['pkg_dir'] = os.path.join(files_dir, state['pkg_dir'])
+        srpm = os.path.join(state['pkg_dir'], state['srpm_file'])
+        try:
+            digest = utils.file_digest(srpm)
+        except IOError:
+            raise BuildPlanException("Srpm of {} not found: {}.".format(pkg, srpm))
+        if digest != info['sha256']:
+            raise BuildPlanException("Srpm {} changed after the plan was made.".format(srpm))
+    return plan
@@ -1,35 +1,126 @@
 import os
 import sys
+import time
 import tempfile
+import threading
 import shutil
+import json
 import logging
+import networkx as nx
 from abc import ABCMeta, abstractmethod
+from collections import namedtuple, deque, OrderedDict, Counter
+from collections.abc import Mapping
+from types import MappingProxyType
 
 from rebuild_tool.graph import PackageGraph
+from rebuild_tool.history import BuildHistory
+from rebuild_tool.analysis_cache import AnalysisCache
+from rebuild_tool.pkg_source import CachedArchive, repo_revision
 from rebuild_tool.rebuild_metadata import Recipe
-from rebuild_tool.exceptions import MissingRecipeException, BuildFailureException
+from rebuild_tool.exceptions import (MissingRecipeException, BuildFailureException,
+                                     IncompleteMetadataException, BuildPlanException)
+from rebuild_tool.metrics import registry as metrics
+from rebuild_tool.slots import SlotPool
+from rebuild_tool import build_plan
 from rebuild_tool import utils
 
 logger = logging.getLogger(__name__)
 
+# Immutable state of the rebuild published by Builder, graph is frozen graph
+# of all packages, states is read-only mapping package: state and counts
+# read-only mapping state: number of packages
+BuildState = namedtuple('BuildState', ['version', 'graph', 'states', 'counts'])
+
+# Minimal number of seconds between updates of package state metrics
+METRICS_INTERVAL = 1
+
+
+class PackageStates(Mapping):
+    '''
+    Read-only mapping package: state sharing dictionary of states with
+    the previous version, recent changes are kept in a small dictionary
+    merged into a new copy of the shared one when it grows over square
+    root of its size
+    '''
+    def __init__(self, base=None, changes=None):
+        self._base = base or {}
+        self._changes = changes or {}
+
+    def __getitem__(self, pkg):
+        if pkg in self._changes:
+            return self._changes[pkg]
+        return self._base[pkg]
+
+    def __iter__(self):
+        yield from self._base
+        for pkg in self._changes:
+            if pkg not in self._base:
+                yield pkg
+
+    def __len__(self):
+        return len(self._base) + sum(1 for pkg in self._changes if pkg not in self._base)
+
+    def updated(self, changes):
+        '''
+        Returns new mapping with states of changes
+        '''
+        merged = dict(self._changes)
+        merged.update(changes)
+        if len(merged) ** 2 > len(self._base):
+            base = dict(self._base)
+            base.update(merged)
+            return PackageStates(base)
+        return PackageStates(self._base, merged)
+
 
 def check_build(build_fce):
     '''
     Decorator to check if build was successfull or not,
-    updates attributes and removes package from graph
+    updates attributes and removes package from graph.
+    build_fce returns True when all packages were built, False when
+    all failed or set of failed packages. Failed builds are retried
+    self.retries times with exponential backoff, packages failed after
+    that are isolated together with all their dependents. Packages are
+    passed to build_fce in groups not bigger than number of free slots
+    of self.slots. Failed packages of speculative are not retried nor
+    isolated, they are built again when all their dependencies are built.
     '''
 
-    def inner(self, pkgs, verbose=True):
+    def inner(self, pkgs, verbose=True, speculative=()):
         if not isinstance(pkgs, list):
             pkgs = [pkgs]
-        if build_fce(self, pkgs, verbose):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.retry_backoff * 2 ** (attempt - 1)
+                print("Retrying build of {} in {} s.".format(pkgs, delay))
+                logger.info("Retry {} of {} in {} s.".format(attempt, pkgs, delay))
+                time.sleep(delay)
+            failed = set()
+            remaining = pkgs
+            while remaining:
+                slots = self.slots.acquire(len(remaining))
+                (group, remaining) = (remaining[:slots], remaining[slots:])
+                try:
+                    self.set_in_flight(self.in_flight | set(group))
+                    result = build_fce(self, group, verbose)
+                finally:
+                    self.set_in_flight(self.in_flight - set(group))
+                    self.slots.release(slots)
+                if result is False:
+                    failed |= set(group)
+                elif result is not True:
+                    failed |= set(result)
             for pkg in pkgs:
-                if verbose:  # not building recipe
-                    self.graph.G.remove_node(pkg)
-                self.built_packages.add(pkg)
-            return True
-        else:
-            raise BuildFailureException("Failed to build packages {}.".format(pkgs))
+                if pkg not in failed:
+                    # graph nodes of recipe packages are removed after whole recipe is built
+                    self.mark_built(pkg, remove_node=verbose)
+            if failed & set(speculative):
+                self.speculation_failed(failed & set(speculative))
+            pkgs = [pkg for pkg in pkgs if pkg in failed and pkg not in speculative]
+            if not pkgs:
+                return True
+        self.isolate_failure(pkgs)
+        return False
     return inner
 
 
@@ -46,16 +137,56 @@ class Builder(metaclass=ABCMeta):
         self.repo = rebuild_metadata['repo']
         self.prefix = rebuild_metadata['prefix']
         self.koji_tag = rebuild_metadata['koji_tag']
+        self.koji_hub = rebuild_metadata.get('koji_hub')
+        self.koji_topurl = rebuild_metadata.get('koji_topurl')
+        self.history = BuildHistory(rebuild_metadata.get('history_db'))
+        self.analysis_cache = AnalysisCache(rebuild_metadata.get('analysis_cache'))
+        self.analysis_only = rebuild_metadata.get('analysis_only', False)
+        self.packages_source = rebuild_metadata.get('packages_source')
+        self.fetch_coordinator = rebuild_metadata.get('fetch_coordinator')
+        self.shared_dir = rebuild_metadata.get('shared_dir')
+        self.fetch_connect_timeout = rebuild_metadata.get('fetch_connect_timeout')
+        self.fetch_idle_timeout = rebuild_metadata.get('fetch_idle_timeout')
+        # only, from_packages and to_packages of PackageGraph.select
+        self.selection = rebuild_metadata.get('select')
+        self.build_plan = None
+        if rebuild_metadata.get('build_plan'):
+            self.build_plan = build_plan.read_plan(rebuild_metadata['build_plan'])
+            self.packages = set(self.build_plan['packages'])
+        self.repo_key = None
         self.path = tempfile.mkdtemp()
         self.built_packages = set()
+        self.in_flight = set()
+        self.lock = threading.RLock()
+        self.full_graph = nx.freeze(nx.DiGraph())
+        self.observers = []
+        self.failed_packages = set()
+        self.blocked_packages = {}
+        self.slots = SlotPool()
+        self.retries = rebuild_metadata.get('retries', 0)
+        self.speculative = rebuild_metadata.get('speculative', False)
+        self.speculative_packages = rebuild_metadata.get('speculative_packages', [])
+        self.speculative_history = rebuild_metadata.get('speculative_history', 3)
+        self.hard_requires = set(rebuild_metadata.get('hard_requires', []))
+        self.speculative_allowed = None
+        self.speculatively_failed = set()
+        self.retry_backoff = rebuild_metadata.get('retry_backoff', 60)
         self.num_of_deps = {}
+        self.priorities = {}
         self.circular_deps = []
         self.get_files()
-        self.graph = PackageGraph(self.repo, self.pkg_source)
+        self.graph = PackageGraph(self.repo, self.pkg_source, self.packages)
+        self.state = BuildState(0, self.full_graph, PackageStates(), MappingProxyType({}))
+        self.metrics_updated = 0
+        self.metrics_labels = {}  # labels of gauges describing this rebuild
         try:
-            self.recipes = rebuild_metadata['recipes']
+            self.recipes = rebuild_metadata.get('recipes')
         except IOError:
             logger.error("Failed to load recipe {0}.".format(rebuild_metadata['recipes']))
+        if self.build_plan:
+            self.recipes = [Recipe.from_order(x['steps']) for x in self.build_plan['recipes']]
+            self.priorities = {pkg: info['priority']
+                               for pkg, info in self.build_plan['packages'].items()}
 
     def __del__(self):
         shutil.rmtree(self.path)
@@ -75,25 +206,304 @@ class Builder(metaclass=ABCMeta):
 
     @property
     def recipes(self):
-        return self.__recipes
+        '''
+        List of recipes which were not built yet, None without recipes
+        '''
+        if self.__recipes is None:
+            return None
+        return list(self.__recipes)
 
     @recipes.setter
     def recipes(self, recipe_files):
+        '''
+        Loads recipes and indexes them by their packages, readiness
+        of recipes is tracked from the first call of next_recipe
+        '''
+        self.recipe_index = {}  # package: recipe including the package
+        self.recipe_requires_cache = {}
+        self.recipe_missing = None  # recipe: number of required packages not built
+        self.recipes_waiting = {}  # package: recipes requiring the package
+        self.ready_recipes = deque()
         if not recipe_files:
             self.__recipes = None
-        else:
-            self.__recipes = [Recipe(recipe) for recipe in recipe_files]
+            return
+        # dictionary keeps order of recipes and removes them in constant time
+        self.__recipes = OrderedDict()
+        for recipe in recipe_files:
+            if not isinstance(recipe, Recipe):
+                recipe = Recipe(recipe)
+            self.__recipes[recipe] = None
+            for pkg in recipe.packages:
+                self.recipe_index.setdefault(pkg, recipe)
+
+    def remove_recipe(self, recipe):
+        '''
+        Removes built or failed recipe
+        '''
+        with self.lock:
+            if self.__recipes is None or self.__recipes.pop(recipe, False) is False:
+                return
+            for pkg in recipe.packages:
+                if self.recipe_index.get(pkg) is recipe:
+                    del self.recipe_index[pkg]
+
+    def recipe_requires(self, recipe):
+        '''
+        Returns packages outside of recipe required by packages
+        of the recipe, computed once for each recipe
+        '''
+        if recipe not in self.recipe_requires_cache:
+            deps = set()
+            for pkg in recipe.packages:
+                if not pkg in self.packages:
+                    raise KeyError("Package {} from recipe missing in packages list".format(pkg))
+                try:
+                    deps |= set(self.graph.G.successors(pkg))
+                except nx.NetworkXError:
+                    # package is not in the graph, it has no dependencies
+                    continue
+            self.recipe_requires_cache[recipe] = frozenset(deps - recipe.packages)
+        return self.recipe_requires_cache[recipe]
+
+    def track_recipes(self):
+        '''
+        Counts packages each recipe waits for, the counters are
+        decreased by mark_built
+        '''
+        with self.lock:
+            if self.recipe_missing is not None:
+                return
+            self.recipe_missing = {}
+            for recipe in self.recipes or []:
+                missing = self.recipe_requires(recipe) - self.built_packages
+                self.recipe_missing[recipe] = len(missing)
+                for pkg in missing:
+                    self.recipes_waiting.setdefault(pkg, []).append(recipe)
+                if not missing:
+                    self.ready_recipes.append(recipe)
+
+    def next_recipe(self):
+        '''
+        Returns recipe with all required packages built, None when
+        no recipe is ready
+        '''
+        self.track_recipes()
+        with self.lock:
+            while self.ready_recipes:
+                recipe = self.ready_recipes.popleft()
+                if recipe in self.__recipes:
+                    return recipe
+        return None
+
+    def recipe_ready(self):
+        '''
+        Checks if any recipe has all required packages built
+        '''
+        self.track_recipes()
+        with self.lock:
+            return any(recipe in self.__recipes for recipe in self.ready_recipes)
 
     def get_relations(self):
         '''
         Runs graph analysis and get dependance tree and circular_deps
         '''
-        self.graph.make_graph()
-        self.circular_deps = self.graph.get_cycles()
+        if self.build_plan:
+            self.restore_graph()
+            if self.selection:
+                self.select_packages()
+        else:
+            with metrics.phase('analyse'):
+                self.graph.make_graph()
+                if self.repo_key:
+                    self.analysis_cache.store(self.repo_key, {x: self.pkg_source[x]
+                                                              for x in self.packages})
+                if self.selection:
+                    self.select_packages()
+                self.circular_deps = self.graph.get_cycles(self.analysis_cache)
+            if self.selection and not self.analysis_only:
+                # Packages loaded from analysis cache are fetched only when selected
+                self.fetch_packages({x for x in self.packages
+                                     if isinstance(self.pkg_source[x], CachedArchive)})
+        self.full_graph = nx.freeze(self.graph.G.copy())
+        self.publish()
         if self.circular_deps and not self.recipes:
             raise MissingRecipeException(
                 "Missing recipes to resolve circular dependencies in graph.")
 
+    def restore_graph(self):
+        '''
+        Creates graph of packages from build plan without analysis
+        '''
+        for pkg, info in self.build_plan['packages'].items():
+            self.graph.G.add_node(pkg)
+            for dep in info['requires']:
+                self.graph.G.add_edge(pkg, dep)
+
+    def select_packages(self):
+        '''
+        Reduces packages and graph to packages selected for partial
+        rebuild, packages of recipes including selected packages are
+        selected too. Packages outside the selection are expected to be
+        built already.
+        '''
+        selected = self.graph.select(**self.selection)
+        for recipe in self.recipes or []:
+            if recipe.packages & selected:
+                selected |= recipe.packages & self.packages
+        print("Selected {} of {} packages.".format(len(selected), len(self.packages)))
+        with self.lock:
+            self.graph.G = nx.DiGraph(self.graph.G.subgraph(selected))
+            self.graph.packages = selected
+            self.packages = selected
+            self.recipes = [x for x in self.recipes or [] if x.packages <= selected]
+
+    def ordered(self, pkgs):
+        '''
+        Returns packages sorted by priority from build plan, packages
+        many other packages wait for are built first
+        '''
+        return sorted(pkgs, key=lambda x: (-self.priorities.get(x, 0), x))
+
+    def subscribe(self, observer):
+        '''
+        Registers function called with each new BuildState, observers
+        are called from the scheduler thread and should return quickly
+        '''
+        self.observers.append(observer)
+
+    def unsubscribe(self, observer):
+        self.observers.remove(observer)
+
+    def publish(self, changed=None):
+        '''
+        Replaces self.state by new BuildState with states of changed
+        packages updated (all packages when changed is None) and
+        notifies observers. Other threads read self.state without
+        locking, published states are never modified.
+        '''
+        with self.lock:
+            previous = self.state
+            if changed is None:
+                states = PackageStates({pkg: self.package_state(pkg) for pkg in self.packages})
+                counts = dict(Counter(states.values()))
+            else:
+                counts = dict(previous.counts)
+                changes = {}
+                for pkg in set(changed) & self.packages:
+                    if pkg in previous.states:
+                        counts[previous.states[pkg]] -= 1
+                    changes[pkg] = self.package_state(pkg)
+                    counts[changes[pkg]] = counts.get(changes[pkg], 0) + 1
+                states = previous.states.updated(changes)
+            self.state = BuildState(previous.version + 1, self.full_graph,
+                                    states, MappingProxyType(counts))
+        # Number of ready packages is computed from the whole graph, metrics
+        # are updated at most once per METRICS_INTERVAL and after the last build
+        if time.time() - self.metrics_updated >= METRICS_INTERVAL or \
+                not (counts.get('pending') or counts.get('in_flight')):
+            self.metrics_updated = time.time()
+            self.update_metrics()
+        for observer in list(self.observers):
+            try:
+                observer(self.state)
+            except Exception:
+                logger.error("Observer {} failed.".format(observer), exc_info=True)
+
+    def update_metrics(self):
+        '''
+        Publishes number of packages in each scheduling state
+        and number of occupied build slots
+        '''
+        counts = self.state.counts
+        ready = len(set(self.graph.get_leaf_nodes() or []) & self.packages -
+                    self.built_packages - self.in_flight - self.failed_packages)
+        metrics.set_package_states(
+            self.metrics_labels,
+            pending=counts.get('pending', 0) - ready,
+            ready=ready,
+            in_flight=counts.get('in_flight', 0),
+            succeeded=counts.get('succeeded', 0),
+            failed=counts.get('failed', 0),
+            blocked=counts.get('blocked', 0))
+        metrics.set('rebuild_build_slots_in_use', len(self.in_flight), **self.metrics_labels)
+
+    def isolate_failure(self, pkgs):
+        '''
+        Marks packages as failed and all packages depending on them
+        as blocked, building of other packages continues
+        '''
+        changed = set(pkgs)
+        with self.lock:
+            for pkg in pkgs:
+                logger.error("Failed to build package {}.".format(pkg))
+                self.failed_packages.add(pkg)
+                self.blocked_packages.pop(pkg, None)
+                if pkg not in self.graph.G:
+                    continue
+                for dependent in nx.ancestors(self.graph.G, pkg):
+                    if dependent not in self.failed_packages | self.built_packages:
+                        self.blocked_packages.setdefault(dependent, pkg)
+                        changed.add(dependent)
+            # recipes of failed and blocked packages can't be built
+            for pkg in changed:
+                if pkg in self.recipe_index:
+                    self.remove_recipe(self.recipe_index[pkg])
+        self.publish(changed)
+
+    def mark_built(self, pkg, remove_node=True):
+        '''
+        Adds package to built packages and removes it from graph
+        '''
+        with self.lock:
+            if remove_node:
+                self.graph.G.remove_node(pkg)
+            self.built_packages.add(pkg)
+            if self.recipe_missing is not None:
+                for recipe in self.recipes_waiting.pop(pkg, []):
+                    self.recipe_missing[recipe] -= 1
+                    if not self.recipe_missing[recipe]:
+                        self.ready_recipes.append(recipe)
+        self.publish([pkg])
+
+    def set_in_flight(self, pkgs):
+        '''
+        Replaces set of packages currently being built
+        '''
+        with self.lock:
+            changed = self.in_flight ^ set(pkgs)
+            self.in_flight = set(pkgs)
+        self.publish(changed)
+
+    def package_state(self, pkg):
+        if pkg in self.in_flight:
+            return 'in_flight'
+        if pkg in self.built_packages:
+            return 'succeeded'
+        if pkg in self.failed_packages:
+            return 'failed'
+        if pkg in self.blocked_packages:
+            return 'blocked'
+        return 'pending'
+
+    @property
+    def unfinished_packages(self):
+        '''
+        Packages which were not built and are not failed or blocked
+        '''
+        return self.packages - self.built_packages - self.failed_packages - \
+            set(self.blocked_packages)
+
+    def failure_report(self):
+        '''
+        Returns text report of failed and blocked packages
+        '''
+        lines = ['Failed packages:']
+        lines += ['    {}'.format(pkg) for pkg in sorted(self.failed_packages)]
+        lines.append('Packages not built because of failed dependency:')
+        lines += ['    {} (blocked by {})'.format(pkg, failed)
+                  for pkg, failed in sorted(self.blocked_packages.items())]
+        return '\n'.join(lines)
+
     def deps_satisfied(self, package):
         '''
         Compares package deps with self.build_packages to
@@ -103,20 +513,54 @@ class Builder(metaclass=ABCMeta):
             return True
         return False
 
-    def recipe_deps_satisfied(self, recipe):
+    def recipe_deps_satisfied(self, recipe, built_packages=None):
         '''
         Checks if all packages in recipe have satisfied their
-        dependencies on packages that are not in recipe
+        dependencies on packages that are not in recipe,
+        built_packages defaults to self.built_packages
         '''
-        deps = set()
-        for pkg in recipe.packages:
-            if not pkg in self.packages:
-                raise KeyError("Package {} from recipe missing in packages list".format(pkg))
-            deps |= set(self.graph.G.successors(pkg))
+        if built_packages is None:
+            built_packages = self.built_packages
+        return self.recipe_requires(recipe) <= built_packages
 
-        if (deps - recipe.packages) <= self.built_packages:
-            return True
-        return False
+    def speculative_candidates(self, built_packages=None):
+        '''
+        Returns packages which can be built speculatively before all their
+        dependencies are built, packages allowed by speculative_packages or
+        by successful builds in history whose hard_requires are built,
+        built_packages defaults to self.built_packages. Nothing is built
+        speculatively without hard_requires.
+        '''
+        if not self.speculative or not self.hard_requires:
+            return []
+        if built_packages is None:
+            built_packages = self.built_packages
+        with self.lock:
+            if self.speculative_allowed is None:
+                self.speculative_allowed = set(self.speculative_packages)
+                if self.speculative_history:
+                    self.speculative_allowed |= self.history.reliable(self.speculative_history)
+            candidates = []
+            for pkg in (self.speculative_allowed & self.unfinished_packages) - \
+                    self.speculatively_failed - self.in_flight - set(self.recipe_index):
+                if pkg not in self.graph.G:
+                    continue
+                deps = set(self.graph.G.successors(pkg))
+                if deps and deps & self.hard_requires <= built_packages and \
+                        not deps <= built_packages:
+                    candidates.append(pkg)
+        return self.ordered(candidates)
+
+    def speculation_failed(self, pkgs):
+        '''
+        Speculatively built packages failed, they wait for all
+        their dependencies now
+        '''
+        with self.lock:
+            self.speculatively_failed |= set(pkgs)
+        for pkg in pkgs:
+            print("Speculative build of {} failed, waiting for its dependencies.".format(pkg))
+        metrics.inc('rebuild_speculative_failures_total', len(pkgs))
 
     @check_build
     def build(self, pkgs, verbose=True):
@@ -125,6 +569,7 @@ class Builder(metaclass=ABCMeta):
                 print("Building {0}...".format(pkg))
         return True
 
+    @metrics.timed('build')
     def run_building(self):
         '''
         First builds all packages without deps, then iterates over num_of_deps
@@ -133,30 +578,39 @@ class Builder(metaclass=ABCMeta):
 
         # Build and add metapackage to chroots when rebuilding scl
         if hasattr(self, 'metapackage'):
-            self.build([self.metapackage])
+            if not self.build([self.metapackage]):
+                raise BuildFailureException(
+                    "Failed to build metapackage {}.".format(self.metapackage))
             self.add_chroot_pkg([self.metapackage])
 
-        while self.packages > self.built_packages:
-            zero_deps = self.graph.get_leaf_nodes()
-            if zero_deps:
-                self.build(zero_deps)
-            else:
-                for recipe in self.recipes:
-                    if list(self.packages - self.built_packages)[1] in recipe.packages and\
-                            self.recipe_deps_satisfied(recipe):
-                        self.build_following_recipe(recipe)
-                        break
+        while self.packages - self.failed_packages - set(self.blocked_packages) > \
+                self.built_packages:
+            zero_deps = self.ordered(x for x in self.graph.get_leaf_nodes() or []
+                                     if x not in self.failed_packages)
+            speculative = [x for x in self.speculative_candidates() if x not in zero_deps]
+            if zero_deps or speculative:
+                if speculative:
+                    print("Building {} speculatively.".format(speculative))
+                    metrics.inc('rebuild_speculative_builds_total', len(speculative))
+                    self.build(zero_deps + speculative, speculative=speculative)
                 else:
+                    self.build(zero_deps)
+            else:
+                recipe = self.next_recipe()
+                if recipe is None:
                     sys.stderr.write("Recipe to resolve circular dependencies not found.\n")
                     raise SystemExit(1)
+                self.build_following_recipe(recipe)
+
+        if self.failed_packages:
+            print(self.failure_report())
 
     def find_recipe(self, package):
         '''
-        Search for recipe including package in self.recipes
+        Returns recipe including package
         '''
-        for recipe in self.recipes:
-            if package in recipe.packages:
-                return recipe
+        if package in self.recipe_index:
+            return self.recipe_index[package]
         raise MissingRecipeException("Recipe for package {0} not found".format(package))
 
     def build_following_recipe(self, recipe):
@@ -174,20 +628,136 @@ class Builder(metaclass=ABCMeta):
                 utils.check_bootstrap_macro(self.pkg_source[name].full_path_spec, macro)
                 utils.edit_bootstrap(self.pkg_source[name].full_path_spec, macro, value)
                 self.pkg_source[name].pack()
-            self.build([step[0]], False)
-        for pkg in {step[0] for step in recipe.order}:
-            self.graph.G.remove_node(pkg)
-        self.recipes.remove(recipe)
+            if not self.build([step[0]], False):
+                # Following steps of the recipe depend on the failed one, packages
+                # built by previous steps may be built only with bootstrap macros
+                with self.lock:
+                    self.built_packages -= recipe.packages
+                self.isolate_failure(recipe.packages - self.failed_packages)
+                break
+        else:
+            with self.lock:
+                for pkg in {step[0] for step in recipe.order}:
+                    self.graph.G.remove_node(pkg)
+        self.remove_recipe(recipe)
+
+    def repo_snapshot(self):
+        '''
+        Returns key identifying packages source and snapshot of repo
+        the analysis is based on, None when revision of repo is unknown
+        '''
+        revision = repo_revision(self.repo)
+        if revision is None:
+            logger.info("Revision of repo {} not found, analysis cache disabled.".format(
+                self.repo))
+            return None
+        return json.dumps([type(self.pkg_source).__module__, self.repo, revision,
+                           self.prefix, self.koji_tag])
 
     def get_files(self):
         '''
-        Creates SrpmArchive object and downloads files for each package
+        Creates SrpmArchive object and downloads files for each package,
+        in analysis only mode packages found in analysis cache are not
+        downloaded. Packages already present in pkg_source shared with
+        other builders are not fetched again. Partial rebuild uses
+        analysis cache too, selected packages are fetched by get_relations.
+        '''
+        if self.build_plan:
+            self.restore_plan()
+            return
+        if self.fetch_coordinator and not self.shared_dir:
+            raise IncompleteMetadataException(
+                "Shared directory accessible by fetch workers has to be specified.")
+        packages = {x for x in self.packages if x not in self.pkg_source}
+        # Only analysis and partial rebuild use the cache, other runs fetch all
+        # packages and don't need revision of the repo
+        if self.analysis_only or self.selection:
+            self.repo_key = self.repo_snapshot()
+        # Partial rebuild fetches only selected packages after analysis
+        if self.repo_key:
+            cached = self.analysis_cache.load(self.repo_key, packages)
+            for package, (srpm_file, rpms, dependencies) in cached.items():
+                self.pkg_source[package] = CachedArchive(package, srpm_file, rpms, dependencies)
+            packages -= set(cached)
+            if cached:
+                print("Analysis of {} packages loaded from cache.".format(len(cached)))
+        self.fetch_packages(packages)
+
+    def fetch_packages(self, packages):
+        '''
+        Downloads files of packages and adds them to pkg_source
         '''
-        with utils.ChangeDir(self.path):
-            for package in self.packages:
-                pkg_dir = self.path + package + "_files/"
+        if self.fetch_coordinator:
+            # Fetch workers need package directories on storage shared with them
+            files_dir = os.path.join(os.path.abspath(self.shared_dir), '')
+        else:
+            files_dir = self.path
+        pkg_dirs = {package: files_dir + package + "_files/" for package in packages}
+        with utils.ChangeDir(self.path), metrics.phase('fetch'):
+            for pkg_dir in pkg_dirs.values():
                 if not os.path.exists(pkg_dir):
                     os.mkdir(pkg_dir)
+            if self.fetch_coordinator:
+                self.fetch_remote(pkg_dirs)
+                return
+            if hasattr(self.pkg_source, 'prefetch'):
+                self.pkg_source.prefetch(pkg_dirs, self.koji_tag, self.koji_hub, self.koji_topurl,
+                                         repo=self.repo)
+            for package, pkg_dir in pkg_dirs.items():
                 print("Getting files of {0}.".format(package))
-                logger.debug("Getting files of {0}.".format(package))
+                logger.debug("Getting files of %s.", package, extra={'package': package})
+                start = time.time()
                 self.pkg_source.add(package, pkg_dir, self.repo, self.prefix, self.koji_tag)
+                metrics.inc('rebuild_fetch_seconds_total', time.time() - start)
+                metrics.inc('rebuild_fetched_packages_total')
+                metrics.inc('rebuild_fetched_bytes_total',
+                            os.path.getsize(self.pkg_source[package].full_path_srpm))
+
+    def restore_plan(self):
+        '''
+        Restores packages from files of build plan, files of packages
+        edited by recipes are copied to keep the plan unchanged
+        '''
+        for attr in ['repo', 'prefix', 'koji_tag']:
+            if self.build_plan[attr] != getattr(self, attr):
+                raise BuildPlanException("Build plan was made for {} {}, not {}.".format(
+                    attr, self.build_plan[attr], getattr(self, attr)))
+        recipe_packages = {step[0] for recipe in self.build_plan['recipes']
+                           for step in recipe['steps']}
+        for pkg, info in sorted(self.build_plan['packages'].items()):
+            state = dict(info['state'])
+            if pkg in recipe_packages:
+                pkg_dir = self.path + pkg + "_files/"
+                shutil.copytree(state['pkg_dir'], pkg_dir)
+                state['pkg_dir'] = pkg_dir
+            self.pkg_source.restore(pkg, state['pkg_dir'], self.repo, self.prefix,
+                                    self.koji_tag, state)
+        print("{} packages loaded from build plan.".format(len(self.packages)))
+
+    def fetch_remote(self, pkg_dirs):
+        '''
+        Sends packages to fetch workers connected to fetch coordinator,
+        archives are restored from states sent back by the workers
+        '''
+        if not pkg_dirs:
+            return
+        from rebuild_tool import distributed
+        coordinator = distributed.Coordinator(
+            self.fetch_coordinator,
+            self.fetch_connect_timeout or distributed.DEFAULT_CONNECT_TIMEOUT,
+            self.fetch_idle_timeout or distributed.DEFAULT_IDLE_TIMEOUT)
+        print("Waiting for fetch workers on {}.".format(coordinator.address))
+        jobs = [{'type': 'fetch', 'id': number, 'package': package, 'pkg_dir': pkg_dir,
+                 'packages_source': self.packages_source, 'repo': self.repo,
+                 'prefix': self.prefix, 'koji_tag': self.koji_tag}
+                for number, (package, pkg_dir) in enumerate(sorted(pkg_dirs.items()))]
+        try:
+            results = coordinator.fetch(jobs)
+        finally:
+            coordinator.stop()
+        for job, result in zip(jobs, results):
+            self.pkg_source.restore(job['package'], job['pkg_dir'], self.repo, self.prefix,
+                                    self.koji_tag, result['state'])
+            metrics.inc('rebuild_fetched_packages_total')
+            metrics.inc('rebuild_fetched_bytes_total',
+                        os.path.getsize(self.pkg_source[job['package']].full_path_srpm))
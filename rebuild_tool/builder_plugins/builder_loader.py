@@ -1,6 +1,6 @@
 import importlib
 
-available_builder_plugins = ['copr', 'printer']
+available_builder_plugins = ['copr', 'local', 'mock', 'printer']
 
 
 def load_plugin(name):
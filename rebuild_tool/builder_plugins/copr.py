@@ -1,13 +1,44 @@
+import os
 import time
 import pprint
+import tempfile
 import logging
-from copr.client import CoprClient
+from functools import wraps
+
+import networkx as nx
 
 from rebuild_tool import builder
-from rebuild_tool.exceptions import IncompleteMetadataException
+from rebuild_tool.exceptions import (IncompleteMetadataException, BuildFailureException,
+                                     BuildSystemException)
+from rebuild_tool.metrics import registry as metrics
+from rebuild_tool.slots import HostSlotPool
 
 logger = logging.getLogger(__name__)
 
+FINAL_STATES = ["skipped", "failed", "succeeded"]
+
+CHROOT_SCHEDULING_MODES = ['together', 'independent']
+
+# Build slots shared by all rebuild_tool processes of the host
+DEFAULT_SLOTS_FILE = os.path.join(tempfile.gettempdir(), 'rebuild_tool_copr_slots.json')
+
+def host_slots(rebuild_metadata):
+    '''
+    Returns HostSlotPool of copr_slots, None without them, raises
+    BuildSystemException when the file of the pool can't be used
+    '''
+    if not rebuild_metadata.get('copr_slots'):
+        return None
+    path = rebuild_metadata.get('copr_slots_file', DEFAULT_SLOTS_FILE)
+    try:
+        slots = HostSlotPool(path, rebuild_metadata['copr_slots'],
+                             rebuild_metadata.get('copr_slots_weight', 1))
+        with slots.state():
+            pass
+    except OSError as e:
+        raise BuildSystemException("Failed to use build slots file {}: {}".format(path, e))
+    return slots
+
 def check_metadata(rebuild_metadata):
     '''
     Checks if rebuild_metadata dictionary has all necesary
@@ -17,6 +48,61 @@ def check_metadata(rebuild_metadata):
         if attr not in rebuild_metadata:
             raise IncompleteMetadataException(
                 "Missing Rebuild file attribute: {} necessary for Copr builds.".format(attr))
+    if rebuild_metadata.get('chroot_scheduling', 'together') not in CHROOT_SCHEDULING_MODES:
+        raise IncompleteMetadataException(
+            "Rebuild file attribute chroot_scheduling has to be one of {}.".format(
+                CHROOT_SCHEDULING_MODES))
+    if rebuild_metadata.get('copr_shards', 1) < 1:
+        raise IncompleteMetadataException("Rebuild file attribute copr_shards has to be positive.")
+
+
+def shard_projects(project, shards):
+    '''
+    Returns names of Copr projects of shards, the first one is project
+    '''
+    return [project] + ['{}-shard{}'.format(project, x) for x in range(1, shards)]
+
+
+def assign_shards(G, projects):
+    '''
+    Splits graph G to weakly connected components, which don't depend
+    on each other, and assigns them to projects, the biggest components
+    first, each to the project with the fewest packages, returns
+    dictionary package: project
+    '''
+    sizes = [0] * len(projects)
+    shard_of = {}
+    for component in sorted(nx.weakly_connected_components(G),
+                            key=lambda x: (-len(x), min(x))):
+        index = sizes.index(min(sizes))
+        sizes[index] += len(component)
+        for pkg in component:
+            shard_of[pkg] = projects[index]
+    return shard_of
+
+
+class CoprApi(object):
+    '''
+    Wraps CoprClient, exceptions of copr are converted to
+    BuildSystemException so that copr is imported only by this plugin
+    '''
+    def __init__(self, client):
+        from copr.exceptions import CoprException
+        self.client = client
+        self.errors = CoprException
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def call(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except self.errors as e:
+                raise BuildSystemException("Copr request {} failed: {}".format(name, e))
+        return call
 
 
 class RealBuilder(builder.Builder):
@@ -24,18 +110,41 @@ class RealBuilder(builder.Builder):
     Contains methods to rebuild packages in Copr
     '''
     def __init__(self, rebuild_metadata, pkg_source):
-        super(self.__class__, self).__init__(rebuild_metadata, pkg_source)
-        self.cl = CoprClient.create_from_file_config()
+        # file of shared build slots is checked before packages are fetched
+        slots = host_slots(rebuild_metadata)
+        super(RealBuilder, self).__init__(rebuild_metadata, pkg_source)
+        if slots is not None:
+            self.slots = slots
+        self.cl = self.connect(rebuild_metadata)
         check_metadata(rebuild_metadata)
         self.project = rebuild_metadata['copr_project']
         self.chroots = rebuild_metadata['chroots']
-        if self.project_is_new():
-            self.cl.create_project(self.project, self.chroots)
-        
+        self.chroot_scheduling = rebuild_metadata.get('chroot_scheduling', 'together')
+        self.projects = shard_projects(self.project, rebuild_metadata.get('copr_shards', 1))
+        self.shard_of = {}  # package: project it is built in
+        for project in self.projects:
+            repos = self.shard_repos(project)
+            if self.project_is_new(project):
+                # copr client wraps list of chroots into another list
+                self.cl.create_project(project, tuple(self.chroots), repos=repos or None)
+            elif repos:
+                self.cl.modify_project(project, repos=' '.join(repos))
+
         if 'chroot_pkgs' in rebuild_metadata:
             self.add_chroot_pkg(rebuild_metadata['chroot_pkgs'])
 
 
+    def connect(self, rebuild_metadata):
+        '''
+        Returns client of Copr API configured in ~/.config/copr
+        '''
+        from copr.client import CoprClient
+        from copr.exceptions import CoprNoConfException
+        try:
+            return CoprApi(CoprClient.create_from_file_config())
+        except CoprNoConfException:
+            raise BuildSystemException("Copr config file ~/.config/copr is missing.")
+
     def add_chroot_pkg(self, chroot_pkgs):
         '''
         Method to add packages to minimal buildroot
@@ -43,50 +152,243 @@ class RealBuilder(builder.Builder):
         if not isinstance(chroot_pkgs, list):
             chroot_pkgs = [chroot_pkgs]
 
-        for chroot in self.chroots:
-            self.cl.modify_project_chroot_details(self.project, chroot, pkgs=chroot_pkgs)
+        for project in self.projects:
+            for chroot in self.chroots:
+                self.cl.modify_project_chroot_details(project, chroot, pkgs=chroot_pkgs)
 
-    def project_is_new(self):
+    def project_is_new(self, project=None):
         '''
-        Checks if project already exists in Copr
+        Checks if project, self.project by default, already exists in Copr
         '''
         result = self.cl.get_projects_list().projects_list
         for proj in result:
-            if proj.projectname == self.project:
+            if proj.projectname == (project or self.project):
                 return False
         return True
 
+    def shard_repos(self, project):
+        '''
+        Returns repos of the other shards, packages built in any shard
+        are available in buildroots of all of them
+        '''
+        return ['copr://{}/{}'.format(self.cl.username, x) for x in self.projects
+                if x != project]
+
+    def shard_report(self):
+        '''
+        Returns text report of packages of each shard project
+        '''
+        lines = ['Copr projects:']
+        for project in self.projects:
+            packages = {pkg for pkg, x in self.shard_of.items() if x == project}
+            lines.append('    {}/{}: {} packages, {} built, {} failed, {} blocked'.format(
+                self.cl.username, project, len(packages), len(packages & self.built_packages),
+                len(packages & self.failed_packages),
+                len(packages & set(self.blocked_packages))))
+        return '\n'.join(lines)
+
+    def submit(self, pkg, chroots):
+        '''
+        Submits build of package to chroots, returns list of BuildWrappers
+        '''
+        result = self.cl.create_new_build(self.shard_of.get(pkg, self.project),
+                                          pkgs=[self.pkg_source[pkg].full_path_srpm],
+                                          chroots=chroots)
+        for bw in result.builds_list:
+            logger.info("Build %s of %s submitted to %s.", bw.build_id, pkg, chroots,
+                        extra={'package': pkg, 'build_id': bw.build_id})
+        return result.builds_list
+
+    def poll(self, bw):
+        '''
+        Returns build details when build is finished, None otherwise
+        '''
+        start = time.time()
+        details = self.cl.get_build_details(bw.build_id)
+        metrics.observe('rebuild_copr_poll_seconds', time.time() - start)
+        if details.status in FINAL_STATES:
+            return details
+        return None
+
     @builder.check_build
     def build(self, pkgs, verbose=True):
         '''
         Building package using copr api, periodicaly checking
         build status while build is not finished
         '''
-        srpms = [self.pkg_source[x].full_path_srpm for x in pkgs]
-        results = []
-
         if verbose:
             print("Building {}".format(pkgs))
         
-        for pkg in srpms:
-            results.append(self.cl.create_new_build(self.project, pkgs=[pkg],
-                                                       chroots=self.chroots))
-        watched = []
-        for result in results:
-            watched += result.builds_list
-
-        watched = set(watched)
+        watched = {}
+        for pkg in pkgs:
+            for bw in self.submit(pkg, self.chroots):
+                watched[bw] = pkg
+
         done = {}
 
-        while watched != set(done.keys()):
-            for bw in watched - set(done.keys()):
-                status = bw.handle.get_build_details().status
-                if status in ["skipped", "failed", "succeeded"]:
-                    done[bw] = status
+        while set(watched) != set(done.keys()):
+            for bw in set(watched) - set(done.keys()):
+                details = self.poll(bw)
+                if details:
+                    done[bw] = details
             time.sleep(1)
 
-        logger.debug(done)
-        for status in done.values():
-            if status != 'succeeded':
-                return False
-        return True
+        logger.debug("Finished builds: %s",
+                     {bw.build_id: details.status for bw, details in done.items()})
+        failed = set()
+        for bw, details in done.items():
+            self.record_history(watched[bw], bw.build_id, details)
+            if details.status != 'succeeded':
+                failed.add(watched[bw])
+        return failed
+
+    def record_history(self, package, build_id, details, chroots=None):
+        '''
+        Stores times and status of finished build in each chroot
+        to build history
+        '''
+        chroots = details.data.get('chroots') or {x: details.status for x in chroots or self.chroots}
+        for chroot, status in chroots.items():
+            self.history.record(package, chroot, status, details.data.get('submitted_on'),
+                                details.data.get('started_on'), details.data.get('ended_on'),
+                                'copr', build_id)
+
+    def run_building(self):
+        '''
+        Builds packages in all chroots together or, with chroot_scheduling
+        independent, tracks progress of each chroot separately
+        '''
+        if len(self.projects) > 1:
+            self.shard_of = assign_shards(self.graph.G, self.projects)
+        if self.chroot_scheduling == 'independent':
+            self.run_building_per_chroot()
+        else:
+            super(RealBuilder, self).run_building()
+        if len(self.projects) > 1:
+            print(self.shard_report())
+
+    @metrics.timed('build')
+    def run_building_per_chroot(self):
+        '''
+        Each chroot has its own set of built packages, a package is submitted
+        to a chroot as soon as its dependencies are built in that chroot.
+        Recipes are synchronization points, recipe is built in all chroots
+        at once when its dependencies are built in every chroot.
+        '''
+        if hasattr(self, 'metapackage'):
+            if not self.build([self.metapackage]):
+                raise BuildFailureException(
+                    "Failed to build metapackage {}.".format(self.metapackage))
+            self.add_chroot_pkg([self.metapackage])
+
+        built = {chroot: set(self.built_packages) for chroot in self.chroots}
+        attempts = {}  # (package, chroot): number of failed builds
+        retry_at = {}  # (package, chroot): time of next attempt
+        watched = {}  # BuildWrapper: (package, chroot)
+        speculating = set()  # (package, chroot) submitted before its dependencies were built
+        holding = set()  # packages holding a build slot, one slot covers all chroots
+        recipe_packages = set()
+        for recipe in self.recipes or []:
+            recipe_packages |= recipe.packages
+
+        def release_slots():
+            idle = holding - {pkg for (pkg, chroot) in watched.values()}
+            if idle:
+                holding.difference_update(idle)
+                self.slots.release(len(idle))
+
+        try:
+            while self.unfinished_packages:
+                retry_at = {key: value for key, value in retry_at.items()
+                            if key[0] in self.unfinished_packages}
+                in_flight = set(watched.values())
+                waiting_for_slot = False
+                # recipe takes build slots blocking, no package is submitted until
+                # builds holding slots of this builder finish and the recipe starts
+                recipe_ready = self.recipe_ready()
+                for chroot in self.chroots if not recipe_ready else []:
+                    speculative = set(self.speculative_candidates(built[chroot]))
+                    candidates = self.unfinished_packages - built[chroot] - recipe_packages
+                    for pkg in self.ordered(candidates):
+                        if (pkg, chroot) not in in_flight and \
+                                retry_at.get((pkg, chroot), 0) <= time.time() and \
+                                (set(self.graph.G.successors(pkg)) <= built[chroot] or
+                                 pkg in speculative):
+                            if pkg not in holding:
+                                if not self.slots.acquire(blocking=False):
+                                    # all build slots are taken by builders of other Rebuild files
+                                    waiting_for_slot = True
+                                    continue
+                                holding.add(pkg)
+                            if pkg in speculative:
+                                print("Building {} in {} speculatively".format(pkg, chroot))
+                                metrics.inc('rebuild_speculative_builds_total')
+                                speculating.add((pkg, chroot))
+                            else:
+                                print("Building {} in {}".format(pkg, chroot))
+                            retry_at.pop((pkg, chroot), None)
+                            try:
+                                for bw in self.submit(pkg, [chroot]):
+                                    watched[bw] = (pkg, chroot)
+                            finally:
+                                release_slots()
+                self.set_in_flight({pkg for (pkg, chroot) in watched.values()})
+
+                # packages are marked built when they are built in all chroots
+                recipe_built = False
+                recipe = self.next_recipe() if not watched else None
+                while recipe is not None:
+                    self.build_following_recipe(recipe)
+                    recipe_packages -= recipe.packages
+                    for chroot in self.chroots:
+                        built[chroot] |= recipe.packages & self.built_packages
+                    recipe_built = True
+                    recipe = self.next_recipe()
+
+                if not watched:
+                    if recipe_built:
+                        continue
+                    if waiting_for_slot:
+                        time.sleep(1)
+                        continue
+                    if retry_at:
+                        time.sleep(max(0, min(retry_at.values()) - time.time()))
+                        continue
+                    raise BuildFailureException(
+                        "Packages {} can't be built, recipe to resolve circular dependencies "
+                        "not found.".format(self.unfinished_packages))
+
+                time.sleep(1)
+                for bw in list(watched):
+                    details = self.poll(bw)
+                    if not details:
+                        continue
+                    (pkg, chroot) = watched.pop(bw)
+                    self.record_history(pkg, bw.build_id, details, [chroot])
+                    if (pkg, chroot) in speculating:
+                        speculating.remove((pkg, chroot))
+                        if details.status != 'succeeded':
+                            self.speculation_failed([pkg])
+                            continue
+                    if details.status != 'succeeded':
+                        attempts[(pkg, chroot)] = attempts.get((pkg, chroot), 0) + 1
+                        if attempts[(pkg, chroot)] <= self.retries:
+                            delay = self.retry_backoff * 2 ** (attempts[(pkg, chroot)] - 1)
+                            print("Retrying build of {} in {} in {} s.".format(pkg, chroot, delay))
+                            retry_at[(pkg, chroot)] = time.time() + delay
+                        else:
+                            logger.error("Failed to build package {} in {}.".format(pkg, chroot))
+                            self.isolate_failure([pkg])
+                        continue
+                    built[chroot].add(pkg)
+                    if all(pkg in built[x] for x in self.chroots):
+                        self.mark_built(pkg)
+                self.set_in_flight({pkg for (pkg, chroot) in watched.values()})
+                release_slots()
+        finally:
+            # slots of builds still running when the build failed
+            watched.clear()
+            release_slots()
+
+        if self.failed_packages:
+            print(self.failure_report())
@@ -0,0 +1,211 @@
+import os
+import time
+import random
+import logging
+import threading
+
+from rebuild_tool.builder_plugins import copr
+
+logger = logging.getLogger(__name__)
+
+
+def package_name(srpm):
+    '''
+    Returns name of package from srpm file name
+    name-version-release.src.rpm  >>  name
+    '''
+    return os.path.basename(srpm).rsplit('-', 2)[0]
+
+
+class SimulatedBuild(object):
+    '''
+    Build of one srpm in simulated build system
+    '''
+    def __init__(self, build_id, srpm, chroots, submitted, duration, outcome):
+        self.build_id = build_id
+        self.srpm = srpm
+        self.package = package_name(srpm)
+        self.chroots = chroots
+        self.submitted = submitted
+        self.started = None
+        self.ended = None
+        self.duration = duration
+        self.outcome = outcome  # chroot: final status
+
+    @property
+    def status(self):
+        if self.ended is not None:
+            if all(x == 'succeeded' for x in self.outcome.values()):
+                return 'succeeded'
+            return 'failed'
+        if self.started is not None:
+            return 'running'
+        return 'pending'
+
+
+class BuildService(object):
+    '''
+    Simulates build system, build waits in queue queue_latency seconds,
+    then runs build_latency seconds once one of workers is free.
+    Build fails in each chroot with probability failure_rate, builds
+    of fail_packages always fail. build_latency can be a number
+    or [min, max] range.
+    '''
+    def __init__(self, workers=None, queue_latency=0, build_latency=1, failure_rate=0,
+                 fail_packages=None, seed=None, clock=time.time):
+        self.workers = workers
+        self.queue_latency = queue_latency
+        self.build_latency = build_latency
+        self.failure_rate = failure_rate
+        self.fail_packages = set(fail_packages or [])
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.builds = {}
+        self.queue = []
+        self.running = set()
+        self.updated = None
+        self.lock = threading.Lock()
+
+    def submit(self, srpm, chroots):
+        '''
+        Queues build of srpm in chroots, returns id of the build
+        '''
+        with self.lock:
+            build_id = len(self.builds) + 1
+            if isinstance(self.build_latency, (list, tuple)):
+                duration = self.random.uniform(*self.build_latency)
+            else:
+                duration = self.build_latency
+            outcome = {}
+            for chroot in chroots:
+                if package_name(srpm) in self.fail_packages or \
+                        self.random.random() < self.failure_rate:
+                    outcome[chroot] = 'failed'
+                else:
+                    outcome[chroot] = 'succeeded'
+            build = SimulatedBuild(build_id, srpm, list(chroots), self.clock(), duration, outcome)
+            self.builds[build_id] = build
+            self.queue.append(build)
+            self.updated = None
+        logger.debug("Build %s of %s submitted.", build_id, srpm, extra={'build_id': build_id})
+        return build_id
+
+    def update(self):
+        '''
+        Finishes builds which ran long enough and starts queued builds
+        on free workers
+        '''
+        now = self.clock()
+        if now == self.updated:
+            return
+        self.updated = now
+        for build in list(self.running):
+            if build.started + build.duration <= now:
+                build.ended = build.started + build.duration
+                self.running.remove(build)
+        while self.queue and (self.workers is None or len(self.running) < self.workers):
+            if self.queue[0].submitted + self.queue_latency > now:
+                break
+            build = self.queue.pop(0)
+            build.started = now
+            self.running.add(build)
+            if build.duration <= 0:
+                build.ended = now
+                self.running.remove(build)
+
+    def details(self, build_id):
+        '''
+        Returns dictionary of build data in format of Copr API
+        '''
+        with self.lock:
+            self.update()
+            build = self.builds[build_id]
+            if build.ended is not None:
+                chroots = dict(build.outcome)
+            else:
+                chroots = {chroot: build.status for chroot in build.chroots}
+            return {'status': build.status,
+                    'chroots': chroots,
+                    'src_pkg': build.srpm,
+                    'submitted_on': build.submitted,
+                    'started_on': build.started,
+                    'ended_on': build.ended}
+
+
+class Response(object):
+    '''
+    Response of LocalClient, provides data as attributes like CoprResponse
+    '''
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class LocalBuildHandle(object):
+    def __init__(self, client, build_id):
+        self.client = client
+        self.build_id = build_id
+
+    def get_build_details(self):
+        return self.client.get_build_details(self.build_id)
+
+
+class LocalClient(object):
+    '''
+    Implements part of CoprClient API used by Copr builder
+    on top of BuildService
+    '''
+    username = 'local'
+
+    def __init__(self, service):
+        self.service = service
+        self.projects = set()
+        self.repos = {}  # project: repos of its buildroot
+        self.build_projects = {}  # build_id: project
+
+    def create_new_build(self, projectname, pkgs, chroots=None):
+        build_id = self.service.submit(pkgs[0], chroots or [])
+        self.build_projects[build_id] = projectname
+        return Response(builds_list=[Response(build_id=build_id,
+                                              handle=LocalBuildHandle(self, build_id))])
+
+    def get_build_details(self, build_id):
+        data = self.service.details(build_id)
+        return Response(status=data['status'], data=data)
+
+    def get_projects_list(self):
+        return Response(projects_list=[Response(projectname=x) for x in self.projects])
+
+    def create_project(self, projectname, chroots, repos=None):
+        self.projects.add(projectname)
+        self.repos[projectname] = repos or []
+
+    def modify_project(self, projectname, repos=None):
+        self.repos[projectname] = repos.split() if repos else []
+
+    def modify_project_chroot_details(self, projectname, chrootname, pkgs=None):
+        logger.debug("Packages %s added to %s buildroot.", pkgs, chrootname)
+
+
+class RealBuilder(copr.RealBuilder):
+    '''
+    Copr builder running builds in simulated build system on local
+    machine, used to test scheduling without access to Copr
+    '''
+    def __init__(self, rebuild_metadata, pkg_source):
+        rebuild_metadata = dict(rebuild_metadata)
+        rebuild_metadata.setdefault('copr_project', 'local')
+        rebuild_metadata.setdefault('chroots', ['local'])
+        super(RealBuilder, self).__init__(rebuild_metadata, pkg_source)
+
+    def connect(self, rebuild_metadata):
+        '''
+        Returns LocalClient of simulated build system configured
+        by local_* Rebuild file attributes
+        '''
+        return LocalClient(BuildService(
+            workers=rebuild_metadata.get('local_workers'),
+            queue_latency=rebuild_metadata.get('local_queue_latency', 0),
+            build_latency=rebuild_metadata.get('local_build_latency', 1),
+            failure_rate=rebuild_metadata.get('local_failure_rate', 0),
+            fail_packages=rebuild_metadata.get('local_fail_packages'),
+            seed=rebuild_metadata.get('local_seed')))
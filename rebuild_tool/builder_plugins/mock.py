@@ -0,0 +1,153 @@
+import os
+import glob
+import time
+import queue
+import shutil
+import logging
+import threading
+from subprocess import TimeoutExpired
+from concurrent.futures import ThreadPoolExecutor
+
+from rebuild_tool import builder
+from rebuild_tool.utils import subprocess_popen_call, max_processes
+from rebuild_tool.exceptions import IncompleteMetadataException
+
+logger = logging.getLogger(__name__)
+
+MOCK_MODES = ['mock', 'rpmbuild']
+
+
+def check_metadata(rebuild_metadata):
+    '''
+    Checks if rebuild_metadata dictionary has all necesary
+    attributes for local builds
+    '''
+    mode = rebuild_metadata.get('mock_mode', 'mock')
+    if mode not in MOCK_MODES:
+        raise IncompleteMetadataException(
+            "Rebuild file attribute mock_mode has to be one of {}.".format(MOCK_MODES))
+    if mode == 'mock' and 'mock_config' not in rebuild_metadata:
+        raise IncompleteMetadataException(
+            "Missing Rebuild file attribute: mock_config necessary for mock builds.")
+
+
+class RealBuilder(builder.Builder):
+    '''
+    Rebuilds packages on local machine in a pool of mock roots,
+    or using rpmbuild in the rpmbuild mode. Built rpms are added
+    to local repository available in all roots.
+    '''
+    def __init__(self, rebuild_metadata, pkg_source):
+        super(RealBuilder, self).__init__(rebuild_metadata, pkg_source)
+        check_metadata(rebuild_metadata)
+        self.mode = rebuild_metadata.get('mock_mode', 'mock')
+        self.config = rebuild_metadata.get('mock_config')
+        self.roots = rebuild_metadata.get('mock_roots', max_processes)
+        self.timeout = rebuild_metadata.get('mock_timeout')
+        self.repo_dir = os.path.abspath(rebuild_metadata.get('mock_repo') or self.path + 'repo')
+        self.chroot_pkgs = []
+        self.free_roots = queue.Queue()
+        for root in range(self.roots):
+            self.free_roots.put(root)
+        self.repo_lock = threading.Lock()
+        os.makedirs(self.repo_dir, exist_ok=True)
+        self.refresh_repo()
+
+        if 'chroot_pkgs' in rebuild_metadata:
+            self.add_chroot_pkg(rebuild_metadata['chroot_pkgs'])
+
+    @property
+    def chroot(self):
+        '''
+        Name of chroot stored in build history
+        '''
+        return self.config if self.mode == 'mock' else 'rpmbuild'
+
+    def add_chroot_pkg(self, chroot_pkgs):
+        '''
+        Packages installed to buildroot of all following builds
+        '''
+        if not isinstance(chroot_pkgs, list):
+            chroot_pkgs = [chroot_pkgs]
+        self.chroot_pkgs += chroot_pkgs
+
+    def root_dir(self, root):
+        return '{}root{}/'.format(self.path, root)
+
+    def build_command(self, srpm, root):
+        '''
+        Returns command to rebuild srpm in root
+        '''
+        if self.mode == 'rpmbuild':
+            return ['rpmbuild', '--rebuild', '--define', '_topdir ' + self.root_dir(root), srpm]
+        command = ['mock', '-r', self.config,
+                   '--uniqueext=rebuild{}'.format(root),
+                   '--resultdir=' + self.root_dir(root),
+                   '--addrepo=file://' + self.repo_dir]
+        for pkg in self.chroot_pkgs:
+            command.append('--additional-package=' + pkg)
+        return command + ['--rebuild', srpm]
+
+    def built_rpms(self, root):
+        '''
+        Returns list of binary rpms built in root
+        '''
+        if self.mode == 'rpmbuild':
+            pattern = self.root_dir(root) + 'RPMS/*/*.rpm'
+        else:
+            pattern = self.root_dir(root) + '*.rpm'
+        return [x for x in glob.glob(pattern) if not x.endswith('.src.rpm')]
+
+    def refresh_repo(self):
+        '''
+        Regenerates metadata of local repository
+        '''
+        if self.mode != 'mock':
+            return
+        with self.repo_lock:
+            proc_data = subprocess_popen_call(['createrepo_c', '--update', self.repo_dir])
+        if proc_data['returncode']:
+            logger.error("Failed to update repository {}: {}".format(
+                self.repo_dir, proc_data['stderr']))
+
+    def build_package(self, pkg):
+        '''
+        Rebuilds srpm of package in the first free root, adds built rpms
+        to local repository, returns status of the build
+        '''
+        root = self.free_roots.get()
+        try:
+            shutil.rmtree(self.root_dir(root), ignore_errors=True)
+            os.makedirs(self.root_dir(root))
+            started = time.time()
+            try:
+                proc_data = subprocess_popen_call(
+                    self.build_command(self.pkg_source[pkg].full_path_srpm, root),
+                    timeout=self.timeout)
+                status = 'failed' if proc_data['returncode'] else 'succeeded'
+            except TimeoutExpired:
+                proc_data = {'stderr': 'Build timed out after {} s.'.format(self.timeout)}
+                status = 'failed'
+            finished = time.time()
+            if status == 'succeeded':
+                for rpm in self.built_rpms(root):
+                    shutil.copy(rpm, self.repo_dir)
+                self.refresh_repo()
+            else:
+                logger.error("Build of {} failed: {}".format(pkg, proc_data['stderr']))
+            self.history.record(pkg, self.chroot, status, started, started, finished, 'mock')
+            return status
+        finally:
+            self.free_roots.put(root)
+
+    @builder.check_build
+    def build(self, pkgs, verbose=True):
+        '''
+        Builds packages in parallel, each in one of roots
+        '''
+        if verbose:
+            print("Building {}".format(pkgs))
+        with ThreadPoolExecutor(min(self.roots, len(pkgs))) as executor:
+            statuses = dict(zip(pkgs, executor.map(self.build_package, pkgs)))
+        logger.debug(statuses)
+        return {pkg for pkg, status in statuses.items() if status != 'succeeded'}
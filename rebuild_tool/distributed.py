@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import queue
+import socket
+import logging
+import threading
+import socketserver
+
+import rebuild_tool.exceptions as ex
+from rebuild_tool.pkg_source_plugins import pkg_source_loader
+from rebuild_tool import utils
+
+logger = logging.getLogger(__name__)
+
+# Seconds the coordinator waits for the first worker and for any result
+DEFAULT_CONNECT_TIMEOUT = 300
+DEFAULT_IDLE_TIMEOUT = 1800
+
+# Messages are JSON objects, one per line:
+#   coordinator -> worker  {"type": "fetch", "id": 1, "package": ..., "pkg_dir": ...,
+#                           "packages_source": ..., "repo": ..., "prefix": ..., "koji_tag": ...}
+#                          {"type": "stop"}
+#   worker -> coordinator  {"id": 1, "package": ..., "state": {...}}
+#                          {"id": 1, "package": ..., "error": "..."}
+
+
+def parse_address(address):
+    '''
+    host:port  >>  (host, port)
+    '''
+    (host, port) = address.rsplit(':', 1)
+    return (host, int(port))
+
+
+def send(wfile, message):
+    wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+    wfile.flush()
+
+
+def receive(rfile):
+    '''
+    Returns next message, None when the connection was closed
+    '''
+    line = rfile.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+class Coordinator(object):
+    '''
+    Listens on address for fetch workers, sends each connected worker
+    one job at a time and collects states of fetched archives. Job of
+    a worker which disconnected is sent to another worker.
+    '''
+    def __init__(self, address, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.workers = 0
+        self.connected = False  # any worker connected
+        self.connect_timeout = connect_timeout
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                coordinator.serve(self.rfile, self.wfile, self.client_address)
+
+        self.server = socketserver.ThreadingTCPServer(parse_address(address), Handler)
+        self.server.daemon_threads = True
+        self.address = '{}:{}'.format(*self.server.server_address[:2])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def serve(self, rfile, wfile, client):
+        '''
+        Sends jobs to one worker until stop
+        '''
+        logger.info("Fetch worker {} connected.".format(client))
+        with self.lock:
+            self.workers += 1
+            self.connected = True
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    send(wfile, {'type': 'stop'})
+                    return
+                try:
+                    send(wfile, job)
+                    result = receive(rfile)
+                except OSError:
+                    result = None
+                if result is None:
+                    logger.warning("Fetch worker {} disconnected, {} sent to other worker.".format(
+                        client, job['package']))
+                    self.jobs.put(job)
+                    return
+                self.results.put(result)
+        finally:
+            with self.lock:
+                self.workers -= 1
+
+    def next_result(self, start):
+        '''
+        Waits for result of any job, raises DownloadFailException when no
+        worker connected in connect_timeout seconds from start, when all
+        workers disconnected or when no result came in idle_timeout seconds
+        '''
+        last_result = time.time()
+        while True:
+            try:
+                return self.results.get(timeout=1)
+            except queue.Empty:
+                pass
+            with self.lock:
+                (connected, workers) = (self.connected, self.workers)
+            if not connected and time.time() - start > self.connect_timeout:
+                raise ex.DownloadFailException("No fetch worker connected in {} s.".format(
+                    self.connect_timeout))
+            if connected and not workers:
+                raise ex.DownloadFailException(
+                    "All fetch workers disconnected before packages were fetched.")
+            if time.time() - last_result > self.idle_timeout:
+                raise ex.DownloadFailException("Fetch workers sent no result in {} s.".format(
+                    self.idle_timeout))
+
+    def fetch(self, jobs):
+        '''
+        Sends jobs to workers and returns their results in order of jobs,
+        raises DownloadFailException when any of the jobs failed or the
+        workers stopped working
+        '''
+        start = time.time()
+        for job in jobs:
+            self.jobs.put(job)
+        results = {}
+        while len(results) < len(jobs):
+            result = self.next_result(start)
+            results[result['id']] = result
+            print("Fetched {} ({}/{}).".format(result['package'], len(results), len(jobs)))
+        errors = ['{}: {}'.format(x['package'], x['error'])
+                  for x in results.values() if x.get('error')]
+        if errors:
+            raise ex.DownloadFailException("Fetch workers failed: {}".format('; '.join(errors)))
+        return [results[job['id']] for job in jobs]
+
+    def stop(self):
+        '''
+        Stops connected workers and the server
+        '''
+        with self.lock:
+            workers = self.workers
+        for worker in range(workers):
+            self.jobs.put(None)
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fetch_package(job, containers):
+    '''
+    Fetches package of job using packages source plugin, returns result
+    message with state of the archive or description of error
+    '''
+    result = {'id': job['id'], 'package': job['package']}
+    try:
+        if job['packages_source'] not in containers:
+            containers[job['packages_source']] = pkg_source_loader.load_plugin(
+                job['packages_source']).PkgsContainer()
+        container = containers[job['packages_source']]
+        os.makedirs(job['pkg_dir'], exist_ok=True)
+        with utils.ChangeDir(job['pkg_dir']):
+            container.add(job['package'], job['pkg_dir'], job['repo'], job['prefix'],
+                          job['koji_tag'])
+            result['state'] = container[job['package']].state()
+    except (Exception, ex.DownloadFailException, ex.UnknownRepoException,
+            ex.SrpmFormatException) as e:
+        logger.error("Failed to fetch {}:".format(job['package']), exc_info=True)
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    return result
+
+
+def run_worker(address):
+    '''
+    Connects to coordinator on address and fetches packages it sends
+    until the coordinator stops it
+    '''
+    containers = {}
+    with socket.create_connection(parse_address(address)) as sock:
+        rfile = sock.makefile('rb')
+        wfile = sock.makefile('wb')
+        while True:
+            job = receive(rfile)
+            if job is None or job['type'] == 'stop':
+                break
+            logger.info("Fetching {}.".format(job['package']))
+            send(wfile, fetch_package(job, containers))
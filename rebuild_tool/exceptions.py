@@ -18,3 +18,12 @@ class IncompleteMetadataException(BaseException):
 
 class UnknownPluginException(BaseException):
     pass
+
+class SrpmFormatException(BaseException):
+    pass
+
+class BuildSystemException(BaseException):
+    pass
+
+class BuildPlanException(BaseException):
+    pass
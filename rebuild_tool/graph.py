@@ -1,10 +1,12 @@
 import networkx as nx
-import matplotlib.pyplot as plt
 import itertools
+import hashlib
+import json
 import pprint
 import logging
 
 from rebuild_tool.utils import subprocess_popen_call
+from rebuild_tool import visual
 import rebuild_tool.exceptions as ex
 
 logger = logging.getLogger(__name__)
@@ -14,82 +16,146 @@ class PackageGraph(object):
     Class to make graph of packages, analyse dependancies and
     plan building order
     '''
-    def __init__(self, repo, pkg_source):
+    def __init__(self, repo, pkg_source, packages=None):
         self.repo = repo
-        self.rpms = set()
         self.pkg_source = pkg_source
+        self.packages = packages
         self.G = nx.DiGraph()
+        self.rpm_index = {}
 
     def make_graph(self):
         '''
         Process all the packages, finds theirs dependancies and makes
-        graph of relations
+        graph of relations, only packages are included when pkg_source
+        is shared with other graphs
         '''
-        for package in self.pkg_source.values():
-            self.rpms |= package.rpms
-
-        for package in self.pkg_source.keys():
+        if self.packages is None:
+            packages = list(self.pkg_source.keys())
+        else:
+            packages = [x for x in self.pkg_source.keys() if x in self.packages]
+        self.rpm_index = {}
+        for name in packages:
+            for rpm in self.pkg_source[name].rpms:
+                self.rpm_index.setdefault(rpm, name)
+
+        for package in packages:
             self.process_deps(package)
 
 
+    @property
+    def rpms(self):
+        '''
+        Rpms of all packages, view of keys of rpm index
+        '''
+        return self.rpm_index.keys()
+
     def process_deps(self, package):
         '''
         Adds edge between package and each of its dependancies,
         pacakge was not processes before. When recursive is True
         calls itself for each of dependancies.
         '''
-        logger.debug("Dependencies of package {}: {}.".format(
-            package, self.pkg_source[package].dependencies))
+        logger.debug("Dependencies of package %s: %s.", package,
+                     self.pkg_source[package].dependencies, extra={'package': package})
 
         self.G.add_node(package)
-        for dep in self.pkg_source[package].dependencies & self.rpms:
-            self.G.add_edge(package, self.find_package(dep))
+        for dep in self.pkg_source[package].dependencies:
+            if dep in self.rpm_index:
+                self.G.add_edge(package, self.rpm_index[dep])
 
-    def get_cycles(self):
+    def get_cycles(self, cache=None):
         '''
-        Finds circular dependencies and returns set of all cycles
+        Finds circular dependencies and returns set of all cycles,
+        cycles of each strongly connected component are looked up in
+        cache first
         '''
-        cycles = [set(x) for x in nx.simple_cycles(self.G)]
-
-        # Removes subsets of other sets in circular_deps
-        for a, b in itertools.combinations(cycles, 2):
-            if a > b:
-                remove_if_present(cycles, b)
-            elif b > a:
-                remove_if_present(cycles, a)
-
-        circular_deps = [x for n, x in enumerate(cycles) if x not in cycles[:n]]
-
-        logger.debug("Circular dependencies: {}".format(circular_deps))
+        circular_deps = []
+        for component in nx.strongly_connected_components(self.G):
+            subgraph = self.G.subgraph(component)
+            if len(component) == 1 and not subgraph.number_of_edges():
+                continue
+            key = None
+            if cache is not None:
+                key = hashlib.sha1(json.dumps(sorted(subgraph.edges())).encode()).hexdigest()
+                cycles = cache.cycles(key)
+                if cycles is not None:
+                    circular_deps += cycles
+                    continue
+            cycles = component_cycles(subgraph)
+            if key is not None:
+                cache.store_cycles(key, cycles)
+            circular_deps += cycles
+
+        logger.debug("Circular dependencies: %s", circular_deps)
         print("\nCircular dependancies: {}")
         pprint.pprint(circular_deps)
         return circular_deps
 
     def find_package(self, rpm):
-        for package in self.pkg_source.keys():
-            if rpm in self.pkg_source[package].rpms:
-                return package
-        
+        if rpm in self.rpm_index:
+            return self.rpm_index[rpm]
+
         logger.warn("Srpm of {} not found.".format(rpm)) #TODO Handle exception if package not found
 
-    def show(self):
+    def show(self, states=None):
         '''
-        Draws nodes, edges, labels and shows the graph
+        Draws nodes, edges, labels and shows the graph, nodes are
+        coloured by states dictionary package: state
         '''
-        try:
-            pos = nx.graphviz_layout(self.G)
-        except (ImportError, AttributeError):
-            pos = nx.circular_layout(self.G)
-        nx.set_node_attributes(self.G, 'pos', pos)
-        nx.draw(self.G, pos, node_size=12000, with_labels=True,
-                node_color="#1F9EDE", alpha=0.9)
-        plt.show()
+        visual.draw(self.G, states)
+
+    def select(self, only=(), from_packages=(), to_packages=()):
+        '''
+        Returns packages selected for partial rebuild: packages of only,
+        packages of from_packages with all packages depending on them,
+        packages of to_packages with all their dependencies, packages
+        between them when both are given. Whole cycles of packages of
+        only are selected.
+        '''
+        missing = (set(only) | set(from_packages) | set(to_packages)) - set(self.G)
+        if missing:
+            raise ex.IncompleteMetadataException(
+                "Selected packages {} not found in packages list.".format(sorted(missing)))
+        selected = set()
+        if from_packages or to_packages:
+            selected = set(self.G)
+            if from_packages:
+                dependents = set(from_packages)
+                for pkg in from_packages:
+                    dependents |= nx.ancestors(self.G, pkg)
+                selected &= dependents
+            if to_packages:
+                dependencies = set(to_packages)
+                for pkg in to_packages:
+                    dependencies |= nx.descendants(self.G, pkg)
+                selected &= dependencies
+        if only:
+            for component in nx.strongly_connected_components(self.G):
+                if component & set(only):
+                    selected |= component
+        return selected
 
     def get_leaf_nodes(self):
         '''
         Returns list of leaf nodes in graph
         '''
-        return [x for x in self.G.nodes_iter() if self.G.out_degree(x) == 0]
+        return [x for x, degree in self.G.out_degree_iter() if degree == 0]
+
+def component_cycles(G):
+    '''
+    Returns list of all cycles in graph G which are not
+    subsets of other cycles
+    '''
+    cycles = [set(x) for x in nx.simple_cycles(G)]
+
+    # Removes subsets of other sets in circular_deps
+    for a, b in itertools.combinations(cycles, 2):
+        if a > b:
+            remove_if_present(cycles, b)
+        elif b > a:
+            remove_if_present(cycles, a)
+
+    return [x for n, x in enumerate(cycles) if x not in cycles[:n]]
 
 def remove_if_present(ls, value):
     if value in ls:
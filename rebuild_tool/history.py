@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import logging
+import threading
+
+from rebuild_tool.utils import cache_path
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    package TEXT NOT NULL,
+    chroot TEXT NOT NULL,
+    build_system TEXT,
+    build_id TEXT,
+    submitted REAL,
+    started REAL,
+    finished REAL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS builds_package ON builds (package, chroot);
+'''
+
+
+def default_history_path():
+    '''
+    Returns path of history database in user's cache directory
+    '''
+    return cache_path('history.db')
+
+
+def percentile(values, fraction):
+    '''
+    Returns value at fraction of sorted values using linear interpolation
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class BuildHistory(object):
+    '''
+    Local database of build durations and outcomes kept between runs,
+    database is opened on first use
+    '''
+    def __init__(self, path=None):
+        self.path = path or default_history_path()
+        self.lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def record(self, package, chroot, status, submitted=None, started=None,
+               finished=None, build_system=None, build_id=None):
+        '''
+        Stores one finished build of package in chroot
+        '''
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO builds (package, chroot, build_system, build_id, '
+                'submitted, started, finished, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (package, chroot, build_system, None if build_id is None else str(build_id),
+                 submitted, started, finished, status))
+        logger.debug("Recorded %s build of %s in %s.", status, package, chroot,
+                     extra={'package': package, 'chroot': chroot, 'status': status,
+                            'build_id': build_id,
+                            'duration': finished - started if finished and started else None})
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def durations(self, package, chroot=None):
+        '''
+        Returns list of durations of successful builds of package
+        '''
+        sql = ("SELECT finished - started FROM builds WHERE package = ? AND status = 'succeeded' "
+               "AND started IS NOT NULL AND finished IS NOT NULL")
+        params = [package]
+        if chroot:
+            sql += ' AND chroot = ?'
+            params.append(chroot)
+        return [x[0] for x in self._query(sql, params)]
+
+    def median(self, package, chroot=None):
+        return percentile(self.durations(package, chroot), 0.5)
+
+    def p90(self, package, chroot=None):
+        return percentile(self.durations(package, chroot), 0.9)
+
+    def slowest(self, limit=10):
+        '''
+        Returns list of (package, median, p90, builds) of packages
+        with the highest median build duration
+        '''
+        packages = [x[0] for x in self._query(
+            "SELECT DISTINCT package FROM builds WHERE status = 'succeeded'")]
+        result = []
+        for package in packages:
+            durations = self.durations(package)
+            if durations:
+                result.append((package, percentile(durations, 0.5),
+                               percentile(durations, 0.9), len(durations)))
+        return sorted(result, key=lambda x: x[1], reverse=True)[:limit]
+
+    def flakiest(self, limit=10):
+        '''
+        Returns list of (package, failures, builds) of packages with the
+        highest ratio of failed builds
+        '''
+        rows = self._query(
+            "SELECT package, SUM(status != 'succeeded'), COUNT(*) FROM builds "
+            "GROUP BY package HAVING SUM(status != 'succeeded') > 0")
+        return sorted(rows, key=lambda x: (x[1] / x[2], x[1]), reverse=True)[:limit]
+
+    def reliable(self, min_builds=3):
+        '''
+        Returns set of packages built at least min_builds times
+        which never failed
+        '''
+        rows = self._query(
+            "SELECT package FROM builds GROUP BY package "
+            "HAVING COUNT(*) >= ? AND SUM(status != 'succeeded') = 0", (min_builds,))
+        return {x[0] for x in rows}
+
+    def report(self, limit=10):
+        '''
+        Returns text report of the slowest and the flakiest packages
+        '''
+        lines = ['Slowest packages:',
+                 '    {:<40} {:>10} {:>10} {:>7}'.format('package', 'median', 'p90', 'builds')]
+        for (package, median, p90, builds) in self.slowest(limit):
+            lines.append('    {:<40} {:>9.0f}s {:>9.0f}s {:>7}'.format(package, median, p90, builds))
+        lines += ['', 'Flakiest packages:',
+                  '    {:<40} {:>10} {:>7}'.format('package', 'failures', 'builds')]
+        for (package, failures, builds) in self.flakiest(limit):
+            lines.append('    {:<40} {:>10} {:>7}'.format(package, failures, builds))
+        return '\n'.join(lines)
@@ -1,24 +1,93 @@
-import logging
 import os
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
 
 logger = logging.getLogger('rebuild_tool')
 logger.setLevel(logging.DEBUG)
 
 file_formatter = logging.Formatter(u'%(name)s::%(levelname)s::%(message)s')
 
-def register_file_log_handler(log_file, level=logging.DEBUG, fmt=file_formatter):
+# Attributes given in extra of log calls which are written to JSON log
+EVENT_FIELDS = ('package', 'chroot', 'phase', 'duration', 'build_id', 'status')
+
+# Log file is rotated when it grows over 10 MiB, 3 old files are kept
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 3
+
+# (QueueHandler, QueueListener) of registered log files
+listeners = []
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats record as JSON object on one line, event fields given
+    in extra of the log call are included
+    '''
+    def format(self, record):
+        event = {'time': record.created, 'level': record.levelname, 'logger': record.name,
+                 'message': record.getMessage()}
+        for field in EVENT_FIELDS:
+            if hasattr(record, field):
+                event[field] = getattr(record, field)
+        if record.exc_info:
+            event['exception'] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Puts records to the queue as they are, message is formatted by
+    the listener thread, so arguments of log calls shouldn't be
+    modified after the call
+    '''
+    def prepare(self, record):
+        return record
+
+
+def register_file_log_handler(log_file, level=logging.DEBUG, fmt=file_formatter,
+                              max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT):
+    '''
+    Writes records of rebuild_tool loggers to log_file from a background
+    thread, the file is rotated when it grows over max_bytes, returns
+    False when the file can't be opened
+    '''
     dirname = os.path.dirname(log_file)
     try:
-        if not os.path.exists(dirname):
+        if dirname and not os.path.exists(dirname):
             os.makedirs(dirname)
     except (OSError, IOError):
         return False
     try:
-        file_handler = logging.FileHandler(log_file, 'a')
-        file_handler.setLevel(level)
-        file_handler.setFormatter(fmt)
-        logger.addHandler(file_handler)
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, 'a', maxBytes=max_bytes, backupCount=backup_count)
     except (OSError, IOError):
         return False
+    file_handler.setLevel(level)
+    file_handler.setFormatter(fmt)
+    log_queue = queue.Queue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, file_handler,
+                                              respect_handler_level=True)
+    listener.start()
+    logger.addHandler(queue_handler)
+    listeners.append((queue_handler, listener))
     return True
 
+
+def stop_file_log_handlers():
+    '''
+    Writes records waiting in queues and closes log files
+    '''
+    while listeners:
+        (queue_handler, listener) = listeners.pop()
+        logger.removeHandler(queue_handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+atexit.register(stop_file_log_handlers)
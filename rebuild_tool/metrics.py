@@ -0,0 +1,187 @@
+import time
+import logging
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+logger = logging.getLogger(__name__)
+
+# name : (type, help) of all metrics exported by rebuild_tool
+METRICS = {
+    'rebuild_packages': (
+        'gauge', 'Number of packages in each scheduling state.'),
+    'rebuild_build_slots_in_use': (
+        'gauge', 'Number of packages currently building, each holds one build slot.'),
+    'rebuild_copr_poll_seconds': (
+        'summary', 'Latency of Copr build status requests.'),
+    'rebuild_fetched_packages_total': (
+        'counter', 'Number of packages fetched from the packages source.'),
+    'rebuild_fetched_bytes_total': (
+        'counter', 'Size of srpms fetched from the packages source.'),
+    'rebuild_fetch_seconds_total': (
+        'counter', 'Time spent fetching packages from the packages source.'),
+    'rebuild_phase_duration_seconds': (
+        'gauge', 'Duration of rebuild phases, running phases are updated live.'),
+    'rebuild_speculative_builds_total': (
+        'counter', 'Number of builds started before all dependencies were built.'),
+    'rebuild_speculative_failures_total': (
+        'counter', 'Number of speculative builds which failed and wait for dependencies.'),
+}
+
+PACKAGE_STATES = ['pending', 'ready', 'in_flight', 'succeeded', 'failed', 'blocked']
+
+
+def format_labels(labels):
+    '''
+    Converts tuple of label pairs to Prometheus label string
+    (('phase', 'build'),)  >>  {phase="build"}
+    '''
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(key, str(value).replace('"', '\\"'))
+                          for key, value in labels) + '}'
+
+
+class Metrics(object):
+    '''
+    Thread safe store of values describing state of the rebuild,
+    renders them in Prometheus text exposition format
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.running_phases = {}
+
+    def _key(self, name, labels):
+        if name not in METRICS:
+            raise KeyError("Unknown metric {}".format(name))
+        return (name, tuple(sorted(labels.items())))
+
+    def set(self, name, value, **labels):
+        '''
+        Sets value of gauge
+        '''
+        with self.lock:
+            self.values[self._key(name, labels)] = value
+
+    def inc(self, name, value=1, **labels):
+        '''
+        Increases value of counter or gauge
+        '''
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        '''
+        Adds one observation to summary
+        '''
+        key = self._key(name, labels)
+        with self.lock:
+            count, total = self.values.get(key, (0, 0))
+            self.values[key] = (count + 1, total + value)
+
+    def set_package_states(self, labels=None, **states):
+        '''
+        Sets number of packages in each of PACKAGE_STATES, labels
+        are added to the state label
+        '''
+        for state in PACKAGE_STATES:
+            self.set('rebuild_packages', states.get(state, 0), state=state, **(labels or {}))
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        With statement to measure duration of rebuild phase, phase
+        can run in more threads at once
+        '''
+        start = time.time()
+        with self.lock:
+            self.running_phases.setdefault(name, []).append(start)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.running_phases[name].remove(start)
+                if not self.running_phases[name]:
+                    del self.running_phases[name]
+            duration = time.time() - start
+            self.set('rebuild_phase_duration_seconds', duration, phase=name)
+            logger.info("Phase %s finished in %.1f s.", name, duration,
+                        extra={'phase': name, 'duration': duration})
+
+    def timed(self, name):
+        '''
+        Decorator to measure duration of function as rebuild phase
+        '''
+        def decorator(fce):
+            @wraps(fce)
+            def inner(*args, **kwargs):
+                with self.phase(name):
+                    return fce(*args, **kwargs)
+            return inner
+        return decorator
+
+    def render(self):
+        '''
+        Returns all collected values in Prometheus text format
+        '''
+        now = time.time()
+        with self.lock:
+            values = dict(self.values)
+            for phase, starts in self.running_phases.items():
+                values[('rebuild_phase_duration_seconds', (('phase', phase),))] = now - min(starts)
+
+        lines = []
+        for name in sorted(METRICS):
+            samples = sorted((labels, value) for (key, labels), value in values.items()
+                             if key == name)
+            if not samples:
+                continue
+            metric_type, help_text = METRICS[name]
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+            for labels, value in samples:
+                if metric_type == 'summary':
+                    count, total = value
+                    lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), count))
+                    lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), total))
+                else:
+                    lines.append('{0}{1} {2}'.format(name, format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Metrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    '''
+    Serves content of metrics registry on /metrics
+    '''
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request: " + format, *args)
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    '''
+    Starts HTTP server exposing metrics in daemon thread,
+    returns server object
+    '''
+    server = HTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info("Metrics available on http://{0}:{1}/metrics".format(host, server.server_port))
+    return server
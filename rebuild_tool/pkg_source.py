@@ -1,45 +1,112 @@
 import os
+import sys
 import glob
 import re
-from subprocess import CalledProcessError
 from abc import ABCMeta, abstractmethod
 
 from rebuild_tool import utils
 
+# name-version-release.arch  >>  name
+RPM_PATTERN = re.compile(r"(^.*?)-\d+.\d+.*$")
+
 def set_class_attrs(add_fce):
     '''
     Decorator to set class attributes repo and prefix
-    before first addition of pkg source class to container
+    before first addition of pkg source class to container,
+    other arguments are passed to add_fce
     '''
-    def inner(self, package, pkg_dir, repo, prefix, koji_tag=None):
+    def inner(self, package, pkg_dir, repo, prefix, koji_tag=None, *args):
         if not PkgSrcArchive.repo:
             PkgSrcArchive.repo = repo
             PkgSrcArchive.prefix = prefix
             PkgSrcArchive.koji_tag = koji_tag
-        add_fce(self, package, pkg_dir)
+        add_fce(self, package, pkg_dir, *args)
     return inner
 
+def intern_names(names):
+    '''
+    Returns frozenset of interned names, names of rpms shared by many
+    packages are stored only once
+    '''
+    return frozenset(sys.intern(x) for x in names)
+
+def repo_revision(repo):
+    '''
+    Returns revision of metadata of repo, None when it is not known
+    '''
+    proc_data = utils.subprocess_popen_call(["dnf", "repoinfo", "--disablerepo=*",
+                                             "--enablerepo=" + repo])
+    if proc_data['returncode']:
+        return None
+    for line in proc_data['stdout'].splitlines():
+        if line.startswith('Repo-revision'):
+            return line.split(':', 1)[1].strip()
+    return None
+
+class CachedArchive(object):
+    '''
+    Package loaded from analysis cache, contains only rpms and
+    dependencies, files of the package are not downloaded
+    '''
+    __slots__ = ('package', 'srpm_file', 'rpms', 'dependencies')
+
+    def __init__(self, package, srpm_file, rpms, dependencies):
+        self.package = sys.intern(package)
+        self.srpm_file = srpm_file
+        self.rpms = intern_names(rpms)
+        self.dependencies = intern_names(dependencies)
+
+    def __repr__(self):
+        return "pacakage: {} rpms: {}".format(self.package, self.rpms)
+
 class PkgSrcArchive(metaclass=ABCMeta):
     '''
-    Abstract super class of pkg_source classes
+    Abstract super class of pkg_source classes, instances of all
+    packages are kept in the graph, so attributes are stored in slots
     '''
+    __slots__ = ('_pkg_dir', 'package', 'srpm_file', 'spec_file', 'rpms')
     repo = None
     prefix = None
     koji_tag = None
+    # attributes sent from fetch workers, see state
+    state_attrs = ['package', 'srpm_file', 'spec_file']
 
     def __init__(self, package, pkg_dir, srpm_file=None, spec_file=None):
         self.pkg_dir = pkg_dir
-        self.package = package
+        self.package = sys.intern(package)
         self.srpm_file = srpm_file
         self.spec_file = spec_file
         self.download()
         self.unpack()
         self.pack()
-        self.rpms = self.rpms_from_spec
+        self.rpms = intern_names(self.rpms_from_spec)
 
     def __repr__(self):
         return "pacakage: {} rpms: {}".format(self.package, self.rpms)
 
+    def state(self):
+        '''
+        Returns JSON serializable dictionary of attributes, archive
+        is restored from it by from_state without fetching the package
+        '''
+        state = {attr: getattr(self, attr) for attr in self.state_attrs}
+        state.update(pkg_dir=self.pkg_dir, rpms=sorted(self.rpms),
+                     dependencies=sorted(self.dependencies))
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        '''
+        Creates archive of package fetched to pkg_dir by other process
+        '''
+        archive = cls.__new__(cls)
+        archive._pkg_dir = state['pkg_dir']
+        for attr in cls.state_attrs:
+            setattr(archive, attr, state[attr])
+        archive.package = sys.intern(archive.package)
+        archive.rpms = intern_names(state['rpms'])
+        return archive
+
     @property
     def pkg_dir(self):
         return self._pkg_dir
@@ -75,16 +142,12 @@ class PkgSrcArchive(metaclass=ABCMeta):
     @property
     def rpms_from_spec(self):
         '''
-        Returns list of rpms created from spec_file
+        Returns set of rpms created from spec_file, raises
+        CalledProcessError when rpm fails
         '''
-        rpm_pattern = re.compile("(^.*?)-\d+.\d+.*$")
-        proc_data = utils.subprocess_popen_call(["rpm", "-q", "--specfile", "--define",
-                                                 "scl_prefix " + type(self).prefix,
-                                                 self.full_path_spec])
-        if proc_data['returncode']:
-            raise CalledProcessError(cmd='rpm', returncode=proc_data['returncode'])
-        rpms = proc_data['stdout'].splitlines()
-        return {rpm_pattern.search(x).groups()[0] for x in rpms}
+        lines = utils.stream_lines(["rpm", "-q", "--specfile", "--define",
+                                    "scl_prefix " + type(self).prefix, self.full_path_spec])
+        return {RPM_PATTERN.search(x).group(1) for x in lines}
 
     @abstractmethod
     def dependencies(self):
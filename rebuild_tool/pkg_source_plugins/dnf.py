@@ -1,46 +1,125 @@
-import locale
+import sys
 import logging
-from subprocess import Popen, PIPE, CalledProcessError
+from itertools import islice
+from subprocess import CalledProcessError
 from collections import UserDict
 
 import rebuild_tool.exceptions as ex
-from rebuild_tool.pkg_source import PkgSrcArchive, set_class_attrs
-from rebuild_tool.utils import subprocess_popen_call, ChangeDir
+from rebuild_tool.pkg_source import PkgSrcArchive, set_class_attrs, intern_names
+from rebuild_tool.srpm import SrpmReader
+from rebuild_tool.utils import (subprocess_popen_call, pipeline_call, file_digest, stream_lines,
+                                run_subprocess_calls)
 
 logger = logging.getLogger(__name__)
 
+def repoquery_command(package, repo):
+    return ["dnf", "repoquery", "--arch=src", "--disablerepo=*", "--enablerepo=" + repo,
+            "--requires", package]
+
+def query_requires(packages, repo):
+    '''
+    Runs repoquery of all packages at once, returns dictionary
+    package: requires of packages which were queried successfully
+    '''
+    packages = sorted(packages)
+    results = run_subprocess_calls([repoquery_command(x, repo) for x in packages])
+    requires = {}
+    for package, result in zip(packages, results):
+        if result['returncode']:
+            logger.debug("Repoquery of %s failed: %s", package, result['stderr'])
+            continue
+        # the first line is metadata expiration check
+        requires[package] = intern_names(result['stdout'].splitlines()[1:])
+    return requires
+
 class PkgsContainer(UserDict):
+    def __init__(self, *args, **kwargs):
+        super(PkgsContainer, self).__init__(*args, **kwargs)
+        self.requires = {}  # package: requires found by prefetch
+
     @set_class_attrs
     def add(self, package, pkg_dir):
         '''
         Adds new DnfArchive object to self.data
         '''
         self[package] = DnfArchive(package, pkg_dir)
+        if package in self.requires:
+            self[package]._dependencies = self.requires.pop(package)
+
+    def prefetch(self, pkg_dirs, koji_tag=None, koji_hub=None, koji_topurl=None, repo=None):
+        '''
+        Downloads srpms and queries requires of all packages at once,
+        pkg_dirs is a dictionary package: pkg_dir. Packages which failed
+        are fetched again by add, which reports the error.
+        '''
+        if not pkg_dirs or not repo:
+            return
+        packages = sorted(pkg_dirs)
+        try:
+            results = run_subprocess_calls([
+                ["dnf", "download", "--disablerepo=*", "--enablerepo=" + repo,
+                 "--destdir", pkg_dirs[package], "--source", package] for package in packages])
+            for package, result in zip(packages, results):
+                if result['returncode']:
+                    logger.debug("Download of %s failed: %s", package, result['stderr'])
+            self.requires.update(query_requires(packages, repo))
+        except OSError as e:
+            logger.warning("Prefetch of packages failed: {}".format(e))
+
+    @set_class_attrs
+    def restore(self, package, pkg_dir, state):
+        '''
+        Adds DnfArchive of package fetched by fetch worker
+        '''
+        self[package] = DnfArchive.from_state(state)
 
 class DnfArchive(PkgSrcArchive):
     '''
     Contains methods to download from dnf, unpack, edit and pack srpm
     '''
+    __slots__ = ('_dependencies', 'spec_digest', 'sources_extracted')
+    state_attrs = PkgSrcArchive.state_attrs + ['spec_digest', 'sources_extracted']
+
+    @classmethod
+    def from_state(cls, state):
+        archive = super(DnfArchive, cls).from_state(state)
+        archive._dependencies = intern_names(state['dependencies'])
+        return archive
+
     @property
     def dependencies(self):
         '''
-        Returns all dependencies of the package found in selected repo
+        Returns all dependencies of the package found in selected repo,
+        the repo is queried only once, output of repoquery is read line
+        by line
         '''
-        proc_data = subprocess_popen_call(["dnf", "repoquery", "--arch=src",
-                                           "--disablerepo=*", "--enablerepo=" + type(self).repo,
-                                           "--requires", self.package])
-        if proc_data['returncode']:
-            if proc_data['stderr'] == "Error: Unknown repo: '{0}'\n".format(type(self).repo):
+        if getattr(self, '_dependencies', None) is not None:
+            return self._dependencies
+        lines = stream_lines(repoquery_command(self.package, type(self).repo))
+        dependencies = set()
+        try:
+            # the first line is metadata expiration check
+            for line in islice(lines, 1, None):
+                dependencies.add(sys.intern(line))
+        except CalledProcessError as e:
+            if e.stderr == "Error: Unknown repo: '{0}'\n".format(type(self).repo):
                 raise ex.UnknownRepoException('Repository {} is probably disabled'.format(
                     type(self).repo))
+            logger.warning("Repoquery of {} failed: {}".format(self.package, e.stderr))
 
-        all_deps = set(proc_data['stdout'].splitlines()[1:])
-        return all_deps
+        self._dependencies = frozenset(dependencies)
+        return self._dependencies
 
     def download(self):
         '''
-        Download srpm of package from selected repo using dnf.
+        Download srpm of package from selected repo using dnf,
+        srpm downloaded by PkgsContainer.prefetch is used if present
         '''
+        try:
+            self.srpm_file = self.get_file('.src.rpm')
+            return
+        except IOError:
+            pass
         proc_data = subprocess_popen_call(["dnf", "download", "--disablerepo=*",
                                            "--enablerepo=" + type(self).repo,
                                            "--destdir", self.pkg_dir,
@@ -56,34 +135,66 @@ class DnfArchive(PkgSrcArchive):
 
     def unpack(self):
         '''
-        Unpacks srpm archive
+        Extracts only spec file from srpm archive, sources are
+        extracted by extract_sources when the srpm is repacked
         '''
-        with ChangeDir(self.pkg_dir):
-            proc1 = Popen(["rpm2cpio", self.srpm_file], stdout=PIPE, stderr=PIPE)
-            proc2 = Popen(["cpio", "-idmv"], stdin=proc1.stdout, stdout=PIPE, stderr=PIPE)
-            stream_data = proc2.communicate()
-            stderr_str = stream_data[1].decode(locale.getpreferredencoding())
-            if proc2.returncode:
-                logger.error(stderr_str)
-                raise CalledProcessError(cmd='rpm2cpio', returncode=proc2.returncode)
+        self.sources_extracted = False
+        try:
+            self.spec_file = SrpmReader(self.full_path_srpm).extract_spec(self.pkg_dir)
+        except ex.SrpmFormatException as e:
+            logger.warning("Failed to read {}: {}, using rpm2cpio.".format(self.srpm_file, e))
+            self.extract_sources()
             self.spec_file = self.get_file('.spec')
+        self.spec_digest = file_digest(self.full_path_spec)
+
+    def extract_sources(self):
+        '''
+        Unpacks whole srpm archive
+        '''
+        if self.sources_extracted:
+            return
+        try:
+            SrpmReader(self.full_path_srpm).extract(
+                self.pkg_dir, select=lambda name: not name.endswith('.spec'))
+        except ex.SrpmFormatException:
+            proc_data = pipeline_call([["rpm2cpio", self.srpm_file],
+                                       ["cpio", "-idmu", "--no-absolute-filenames"]],
+                                      cwd=self.pkg_dir)
+            if proc_data['returncode']:
+                logger.error(proc_data['stderr'])
+                raise CalledProcessError(cmd='rpm2cpio', returncode=proc_data['returncode'])
+        self.sources_extracted = True
+
+    @property
+    def repack_needed(self):
+        '''
+        Downloaded srpm can be used as long as the spec file was not edited
+        and scl_prefix doesn't have to be defined
+        '''
+        return bool(type(self).prefix) or file_digest(self.full_path_spec) != self.spec_digest
 
     def pack(self, save_dir=None):
         '''
         Builds a srpm  using rpmbuild.
-        Generated srpm is stored in directory specified by save_dir."""
+        Generated srpm is stored in directory specified by save_dir.
+        Without save_dir the srpm is rebuilt only if repack is needed.
         '''
         if not save_dir:
+            if not self.repack_needed:
+                return
             save_dir = self.pkg_dir
+        self.extract_sources()
         try:
-            msg = Popen(['rpmbuild',
-                         '--define', '_sourcedir {0}'.format(save_dir),
-                         '--define', '_builddir {0}'.format(save_dir),
-                         '--define', '_srcrpmdir {0}'.format(save_dir),
-                         '--define', '_rpmdir {0}'.format(save_dir),
-                         '--define', 'scl_prefix {0}'.format(type(self).prefix),
-                         '-bs', self.spec_file], stdout=PIPE,
-                         stderr=PIPE).communicate()[0].strip()
+            proc_data = subprocess_popen_call(['rpmbuild',
+                                               '--define', '_sourcedir {0}'.format(save_dir),
+                                               '--define', '_builddir {0}'.format(save_dir),
+                                               '--define', '_srcrpmdir {0}'.format(save_dir),
+                                               '--define', '_rpmdir {0}'.format(save_dir),
+                                               '--define', 'scl_prefix {0}'.format(
+                                                   type(self).prefix),
+                                               '-bs', self.spec_file], cwd=self.pkg_dir)
+            if proc_data['returncode']:
+                logger.error(proc_data['stderr'])
         except OSError:
             logger.error('Rpmbuild failed for specfile: {0} and save_dir: {1}'.format(
                 self.spec_file, self.pkg_dir))
@@ -1,33 +1,206 @@
+import os
+import logging
+import threading
+import http.client
+import xmlrpc.client
+from urllib.parse import urlsplit, quote
 from collections import UserDict
+from concurrent.futures import ThreadPoolExecutor
 
 from rebuild_tool.pkg_source import set_class_attrs
-from rebuild_tool.pkg_source_plugins.dnf import DnfArchive
-from rebuild_tool.utils import ChangeDir, subprocess_popen_call
-from rebuild_tool.exceptions import DownloadFailException
+from rebuild_tool.pkg_source_plugins.dnf import DnfArchive, query_requires
+from rebuild_tool.srpm import SrpmReader, CHUNK_SIZE
+from rebuild_tool.utils import subprocess_popen_call
+from rebuild_tool.exceptions import DownloadFailException, SrpmFormatException
+
+logger = logging.getLogger(__name__)
+
+KOJI_HUB = 'https://koji.fedoraproject.org/kojihub'
+KOJI_TOPURL = 'https://kojipkgs.fedoraproject.org'
+
+# Seconds to wait for connection to and data from kojipkgs server
+DOWNLOAD_TIMEOUT = 60
 
 class PkgsContainer(UserDict):
+    def __init__(self, *args, **kwargs):
+        super(PkgsContainer, self).__init__(*args, **kwargs)
+        self.requires = {}  # package: requires found by prefetch
+
     @set_class_attrs
     def add(self, package, pkg_dir):
         '''
         Adds new KojiArchive object to self.data
         '''
         self[package] = KojiArchive(package, pkg_dir)
+        if package in self.requires:
+            self[package]._dependencies = self.requires.pop(package)
+
+    @set_class_attrs
+    def restore(self, package, pkg_dir, state):
+        '''
+        Adds KojiArchive of package fetched by fetch worker
+        '''
+        self[package] = KojiArchive.from_state(state)
+
+    def prefetch(self, pkg_dirs, koji_tag, koji_hub=None, koji_topurl=None, repo=None):
+        '''
+        Downloads srpms of all packages at once, pkg_dirs is a dictionary
+        package: pkg_dir. KojiArchive objects created by add use srpms
+        already present in their pkg_dir. With repo requires of all the
+        packages are queried at once too.
+        '''
+        if not pkg_dirs:
+            return
+        fetcher = KojiFetcher(koji_hub or KOJI_HUB, koji_topurl or KOJI_TOPURL)
+        fetcher.fetch(pkg_dirs, koji_tag)
+        if repo:
+            try:
+                self.requires.update(query_requires(pkg_dirs, repo))
+            except OSError as e:
+                logger.warning("Repoquery of packages failed: {}".format(e))
+
+
+class KojiFetcher(object):
+    '''
+    Resolves latest builds of all packages in a tag using koji multicall
+    and downloads their srpms in parallel over persistent connections
+    '''
+    def __init__(self, hub, topurl, jobs=8, timeout=DOWNLOAD_TIMEOUT):
+        self.hub = xmlrpc.client.ServerProxy(hub, allow_none=True)
+        self.topurl = urlsplit(topurl)
+        self.jobs = jobs
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def multicall(self, method, params_list):
+        '''
+        Calls method once for each list of params in one request,
+        returns list of results
+        '''
+        results = self.hub.multiCall([{'methodName': method, 'params': params}
+                                      for params in params_list])
+        values = []
+        for result in results:
+            if isinstance(result, dict):
+                raise DownloadFailException("Koji {} failed: {}".format(
+                    method, result['faultString']))
+            values.append(result[0])
+        return values
+
+    def latest_srpms(self, packages, koji_tag):
+        '''
+        Returns dictionary package: info of src rpm of its latest build
+        '''
+        builds = self.multicall('getLatestBuilds', [[koji_tag, None, package]
+                                                    for package in packages])
+        missing = [package for package, found in zip(packages, builds) if not found]
+        if missing:
+            raise DownloadFailException("Builds of {} not found in {}.".format(missing, koji_tag))
+        # listRPMs(buildID, buildrootID, imageID, componentBuildrootID, hostID, arches)
+        rpms = self.multicall('listRPMs', [[found[0]['build_id'], None, None, None, None, 'src']
+                                           for found in builds])
+        srpms = {}
+        for package, build_rpms in zip(packages, rpms):
+            if not build_rpms:
+                raise DownloadFailException("Srpm of {} not found in koji.".format(package))
+            srpms[package] = build_rpms[0]
+        return srpms
+
+    def srpm_url(self, rpm):
+        return '{0}/packages/{1}/{2}/{3}/src/{1}-{2}-{3}.src.rpm'.format(
+            self.topurl.path.rstrip('/'), *[quote(rpm[x]) for x in ['name', 'version', 'release']])
+
+    def _connection(self):
+        '''
+        Returns persistent connection of current thread
+        '''
+        if not hasattr(self._local, 'connection'):
+            if self.topurl.scheme == 'https':
+                self._local.connection = http.client.HTTPSConnection(
+                    self.topurl.netloc, timeout=self.timeout)
+            else:
+                self._local.connection = http.client.HTTPConnection(
+                    self.topurl.netloc, timeout=self.timeout)
+        return self._local.connection
+
+    def download(self, rpm, pkg_dir):
+        '''
+        Downloads srpm to pkg_dir and verifies its size and payloadhash,
+        returns name of the file
+        '''
+        file_name = '{}-{}-{}.src.rpm'.format(rpm['name'], rpm['version'], rpm['release'])
+        path = os.path.join(pkg_dir, file_name)
+        url = self.srpm_url(rpm)
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request('GET', url)
+                response = connection.getresponse()
+                if response.status != 200:
+                    response.read()
+                    raise DownloadFailException("Failed to download {}: {} {}".format(
+                        url, response.status, response.reason))
+                with open(path, 'wb') as fo:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                        fo.write(chunk)
+                break
+            except (http.client.HTTPException, OSError) as e:
+                # Server closed kept alive connection or didn't answer, reconnect once
+                connection.close()
+                del self._local.connection
+                if attempt:
+                    raise DownloadFailException("Failed to download {}: {}".format(url, e))
+        self.verify(path, rpm)
+        logger.debug("Downloaded %s.", url)
+        return file_name
+
+    def verify(self, path, rpm):
+        if 'size' in rpm and os.path.getsize(path) != rpm['size']:
+            raise DownloadFailException("Size of {} doesn't match koji.".format(path))
+        if rpm.get('payloadhash'):
+            try:
+                digest = SrpmReader(path).payload_digest()
+            except SrpmFormatException as e:
+                raise DownloadFailException("Downloaded {} is broken: {}".format(path, e))
+            if digest != rpm['payloadhash']:
+                raise DownloadFailException("Checksum of {} doesn't match koji.".format(path))
+
+    def fetch(self, pkg_dirs, koji_tag):
+        '''
+        Downloads srpms of latest builds in koji_tag of all packages
+        in pkg_dirs dictionary package: pkg_dir
+        '''
+        packages = sorted(pkg_dirs)
+        srpms = self.latest_srpms(packages, koji_tag)
+        print("Downloading {} srpms from koji.".format(len(packages)))
+        with ThreadPoolExecutor(self.jobs) as executor:
+            files = list(executor.map(lambda package: self.download(srpms[package],
+                                                                     pkg_dirs[package]),
+                                      packages))
+        return dict(zip(packages, files))
+
 
 class KojiArchive(DnfArchive):
     '''
     Overriding DnfArchive download method to use koji download
     '''
+    __slots__ = ()
 
     def download(self):
         '''
-        Download srpm of package from selected repo using koji.
+        Download srpm of package from selected repo using koji,
+        srpm downloaded by PkgsContainer.prefetch is used if present
         '''
-        with ChangeDir(self.pkg_dir):
-            proc_data = subprocess_popen_call(["koji", "download-build",
-                                               "--arch=src",
-                                               "--latestfrom=" + type(self).koji_tag,
-                                               self.package])
-            if proc_data['returncode']:
-                raise DownloadFailException(proc_data['stderr'])
+        try:
+            self.srpm_file = self.get_file(".src.rpm")
+            return
+        except IOError:
+            pass
+        proc_data = subprocess_popen_call(["koji", "download-build",
+                                           "--arch=src",
+                                           "--latestfrom=" + type(self).koji_tag,
+                                           self.package], cwd=self.pkg_dir)
+        if proc_data['returncode']:
+            raise DownloadFailException(proc_data['stderr'])
 
         self.srpm_file = self.get_file(".src.rpm")
@@ -1,10 +1,131 @@
+import os
+import glob
 import yaml
-from collections import UserDict
+import logging
+from collections import UserDict, OrderedDict
 
 from rebuild_tool.exceptions import IncompleteMetadataException, UnknownPluginException
 from rebuild_tool.builder_plugins.builder_loader import available_builder_plugins
 from rebuild_tool.pkg_source_plugins.pkg_source_loader import available_pkg_source_plugins
 
+logger = logging.getLogger(__name__)
+
+# libyaml parser is several times faster than the pure Python one
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+NUMBER = (int, float)
+
+# Rebuild file attribute: allowed types of its value
+SCHEMA = {
+    'build_system': str,
+    'packages_source': str,
+    'repo': str,
+    'packages': list,
+    'packages_from': (str, list),
+    'recipes': (str, list),
+    'metapackage': str,
+    'prefix': (str, type(None)),
+    'koji_tag': str,
+    'koji_hub': str,
+    'koji_topurl': str,
+    'history_db': str,
+    'analysis_cache': str,
+    'fetch_connect_timeout': NUMBER,
+    'fetch_idle_timeout': NUMBER,
+    'retries': int,
+    'retry_backoff': NUMBER,
+    'speculative': bool,
+    'speculative_packages': list,
+    'speculative_history': int,
+    'hard_requires': list,
+    'copr_project': str,
+    'chroots': (str, list),
+    'chroot_pkgs': (str, list),
+    'chroot_scheduling': str,
+    'copr_shards': int,
+    'copr_slots': int,
+    'copr_slots_weight': NUMBER,
+    'copr_slots_file': str,
+    'mock_config': str,
+    'mock_mode': str,
+    'mock_roots': int,
+    'mock_repo': str,
+    'mock_timeout': NUMBER,
+    'local_workers': int,
+    'local_queue_latency': NUMBER,
+    'local_build_latency': NUMBER + (list,),
+    'local_failure_rate': NUMBER,
+    'local_fail_packages': list,
+    'local_seed': int,
+}
+
+# Numeric attribute: (minimum, maximum) of its value, None is not limited
+RANGES = {
+    'retries': (0, None),
+    'retry_backoff': (0, None),
+    'copr_shards': (1, None),
+    'copr_slots': (1, None),
+    'copr_slots_weight': (1, None),
+    'mock_roots': (1, None),
+    'local_workers': (1, None),
+    'local_failure_rate': (0, 1),
+}
+
+# Attributes which are lists of package, rpm or chroot names
+NAME_LISTS = ['packages', 'packages_from', 'recipes', 'speculative_packages', 'hard_requires',
+              'chroots', 'chroot_pkgs', 'local_fail_packages']
+
+
+def load_yaml(data):
+    '''
+    Parses YAML data using safe loader
+    '''
+    return yaml.load(data, Loader=Loader)
+
+
+def schema_errors(data):
+    '''
+    Returns list of descriptions of values of data not matching SCHEMA
+    or out of RANGES, unknown attributes are only logged
+    '''
+    errors = []
+    for attr, value in data.items():
+        if attr not in SCHEMA:
+            logger.warning("Unknown Rebuild file attribute: %s.", attr)
+            continue
+        types = SCHEMA[attr] if isinstance(SCHEMA[attr], tuple) else (SCHEMA[attr],)
+        # bool is subclass of int, yes/no are not numbers
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            errors.append("{} has to be {}, not {}".format(
+                attr, ' or '.join(x.__name__ for x in types), type(value).__name__))
+        elif attr in NAME_LISTS and isinstance(value, list):
+            wrong = [x for x in value if not isinstance(x, str)]
+            if wrong:
+                errors.append("{} has to contain only strings, not {}".format(
+                    attr, ', '.join(repr(x) for x in wrong[:5])))
+        elif attr in RANGES:
+            (minimum, maximum) = RANGES[attr]
+            if maximum is not None and not minimum <= value <= maximum:
+                errors.append("{} has to be between {} and {}, not {}".format(
+                    attr, minimum, maximum, value))
+            elif value < minimum:
+                errors.append("{} has to be at least {}, not {}".format(attr, minimum, value))
+    return errors
+
+
+def read_package_list(path):
+    '''
+    Returns names of packages in file path, one per line,
+    empty lines and lines starting with # are skipped
+    '''
+    packages = []
+    for line in get_file_data(path, split=True):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            packages.append(line)
+    return packages
+
+
 def get_file_data(input_file, split=False):
     '''
     Opens given file and reads it,
@@ -19,15 +140,28 @@ def get_file_data(input_file, split=False):
 
 class RebuildMetadata(UserDict):
     '''
-    Class to load, check and store all rebuild metadata
+    Class to load, check and store all rebuild metadata, paths of
+    packages_from are relative to base_dir
     '''
-    def __init__(self, yaml_data):
+    def __init__(self, yaml_data, base_dir=None):
         super(self.__class__, self).__init__()
-        self.data = yaml.load(yaml_data)
+        self.base_dir = base_dir or os.getcwd()
+        self.data = load_yaml(yaml_data)
+        if not isinstance(self.data, dict):
+            raise IncompleteMetadataException("Rebuild file has to be a mapping of attributes.")
 
-        for attr in ['build_system', 'packages_source', 'repo', 'packages']:
-            if attr not in self:
-                raise IncompleteMetadataException("Missing Rebuild file attribute: {}.".format(attr))
+        if 'packages_from' in self:
+            self.setdefault('packages', [])
+        errors = ["missing attribute {}".format(attr)
+                  for attr in ['build_system', 'packages_source', 'repo', 'packages']
+                  if attr not in self]
+        errors += schema_errors(self.data)
+        # without hard_requires packages would be built before anything is built
+        if self.get('speculative') and not self.get('hard_requires'):
+            errors.append("speculative builds need hard_requires")
+        if errors:
+            raise IncompleteMetadataException(
+                "Invalid Rebuild file: {}.".format('; '.join(errors)))
 
         if self['build_system'] not in available_builder_plugins:
             raise UnknownPluginException("Builder plugin: {} specified in Rebuild file not available.".format(
@@ -43,11 +177,16 @@ class RebuildMetadata(UserDict):
         if not 'prefix' in self:
             self['prefix'] = ""
 
-        for attr in ["chroots", "recipes", "chroot_pkgs", "packages"]:
+        for attr in ["chroots", "recipes", "chroot_pkgs", "packages", "packages_from"]:
             if attr in self:
                 if not isinstance(self[attr], list):
                     self[attr] = [self[attr]]
 
+        if 'packages_from' in self:
+            self['packages'] += self.expand_packages_from()
+        # duplicates would be fetched and analysed twice
+        self['packages'] = list(OrderedDict.fromkeys(self['packages']))
+
         if self['packages_source'] == 'koji':
             if 'koji_tag' not in self:
                 raise IncompleteMetadataException("Missing Rebuild file attribute: koji_tag necesary to get srpms from koji.")
@@ -55,6 +194,80 @@ class RebuildMetadata(UserDict):
             self['koji_tag'] = None
 
 
+    @classmethod
+    def from_file(cls, path):
+        '''
+        Loads Rebuild file path and all its recipes, raises
+        IncompleteMetadataException listing all the problems found
+        '''
+        metadata = cls(get_file_data(path), os.path.dirname(os.path.abspath(path)))
+        metadata.load_recipes()
+        return metadata
+
+    def expand_packages_from(self):
+        '''
+        Returns packages listed in files or glob patterns of packages_from
+        '''
+        packages = []
+        for pattern in self['packages_from']:
+            paths = sorted(glob.glob(os.path.join(self.base_dir, os.path.expanduser(pattern))))
+            if not paths:
+                raise IncompleteMetadataException(
+                    "No package list matches packages_from {}.".format(pattern))
+            for path in paths:
+                try:
+                    packages += read_package_list(path)
+                except IOError as e:
+                    raise IncompleteMetadataException(
+                        "Failed to read package list {}: {}.".format(path, e))
+        return packages
+
+    def load_recipes(self):
+        '''
+        Replaces paths of recipes by loaded recipes, checks that steps
+        of all recipes are valid and their packages are rebuilt
+        '''
+        if 'recipes' not in self:
+            return
+        packages = set(self['packages'])
+        recipes = []
+        errors = []
+        for recipe_file in self['recipes']:
+            if isinstance(recipe_file, Recipe):
+                recipes.append(recipe_file)
+                continue
+            try:
+                recipe = Recipe(recipe_file)
+            except (IOError, yaml.YAMLError) as e:
+                errors.append("failed to load recipe {}: {}".format(recipe_file, e))
+                continue
+            except ValueError as e:
+                errors.append("recipe {}: {}".format(recipe_file, e))
+                continue
+            missing = sorted(recipe.packages - packages)
+            if missing:
+                errors.append("packages {} of recipe {} are not in packages".format(
+                    ', '.join(missing), recipe_file))
+            recipes.append(recipe)
+        if errors:
+            raise IncompleteMetadataException("Invalid recipes: {}.".format('; '.join(errors)))
+        self['recipes'] = recipes
+
+
+def check_steps(order):
+    '''
+    Raises ValueError when order is not a list of steps [package]
+    or [package, macro]
+    '''
+    if not isinstance(order, list):
+        raise ValueError("recipe has to be a list of steps")
+    for number, step in enumerate(order, 1):
+        if not isinstance(step, list) or not 1 <= len(step) <= 2 or \
+                not all(isinstance(x, str) for x in step):
+            raise ValueError("step {} has to be [package] or [package, macro], not {!r}".format(
+                number, step))
+
+
 class Recipe(yaml.YAMLObject):
     '''
     Class to store order of building recipe, reads data from
@@ -69,13 +282,26 @@ class Recipe(yaml.YAMLObject):
         self.order = get_file_data(recipe_file)
         self.get_packages()
 
+    @classmethod
+    def from_order(cls, order):
+        '''
+        Creates recipe from already loaded list of steps
+        '''
+        recipe = cls.__new__(cls)
+        recipe.packages = set()
+        recipe.__order = [list(step) for step in order]
+        recipe.get_packages()
+        return recipe
+
     @property
     def order(self):
         return self.__order
 
     @order.setter
     def order(self, recipe_data):
-        self.__order = yaml.load(recipe_data)
+        order = load_yaml(recipe_data)
+        check_steps(order)
+        self.__order = order
 
     def get_packages(self):
         '''
@@ -0,0 +1,268 @@
+import os
+import json
+import stat
+import errno
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds an instance stays recorded as waiting after it asked for slots
+WAITING_TIMEOUT = 10
+
+
+class SlotPool(object):
+    '''
+    Limits number of packages built at once, one pool can be shared
+    by several builders, pool without size is not limited. Slots of
+    a pool with parent are taken from the parent too. Packages are
+    counted once however many chroots they are built in.
+    '''
+    shared = False  # slots are shared with other processes
+
+    def __init__(self, size=None, parent=None):
+        self.size = size
+        self.parent = parent
+        self.used = 0
+        self.peak = 0  # the most slots used at once
+        self.condition = threading.Condition()
+
+    def attach(self, pool):
+        '''
+        Makes pool parent of the last pool of the chain of parents
+        '''
+        last = self
+        while last.parent is not None:
+            last = last.parent
+        if last is not pool:
+            last.parent = pool
+
+    def chain(self):
+        '''
+        Yields the pool and all its parents
+        '''
+        pool = self
+        while pool is not None:
+            yield pool
+            pool = pool.parent
+
+    def acquire(self, n=1, blocking=True):
+        '''
+        Takes up to n free slots of the pool and its parents and returns
+        their number, waits until at least one slot is free, returns 0
+        instead of waiting when blocking is False. Slots of pools local to
+        the process are taken first, so slots shared with other processes
+        are never held while waiting for local ones.
+        '''
+        taken = []
+        for pool in sorted(self.chain(), key=lambda x: x.shared):
+            granted = pool.take(n, blocking)
+            if granted < n:
+                for previous in taken:
+                    previous.give(n - granted)
+            n = granted
+            if not n:
+                break
+            taken.append(pool)
+        return n
+
+    def release(self, n=1):
+        for pool in self.chain():
+            pool.give(n)
+
+    def take(self, n, blocking):
+        with self.condition:
+            if self.size is not None:
+                while self.used >= self.size:
+                    if not blocking:
+                        return 0
+                    self.condition.wait()
+                n = min(n, self.size - self.used)
+            self.used += n
+            self.peak = max(self.peak, self.used)
+            return n
+
+    def give(self, n):
+        with self.condition:
+            self.used -= n
+            self.condition.notify_all()
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class HostSlotPool(SlotPool):
+    '''
+    Slots shared by all rebuild_tool processes on the host, state of the
+    pool is kept in JSON file path locked during each change. Each
+    process gets share of size proportional to its weight, slots not
+    wanted by other processes can be taken over the share.
+    '''
+    shared = True
+
+    def __init__(self, path, size, weight=1, poll_interval=1, parent=None):
+        super(HostSlotPool, self).__init__(size, parent)
+        self.path = path
+        self.weight = weight
+        self.poll_interval = poll_interval
+        self.id = '{}-{}'.format(os.getpid(), id(self))
+        self.waiting_since = None
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+
+    def open(self):
+        '''
+        Returns descriptor of the state file, new file is made writable
+        by all users regardless of umask, so that processes of all users
+        can share it. Symlinks and other files than regular ones with one
+        link are refused, other users could point them to files of the user.
+        '''
+        while True:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW,
+                             0o666)
+                os.fchmod(fd, 0o666)
+                return fd
+            except FileExistsError:
+                try:
+                    fd = os.open(self.path, os.O_RDWR | os.O_NOFOLLOW | os.O_NONBLOCK)
+                except FileNotFoundError:
+                    continue
+            info = os.fstat(fd)
+            if not stat.S_ISREG(info.st_mode) or info.st_nlink != 1:
+                os.close(fd)
+                raise OSError(errno.EINVAL, "Not a regular file", self.path)
+            return fd
+
+    @staticmethod
+    def waiting(info):
+        '''
+        Number of slots the instance waits for, instances which didn't
+        ask for them in WAITING_TIMEOUT seconds don't wait anymore
+        '''
+        if time.time() - info.get('asked', 0) > WAITING_TIMEOUT:
+            return 0
+        return info['waiting']
+
+    def load(self, fo):
+        '''
+        Returns instances recorded in state file fo, content not written
+        by HostSlotPool, e.g. of a truncated or foreign file, is logged
+        and replaced by an empty state
+        '''
+        try:
+            content = fo.read()
+            instances = json.loads(content) if content else {}
+        except ValueError as e:
+            logger.warning("Ignoring corrupted build slots file {}: {}".format(self.path, e))
+            return {}
+        if not isinstance(instances, dict):
+            logger.warning("Ignoring build slots file {} without instances.".format(self.path))
+            return {}
+        fields = {'pid': int, 'used': int, 'waiting': int, 'weight': (int, float)}
+        for key in list(instances):
+            info = instances[key]
+            if not isinstance(info, dict) or \
+                    not all(isinstance(info.get(x), fields[x]) for x in fields) or \
+                    not isinstance(info.get('asked', 0), (int, float)) or \
+                    info['pid'] <= 0 or info['weight'] <= 0:
+                logger.warning("Ignoring invalid entry {} of build slots file {}.".format(
+                    key, self.path))
+                del instances[key]
+        return instances
+
+    @contextmanager
+    def state(self):
+        '''
+        Yields instances of the pool from the locked file, entries of
+        finished processes are dropped, changes are written back
+        '''
+        with os.fdopen(self.open(), 'r+') as fo:
+            fcntl.flock(fo, fcntl.LOCK_EX)
+            try:
+                instances = self.load(fo)
+                for key in [key for key, info in instances.items()
+                            if not pid_alive(info['pid'])]:
+                    logger.info("Dropping build slots of finished process {}.".format(
+                        instances[key]['pid']))
+                    del instances[key]
+                yield instances
+                for key in [key for key, info in instances.items()
+                            if not info['used'] and not self.waiting(info)]:
+                    del instances[key]
+                fo.seek(0)
+                fo.truncate()
+                json.dump(instances, fo, sort_keys=True)
+                fo.flush()
+            finally:
+                fcntl.flock(fo, fcntl.LOCK_UN)
+
+    def share(self, instances, key):
+        '''
+        Number of slots instance key is entitled to among active instances
+        '''
+        total_weight = sum(info['weight'] for info in instances.values())
+        return max(1, self.size * instances[key]['weight'] // total_weight)
+
+    def grant(self, instances, n):
+        '''
+        Returns number of slots up to n this instance can take now
+        '''
+        me = instances.setdefault(self.id, {'pid': os.getpid(), 'weight': self.weight,
+                                            'used': 0, 'waiting': 0})
+        free = self.size - sum(info['used'] for info in instances.values())
+        if free <= 0:
+            return 0
+        share = self.share(instances, self.id)
+        if me['used'] < share:
+            return min(n, free, share - me['used'])
+        starving = [key for key, info in instances.items() if key != self.id and
+                    self.waiting(info) and info['used'] < self.share(instances, key)]
+        return 0 if starving else min(n, free)
+
+    def take(self, n, blocking):
+        '''
+        Instance waiting for slots is recorded in the file so that other
+        processes leave it its share, time spent waiting is logged. Callers
+        of non-blocking take are recorded as waiting until they stop asking
+        for WAITING_TIMEOUT seconds.
+        '''
+        while True:
+            with self.condition:
+                with self.state() as instances:
+                    granted = self.grant(instances, n)
+                    me = instances[self.id]
+                    me['used'] += granted
+                    me['waiting'] = 0 if granted else n
+                    me['asked'] = time.time()
+                    self.used = me['used']
+                    self.peak = max(self.peak, self.used)
+                if granted:
+                    if self.waiting_since is not None:
+                        logger.info("Waited {:.1f} s in queue for build slots of {}.".format(
+                            time.time() - self.waiting_since, self.path))
+                        self.waiting_since = None
+                    return granted
+                if self.waiting_since is None:
+                    self.waiting_since = time.time()
+            if not blocking:
+                return 0
+            time.sleep(self.poll_interval)
+
+    def give(self, n):
+        with self.condition:
+            with self.state() as instances:
+                me = instances.setdefault(self.id, {'pid': os.getpid(), 'weight': self.weight,
+                                                    'used': 0, 'waiting': 0})
+                me['used'] = max(0, me['used'] - n)
+                self.used = me['used']
@@ -0,0 +1,238 @@
+import os
+import io
+import bz2
+import gzip
+import lzma
+import zlib
+import shutil
+import struct
+import hashlib
+import logging
+from contextlib import contextmanager
+
+from rebuild_tool.exceptions import SrpmFormatException
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+LEAD_SIZE = 96
+LEAD_MAGIC = b'\xed\xab\xee\xdb'
+HEADER_MAGIC = b'\x8e\xad\xe8\x01'
+CPIO_MAGICS = [b'070701', b'070702']
+CPIO_TRAILER = 'TRAILER!!!'
+
+# Header tags and types needed to read the payload
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+RPM_STRING_TYPE = 6
+RPM_STRING_ARRAY_TYPE = 8
+RPM_I18NSTRING_TYPE = 9
+
+CHUNK_SIZE = 1024 * 1024
+
+# Errors of decompressors reading corrupted or truncated payload
+PAYLOAD_ERRORS = (EOFError, OSError, lzma.LZMAError, zlib.error)
+if zstandard:
+    PAYLOAD_ERRORS += (zstandard.ZstdError,)
+
+
+def read_exactly(fileobj, size):
+    '''
+    Reads size bytes from fileobj, raises SrpmFormatException
+    if the file ends before
+    '''
+    data = fileobj.read(size)
+    if len(data) != size:
+        raise SrpmFormatException("Unexpected end of file.")
+    return data
+
+
+def align(fileobj, position, boundary):
+    '''
+    Skips padding bytes to the next multiple of boundary,
+    returns new position
+    '''
+    padding = (boundary - position % boundary) % boundary
+    read_exactly(fileobj, padding)
+    return position + padding
+
+
+class CpioEntry(object):
+    '''
+    File stored in cpio archive, data are available only while
+    the archive is being read, errors of reading them are converted
+    by errors context manager
+    '''
+    def __init__(self, name, mode, mtime, size, fileobj, errors):
+        self.name = name
+        self.mode = mode
+        self.mtime = mtime
+        self.size = size
+        self._fileobj = fileobj
+        self._errors = errors
+        self._remaining = size
+
+    @property
+    def is_file(self):
+        return self.mode & 0o170000 == 0o100000
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        with self._errors():
+            data = read_exactly(self._fileobj, size)
+        self._remaining -= size
+        return data
+
+    def skip(self):
+        while self._remaining:
+            self.read(CHUNK_SIZE)
+
+
+class SrpmReader(object):
+    '''
+    Reads srpm files without rpm2cpio and cpio, payload is
+    decompressed as a stream so single files can be extracted
+    without writing the rest of the archive to disk
+    '''
+    def __init__(self, srpm_file):
+        self.srpm_file = srpm_file
+        self.header = {}
+        with open(self.srpm_file, 'rb') as fi:
+            self.read_headers(fi)
+
+    def read_headers(self, fileobj):
+        '''
+        Reads lead, signature and main header of the rpm, stores string
+        tags of the main header to self.header and offsets of the main
+        header and the payload
+        '''
+        lead = read_exactly(fileobj, LEAD_SIZE)
+        if lead[:4] != LEAD_MAGIC:
+            raise SrpmFormatException("{} is not a rpm file.".format(self.srpm_file))
+        position = LEAD_SIZE
+        (_, position) = self._read_header(fileobj, position)
+        position = align(fileobj, position, 8)
+        self.header_offset = position
+        (self.header, position) = self._read_header(fileobj, position)
+        self.payload_offset = position
+
+    def _read_header(self, fileobj, position):
+        intro = read_exactly(fileobj, 16)
+        if intro[:4] != HEADER_MAGIC:
+            raise SrpmFormatException("Bad header magic in {}.".format(self.srpm_file))
+        (nindex, hsize) = struct.unpack('>II', intro[8:])
+        index = read_exactly(fileobj, nindex * 16)
+        store = read_exactly(fileobj, hsize)
+        tags = {}
+        for i in range(nindex):
+            (tag, tag_type, offset, count) = struct.unpack('>IIII', index[i * 16:i * 16 + 16])
+            if tag_type in [RPM_STRING_TYPE, RPM_STRING_ARRAY_TYPE, RPM_I18NSTRING_TYPE]:
+                values = store[offset:].split(b'\0')[:count]
+                values = [x.decode('utf-8', 'replace') for x in values]
+                tags[tag] = values[0] if tag_type == RPM_STRING_TYPE else values
+        return (tags, position + 16 + nindex * 16 + hsize)
+
+    @contextmanager
+    def payload_errors(self):
+        '''
+        Converts errors of reading the payload to SrpmFormatException,
+        only reading of the srpm is wrapped so that errors of writing
+        extracted files are not mistaken for a broken srpm
+        '''
+        try:
+            yield
+        except PAYLOAD_ERRORS as e:
+            raise SrpmFormatException("Failed to read payload of {}: {}".format(
+                self.srpm_file, e))
+
+    def payload_digest(self, algorithm='md5'):
+        '''
+        Returns hex digest of main header and payload, md5 digest
+        is the payloadhash koji stores for each rpm
+        '''
+        digest = hashlib.new(algorithm)
+        with open(self.srpm_file, 'rb') as fi, self.payload_errors():
+            fi.seek(self.header_offset)
+            for chunk in iter(lambda: fi.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @property
+    def compressor(self):
+        return self.header.get(RPMTAG_PAYLOADCOMPRESSOR, 'gzip')
+
+    def _payload(self, fileobj):
+        '''
+        Returns file object with decompressed payload
+        '''
+        fileobj.seek(self.payload_offset)
+        if self.compressor == 'gzip':
+            return gzip.GzipFile(fileobj=fileobj, mode='rb')
+        elif self.compressor == 'bzip2':
+            return bz2.BZ2File(fileobj, mode='rb')
+        elif self.compressor in ['xz', 'lzma']:
+            return lzma.LZMAFile(fileobj, mode='rb')
+        elif self.compressor == 'zstd' and zstandard:
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fileobj))
+        raise SrpmFormatException("Unsupported payload compressor {} of {}.".format(
+            self.compressor, self.srpm_file))
+
+    def entries(self):
+        '''
+        Generator of CpioEntry objects of all files in payload, data of
+        entry not read by consumer are skipped before next entry
+        '''
+        with open(self.srpm_file, 'rb') as fi, self.payload_errors():
+            payload = self._payload(fi)
+            position = 0
+            while True:
+                header = read_exactly(payload, 110)
+                if header[:6] not in CPIO_MAGICS:
+                    raise SrpmFormatException("Bad cpio header in {}.".format(self.srpm_file))
+                fields = [int(header[6 + i * 8:14 + i * 8], 16) for i in range(13)]
+                (mode, mtime, size, namesize) = (fields[1], fields[5], fields[6], fields[11])
+                name = read_exactly(payload, namesize)[:-1].decode('utf-8')
+                position = align(payload, position + 110 + namesize, 4)
+                if name == CPIO_TRAILER:
+                    return
+                entry = CpioEntry(name, mode, mtime, size, payload, self.payload_errors)
+                yield entry
+                entry.skip()
+                position = align(payload, position + size, 4)
+
+    def extract(self, dest_dir, select=None):
+        '''
+        Extracts files for which select(name) returns True (all files
+        when select is None) to dest_dir, returns list of extracted names
+        '''
+        extracted = []
+        for entry in self.entries():
+            if not entry.is_file or (select and not select(entry.name)):
+                continue
+            # srpm payload is flat, paths are never used
+            name = os.path.basename(entry.name)
+            path = os.path.join(dest_dir, name)
+            with open(path, 'wb') as fo:
+                shutil.copyfileobj(entry, fo, CHUNK_SIZE)
+            os.chmod(path, entry.mode & 0o7777)
+            os.utime(path, (entry.mtime, entry.mtime))
+            extracted.append(name)
+        logger.debug("Extracted %s from %s.", extracted, self.srpm_file)
+        return extracted
+
+    def extract_spec(self, dest_dir):
+        '''
+        Extracts only spec file, returns its name
+        '''
+        for entry in self.entries():
+            if entry.is_file and entry.name.endswith('.spec'):
+                name = os.path.basename(entry.name)
+                with open(os.path.join(dest_dir, name), 'wb') as fo:
+                    shutil.copyfileobj(entry, fo, CHUNK_SIZE)
+                os.utime(os.path.join(dest_dir, name), (entry.mtime, entry.mtime))
+                return name
+        raise SrpmFormatException("Spec file not found in {}.".format(self.srpm_file))
@@ -1,11 +1,24 @@
 import locale
 import os
+import sys
 import logging
+import asyncio
+import hashlib
+import functools
+import tempfile
+import threading
 
-from subprocess import Popen, PIPE, CalledProcessError
+from subprocess import Popen, PIPE, CalledProcessError, TimeoutExpired
 
 logger = logging.getLogger(__name__)
 
+# Maximal number of processes run at once by all threads of the tool
+max_processes = os.cpu_count() or 1
+
+# (max_processes, BoundedSemaphore) shared by all threads and event loops
+_process_slots = None
+_process_slots_lock = threading.Lock()
+
 def add_prefix(name, prefix):   #TODO remove prefix functions??
     if prefix in name:
         return name
@@ -18,12 +31,240 @@ def remove_prefix(name, prefix):
     else:
         return name[len(prefix):]
 
-def subprocess_popen_call(command):
-    proc = Popen(command, stdout=PIPE, stderr=PIPE)
-    stream_data = proc.communicate()
-    stdout_str = stream_data[0].decode(locale.getpreferredencoding())
-    stderr_str = stream_data[1].decode(locale.getpreferredencoding())
-    return {'returncode' : proc.returncode, 'stdout' : stdout_str, 'stderr' : stderr_str}
+@functools.lru_cache()
+def preferred_encoding():
+    '''
+    Returns encoding used to decode output of processes, the locale
+    is queried only once
+    '''
+    return locale.getpreferredencoding()
+
+def subprocess_popen_call(command, timeout=None, cwd=None):
+    '''
+    Runs command and waits for it to finish, returns dictionary
+    with returncode, stdout and stderr of the process
+    '''
+    return run_subprocess_calls([command], timeout, cwd)[0]
+
+def stream_lines(command, timeout=None, cwd=None):
+    '''
+    Runs command and yields lines of its stdout without line endings
+    as the process writes them, whole output is never kept in memory.
+    Raises CalledProcessError with stderr of the process when it exits
+    with non-zero status, the process is killed when the generator
+    is closed before the end of output. The process takes one slot of
+    the process limiter until it exits, it is killed and TimeoutExpired
+    raised when it doesn't finish in timeout seconds.
+    '''
+    encoding = preferred_encoding()
+    expired = threading.Event()
+    with process_slots(), tempfile.TemporaryFile() as stderr_file:
+        proc = Popen(command, stdout=PIPE, stderr=stderr_file, cwd=cwd)
+        timer = None
+        if timeout is not None:
+            def expire():
+                expired.set()
+                proc.kill()
+            timer = threading.Timer(timeout, expire)
+            timer.start()
+        try:
+            for line in proc.stdout:
+                yield line.decode(encoding).rstrip('\n')
+            proc.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if proc.returncode is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+        if expired.is_set():
+            raise TimeoutExpired(cmd=command, timeout=timeout)
+        if proc.returncode:
+            stderr_file.seek(0)
+            raise CalledProcessError(proc.returncode, command,
+                                     stderr=stderr_file.read().decode(encoding))
+
+def pipeline_call(commands, timeout=None, cwd=None):
+    '''
+    Runs commands connected by pipes (cmd1 | cmd2 | ...), returns
+    result dictionary of the pipeline, stderr of all the commands
+    is concatenated
+    '''
+    if not async_subprocess_available():
+        return _blocking_pipeline(commands, timeout, cwd)
+    return run_async(async_pipeline_call(commands, timeout, cwd))
+
+def run_subprocess_calls(commands, timeout=None, cwd=None):
+    '''
+    Runs all commands concurrently, at most max_processes at once,
+    returns list of result dictionaries in order of commands
+    '''
+    if not async_subprocess_available():
+        return [_blocking_pipeline([command], timeout, cwd) for command in commands]
+
+    async def run_all():
+        return await asyncio.gather(*[async_subprocess_call(command, timeout, cwd)
+                                      for command in commands])
+    return run_async(run_all())
+
+def run_async(coroutine):
+    '''
+    Runs coroutine in new event loop and returns its result
+    '''
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+def async_subprocess_available():
+    '''
+    Child processes of asyncio loops running outside of the main thread
+    can't be watched before Python 3.8
+    '''
+    return sys.version_info >= (3, 8) or threading.current_thread() is threading.main_thread()
+
+def process_slots():
+    '''
+    Returns semaphore limiting number of processes run at once by all
+    threads and event loops to max_processes
+    '''
+    global _process_slots
+    with _process_slots_lock:
+        if _process_slots is None or _process_slots[0] != max_processes:
+            _process_slots = (max_processes, threading.BoundedSemaphore(max_processes))
+        return _process_slots[1]
+
+async def _acquire_slot():
+    '''
+    Waits for free process slot without blocking the event loop,
+    returns the semaphore to be released
+    '''
+    slots = process_slots()
+    while not slots.acquire(blocking=False):
+        await asyncio.sleep(0.01)
+    return slots
+
+def _blocking_pipeline(commands, timeout=None, cwd=None):
+    with process_slots():
+        return _run_pipeline(commands, timeout, cwd)
+
+def _run_pipeline(commands, timeout=None, cwd=None):
+    procs = []
+    # stderr of all but the last process goes to temporary files
+    # so a full pipe can't block the pipeline
+    stderr_files = [tempfile.TemporaryFile() for command in commands[:-1]]
+    try:
+        for index, command in enumerate(commands):
+            stdin = procs[-1].stdout if procs else None
+            stderr = stderr_files[index] if index < len(stderr_files) else PIPE
+            procs.append(Popen(command, stdin=stdin, stdout=PIPE, stderr=stderr, cwd=cwd))
+            if stdin is not None:
+                stdin.close()
+        try:
+            stream_data = procs[-1].communicate(timeout=timeout)
+            for proc in procs[:-1]:
+                proc.wait(timeout)
+        except TimeoutExpired:
+            for proc in procs:
+                proc.kill()
+                proc.wait()
+            raise
+        stderr_str = ''
+        for stderr_file in stderr_files:
+            stderr_file.seek(0)
+            stderr_str += stderr_file.read().decode(preferred_encoding())
+    finally:
+        for stderr_file in stderr_files:
+            stderr_file.close()
+    stdout_str = stream_data[0].decode(preferred_encoding())
+    stderr_str += stream_data[1].decode(preferred_encoding())
+    returncode = 0
+    for proc in procs:
+        returncode = proc.returncode or returncode
+    return {'returncode' : returncode, 'stdout' : stdout_str, 'stderr' : stderr_str}
+
+async def _read_stream(stream, lines, line_callback=None):
+    '''
+    Reads stream line by line as the process writes it
+    '''
+    encoding = preferred_encoding()
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        line = line.decode(encoding)
+        if line_callback:
+            line_callback(line)
+        if lines is not None:
+            lines.append(line)
+
+async def _communicate(commands, procs, timeout, stdout_callback=None, capture_stdout=True):
+    stdout_lines = [] if capture_stdout else None
+    stderr_lines = []
+    readers = [_read_stream(procs[-1].stdout, stdout_lines, stdout_callback)]
+    readers += [_read_stream(proc.stderr, stderr_lines) for proc in procs]
+    try:
+        await asyncio.wait_for(asyncio.gather(*(readers + [proc.wait() for proc in procs])),
+                               timeout)
+    except asyncio.TimeoutError:
+        for proc in procs:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+        raise TimeoutExpired(cmd=commands, timeout=timeout)
+    returncode = 0
+    for proc in procs:
+        returncode = proc.returncode or returncode
+    return {'returncode' : returncode,
+            'stdout' : ''.join(stdout_lines) if capture_stdout else '',
+            'stderr' : ''.join(stderr_lines)}
+
+async def async_subprocess_call(command, timeout=None, cwd=None,
+                                stdout_callback=None, capture_stdout=True):
+    '''
+    Runs command in asyncio event loop, number of processes running
+    at once in all threads is limited by max_processes. Each line of stdout is passed
+    to stdout_callback as soon as the process writes it, with capture_stdout
+    False the output is not kept in memory. Raises TimeoutExpired when the
+    command is not finished in timeout seconds.
+    '''
+    slots = await _acquire_slot()
+    try:
+        proc = await asyncio.create_subprocess_exec(*command, stdout=PIPE, stderr=PIPE, cwd=cwd)
+        return await _communicate([command], [proc], timeout, stdout_callback, capture_stdout)
+    finally:
+        slots.release()
+
+async def async_pipeline_call(commands, timeout=None, cwd=None):
+    '''
+    Asynchronous version of pipeline_call, whole pipeline takes one
+    slot of the process limiter
+    '''
+    slots = await _acquire_slot()
+    try:
+        procs = []
+        stdin = None
+        for index, command in enumerate(commands):
+            if index < len(commands) - 1:
+                read_fd, write_fd = os.pipe()
+            else:
+                read_fd, write_fd = None, PIPE
+            try:
+                procs.append(await asyncio.create_subprocess_exec(
+                    *command, stdin=stdin, stdout=write_fd, stderr=PIPE, cwd=cwd))
+            finally:
+                if stdin is not None:
+                    os.close(stdin)
+                if read_fd is not None:
+                    os.close(write_fd)
+            stdin = read_fd
+        return await _communicate(commands, procs, timeout)
+    finally:
+        slots.release()
 
 class ChangeDir(object):
     '''
@@ -63,6 +304,23 @@ def check_bootstrap_macro(spec_file, macro):
             logger.error(sed_data['stderr'])
             raise CalledProcessError(cmd='sed', returncode=sed_data['returncode'])
 
+def file_digest(path, algorithm='sha256'):
+    '''
+    Returns hex digest of file content
+    '''
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as fi:
+        for chunk in iter(lambda: fi.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_path(name):
+    '''
+    Returns path of file name in user's cache directory
+    '''
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_dir, 'rebuild_tool', name)
+
 def base_name(name):
     '''
     Removes version and parentheses from package name
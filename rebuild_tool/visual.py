@@ -0,0 +1,263 @@
+import os
+import html
+import logging
+import threading
+import networkx as nx
+
+logger = logging.getLogger(__name__)
+
+COLORS = {'pending': '#1F9EDE',
+          'in_flight': '#F0AD4E',
+          'succeeded': '#5CB85C',
+          'failed': '#D9534F',
+          'blocked': '#999999'}
+
+NODE_WIDTH = 160
+NODE_HEIGHT = 30
+X_SPACING = 20
+Y_SPACING = 60
+
+
+def condense(G):
+    '''
+    Collapses each strongly connected component of G into one node,
+    returns condensed acyclic graph and dictionary node: members,
+    node of a component with more packages is named cycle<n>
+    '''
+    C = nx.DiGraph()
+    members = {}
+    node_of = {}
+    components = sorted((sorted(x) for x in nx.strongly_connected_components(G)),
+                        key=lambda x: x[0])
+    for n, component in enumerate(components):
+        node = component[0] if len(component) == 1 else 'cycle{}'.format(n)
+        members[node] = component
+        C.add_node(node)
+        for pkg in component:
+            node_of[pkg] = node
+    for (a, b) in G.edges():
+        if node_of[a] != node_of[b]:
+            C.add_edge(node_of[a], node_of[b])
+    return (C, members)
+
+
+def component_state(packages, states):
+    '''
+    Returns state of group of packages shown in collapsed node
+    '''
+    component_states = {states.get(x, 'pending') for x in packages}
+    for state in ['failed', 'in_flight', 'blocked', 'pending']:
+        if state in component_states:
+            return state
+    return 'succeeded'
+
+
+def label(node, packages):
+    if len(packages) == 1:
+        return packages[0]
+    return '{} packages'.format(len(packages))
+
+
+def to_dot(G, states=None, collapse=True):
+    '''
+    Returns graph in Graphviz DOT format, strongly connected components
+    are drawn as one node when collapse is True
+    '''
+    states = states or {}
+    if collapse:
+        (G, members) = condense(G)
+    else:
+        members = {x: [x] for x in G}
+    lines = ['digraph packages {',
+             '    rankdir=BT;',
+             '    node [shape=box, style=filled, fontcolor=white];']
+    for node in sorted(G):
+        attrs = {'label': label(node, members[node]),
+                 'fillcolor': COLORS[component_state(members[node], states)]}
+        if len(members[node]) > 1:
+            attrs.update({'tooltip': ' '.join(members[node]), 'shape': 'box3d'})
+        lines.append('    "{}" [{}];'.format(node, ', '.join(
+            '{}="{}"'.format(key, value) for key, value in sorted(attrs.items()))))
+    for (a, b) in sorted(G.edges()):
+        lines.append('    "{}" -> "{}";'.format(a, b))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def layout(C):
+    '''
+    Returns dictionary node: (x, y) of acyclic graph C, packages are
+    placed in layers above all their dependencies, order in each layer
+    is given by average position of dependencies
+    '''
+    level = {}
+    for node in reversed(nx.topological_sort(C)):
+        level[node] = max([level[x] + 1 for x in C.successors(node)] or [0])
+    layers = {}
+    for node, n in level.items():
+        layers.setdefault(n, []).append(node)
+    position = {}
+    for n in sorted(layers):
+        layer = sorted(layers[n])
+        if n:
+            layer.sort(key=lambda x: sum(position[y] for y in C.successors(x)) /
+                       max(C.out_degree(x), 1))
+        for index, node in enumerate(layer):
+            position[node] = index
+    height = max(layers or [0])
+    return {node: (position[node] * (NODE_WIDTH + X_SPACING),
+                   (height - level[node]) * (NODE_HEIGHT + Y_SPACING)) for node in C}
+
+
+def to_svg(G, states=None):
+    '''
+    Returns SVG image of graph with collapsed strongly connected components
+    '''
+    states = states or {}
+    (C, members) = condense(G)
+    positions = layout(C)
+    width = max([x for x, y in positions.values()] or [0]) + NODE_WIDTH
+    height = max([y for x, y in positions.values()] or [0]) + NODE_HEIGHT
+    lines = ['<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" '
+             'viewBox="0 0 {0} {1}" font-family="sans-serif" font-size="12">'.format(
+                 width, height),
+             '<g stroke="#888888" stroke-opacity="0.5">']
+    for (a, b) in C.edges():
+        (x1, y1) = positions[a]
+        (x2, y2) = positions[b]
+        lines.append('<line x1="{}" y1="{}" x2="{}" y2="{}"/>'.format(
+            x1 + NODE_WIDTH // 2, y1 + NODE_HEIGHT, x2 + NODE_WIDTH // 2, y2))
+    lines.append('</g>')
+    for node, (x, y) in sorted(positions.items()):
+        packages = members[node]
+        lines.append(
+            '<g><title>{}</title><rect x="{}" y="{}" width="{}" height="{}" rx="4" '
+            'fill="{}"/><text x="{}" y="{}" fill="white" text-anchor="middle">{}</text>'
+            '</g>'.format(html.escape(' '.join(packages)), x, y, NODE_WIDTH, NODE_HEIGHT,
+                          COLORS[component_state(packages, states)], x + NODE_WIDTH // 2,
+                          y + NODE_HEIGHT // 2 + 4, html.escape(label(node, packages)[:24])))
+    lines.append('</svg>')
+    return '\n'.join(lines) + '\n'
+
+
+def to_html(G, states=None):
+    '''
+    Returns static HTML page with SVG image of graph and summary of states
+    '''
+    states = states or {}
+    counts = {state: 0 for state in COLORS}
+    for pkg in G:
+        counts[states.get(pkg, 'pending')] += 1
+    legend = ' '.join('<span style="background:{};color:white;padding:2px 6px">{} {}</span>'
+                      .format(COLORS[state], state, counts[state]) for state in COLORS)
+    return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+            '<title>rebuild_tool</title></head>\n<body>\n<p>{}</p>\n{}</body></html>\n'
+            .format(legend, to_svg(G, states)))
+
+
+def write_graph(path, G, states=None):
+    '''
+    Writes graph to path in format given by extension .dot, .svg or .html,
+    file is replaced atomically
+    '''
+    formats = {'.dot': to_dot, '.gv': to_dot, '.svg': to_svg, '.html': to_html}
+    extension = os.path.splitext(path)[1]
+    if extension not in formats:
+        raise ValueError("Unknown graph format {}, use one of {}.".format(
+            extension, sorted(formats)))
+    data = formats[extension](G, states)
+    with open(path + '.tmp', 'w') as fo:
+        fo.write(data)
+    os.replace(path + '.tmp', path)
+
+
+class GraphWriter(threading.Thread):
+    '''
+    Thread periodically writing the last published state of builder
+    to path, file is written only when the state changed
+    '''
+    def __init__(self, builder, path, interval=5):
+        super(GraphWriter, self).__init__()
+        self.daemon = True
+        self.builder = builder
+        self.path = path
+        self.interval = interval
+        self.version = None
+        self.stopped = threading.Event()
+
+    def write(self):
+        state = self.builder.state
+        if state.version != self.version:
+            write_graph(self.path, state.graph, state.states)
+            self.version = state.version
+
+    def safe_write(self):
+        try:
+            self.write()
+        except OSError:
+            logger.error("Failed to write graph to {}.".format(self.path), exc_info=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.safe_write()
+
+    def stop(self):
+        '''
+        Stops the thread and writes the final state
+        '''
+        self.stopped.set()
+        self.safe_write()
+
+
+def draw(G, states=None, builder=None, interval=1):
+    '''
+    Draws graph using matplotlib, colors of nodes follow states
+    published by builder until the window is closed
+    '''
+    import matplotlib.pyplot as plt
+    states = states or {}
+    try:
+        pos = nx.graphviz_layout(G)
+    except (ImportError, AttributeError):
+        pos = nx.circular_layout(G)
+    node_size = max(12000 // max(len(G), 1), 300)
+    nodelist = list(G.nodes())
+
+    def colors(states):
+        return [COLORS[states.get(x, 'pending')] for x in nodelist]
+
+    figure = plt.figure()
+    nodes = nx.draw_networkx_nodes(G, pos, nodelist=nodelist, node_size=node_size,
+                                   alpha=0.9, node_color=colors(states))
+    nx.draw_networkx_edges(G, pos, alpha=0.9)
+    if len(G) < 100:
+        nx.draw_networkx_labels(G, pos)
+    plt.axis('off')
+    if builder is None:
+        plt.show()
+        return
+
+    # Observers are called from scheduler thread, figure is redrawn by timer
+    # of the main thread when a new state was published
+    changed = threading.Event()
+
+    def observer(state):
+        changed.set()
+
+    def refresh():
+        if changed.is_set():
+            changed.clear()
+            nodes.set_color(colors(builder.state.states))
+            figure.canvas.draw_idle()
+
+    builder.subscribe(observer)
+    changed.set()
+    timer = figure.canvas.new_timer(interval=interval * 1000)
+    timer.add_callback(refresh)
+    timer.start()
+    try:
+        refresh()
+        plt.show()
+    finally:
+        timer.stop()
+        builder.unsubscribe(observer)
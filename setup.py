@@ -31,6 +31,7 @@ setup(
     url='https://github.com/mcyprian/rebuild_tool',
     license='MIT',
     packages=['rebuild_tool', ],
+    python_requires='>=3.6',
     install_requires=['click',
                       'networkx',
                       'matplotlib',
@@ -46,6 +47,7 @@ setup(
                  'License :: OSI Approved :: MIT License',
                  'Operating System :: POSIX :: Linux',
                  'Programming Language :: Python',
+                 'Programming Language :: Python :: 3 :: Only',
                  'Topic :: Software Development :: Build Tools',
                  ]
 )
@@ -0,0 +1,122 @@
+import re
+import json
+import email
+import threading
+from urllib.parse import unquote_plus
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from rebuild_tool.builder_plugins.local import BuildService
+
+
+class CoprHandler(BaseHTTPRequestHandler):
+    '''
+    Serves Copr API endpoints used by Copr builder, builds
+    are simulated by BuildService of the server
+    '''
+    routes = [
+        ('GET', r'^/api/coprs/build/(\d+)/$', 'build_details'),
+        ('GET', r'^/api/coprs/([^/]+)/$', 'projects_list'),
+        ('POST', r'^/api/coprs/([^/]+)/new/$', 'new_project'),
+        ('POST', r'^/api/coprs/([^/]+)/([^/]+)/new_build_upload/$', 'new_build'),
+        ('POST', r'^/api/coprs/([^/]+)/([^/]+)/modify/$', 'modify_project'),
+        ('POST', r'^/api/coprs/([^/]+)/([^/]+)/modify/([^/]+)/$', 'modify_chroot'),
+    ]
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        for (route_method, pattern, name) in self.routes:
+            match = re.match(pattern, self.path)
+            if route_method == method and match:
+                (status, data) = getattr(self, name)(*match.groups())
+                break
+        else:
+            (status, data) = (404, {'output': 'notok', 'error': 'Not found'})
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def form(self):
+        '''
+        Returns dictionary of fields of posted multipart or urlencoded form,
+        value of file field is its file name
+        '''
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        content_type = self.headers['Content-Type']
+        if not content_type.startswith('multipart/'):
+            return dict(x.split('=', 1) for x in body.decode().split('&') if x)
+        message = email.message_from_bytes(
+            'Content-Type: {}\r\n\r\n'.format(content_type).encode() + body)
+        fields = {}
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            fields[name] = part.get_filename() or part.get_payload()
+        return fields
+
+    def projects_list(self, user):
+        return (200, {'output': 'ok', 'repos': [{'name': x} for x in self.server.projects]})
+
+    def new_project(self, user):
+        fields = self.form()
+        self.server.projects.add(fields['name'])
+        self.server.repos[fields['name']] = unquote_plus(fields.get('repos', '')).split()
+        return (200, {'output': 'ok', 'message': 'Project created.'})
+
+    def modify_project(self, user, project):
+        self.server.repos[project] = unquote_plus(self.form().get('repos', '')).split()
+        return (200, {'output': 'ok', 'message': 'Project modified.'})
+
+    def new_build(self, user, project):
+        fields = self.form()
+        chroots = [x for x, value in fields.items() if value == 'y']
+        build_id = self.server.service.submit(fields['pkgs'], chroots)
+        self.server.build_projects[build_id] = project
+        return (200, {'output': 'ok', 'ids': [build_id], 'message': 'Build was added.'})
+
+    def build_details(self, build_id):
+        data = self.server.service.details(int(build_id))
+        data.update({'output': 'ok', 'project': None, 'owner': None, 'results': None,
+                     'built_pkgs': [], 'src_version': None})
+        return (200, data)
+
+    def modify_chroot(self, user, project, chroot):
+        return (200, {'output': 'ok', 'error': None, 'buildroot_pkgs': ''})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeCopr(ThreadingMixIn, HTTPServer):
+    '''
+    HTTP server simulating Copr on random local port
+    '''
+    daemon_threads = True
+
+    def __init__(self, service=None, projects=None):
+        super(FakeCopr, self).__init__(('127.0.0.1', 0), CoprHandler)
+        self.service = service or BuildService()
+        self.projects = set(projects or [])
+        self.repos = {}  # project: repos of its buildroot
+        self.build_projects = {}  # build_id: project
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
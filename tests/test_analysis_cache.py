@@ -0,0 +1,115 @@
+import os
+import pytest
+import networkx as nx
+from flexmock import flexmock
+
+from rebuild_tool import builder as builder_module
+from rebuild_tool.builder import Builder
+from rebuild_tool.graph import PackageGraph
+from rebuild_tool.analysis_cache import AnalysisCache
+from rebuild_tool.pkg_source import CachedArchive
+from rebuild_tool.exceptions import MissingRecipeException
+
+tests_dir = os.path.split(os.path.abspath(__file__))[0]
+
+
+@pytest.fixture
+def cache(tmpdir):
+    cache = AnalysisCache(str(tmpdir.join('cache', 'analysis.db')))
+    yield cache
+    cache.close()
+
+
+def archive(package, rpms, dependencies):
+    return flexmock(package=package, srpm_file=package + '-1.0-1.src.rpm',
+                    full_path_srpm='/srpms/' + package + '-1.0-1.src.rpm',
+                    rpms=set(rpms), dependencies=set(dependencies))
+
+
+pkg_source = {'pkg1': archive('pkg1', ['pkg1', 'pkg1-devel'], ['pkg2']),
+              'pkg2': archive('pkg2', ['pkg2'], ['pkg1-devel', 'gcc']),
+              'pkg3': archive('pkg3', ['pkg3'], ['pkg1'])}
+
+
+class TestAnalysisCache(object):
+
+    def test_store_load(self, cache):
+        cache.store('snapshot1', pkg_source)
+        assert cache.load('snapshot1', {'pkg2', 'pkg4'}) == {
+            'pkg2': ('pkg2-1.0-1.src.rpm', {'pkg2'}, {'pkg1-devel', 'gcc'})}
+        assert cache.load('snapshot2', {'pkg2'}) == {}
+
+    def test_cycles(self, cache):
+        assert cache.cycles('component') is None
+        cache.store_cycles('component', [{'pkg1', 'pkg2'}])
+        assert cache.cycles('component') == [{'pkg1', 'pkg2'}]
+
+    def test_get_cycles(self, cache):
+        graph = PackageGraph('rawhide', pkg_source)
+        graph.make_graph()
+        assert graph.get_cycles(cache) == [{'pkg1', 'pkg2'}]
+        # Second analysis of the same component doesn't search for cycles
+        flexmock(nx).should_receive('simple_cycles').never()
+        assert graph.get_cycles(cache) == [{'pkg1', 'pkg2'}]
+
+
+class Container(dict):
+    '''
+    Packages source adding packages from pkg_source
+    '''
+    def __init__(self):
+        super(Container, self).__init__()
+        self.added = set()
+
+    def add(self, package, pkg_dir, repo, prefix, koji_tag):
+        self.added.add(package)
+        self[package] = pkg_source[package]
+
+
+class TestBuilderAnalysisCache(object):
+
+    @pytest.mark.parametrize(('analysis_only', 'revision', 'fetched'), [
+        (True, '1476277245', {'pkg3'}),
+        (False, '1476277245', {'pkg1', 'pkg2', 'pkg3'}),
+        (True, None, {'pkg1', 'pkg2', 'pkg3'}),
+    ])
+    def test_get_files(self, cache, analysis_only, revision, fetched):
+        container = Container()
+        snapshot = '["{}", "rawhide", "1476277245", "", null]'.format(Container.__module__)
+        cache.store(snapshot, {x: pkg_source[x] for x in ['pkg1', 'pkg2']})
+        flexmock(builder_module).should_receive('repo_revision').and_return(revision)\
+            .times(1 if analysis_only else 0)
+        flexmock(builder_module.os.path).should_receive('getsize').and_return(1)
+        builder = Builder({'packages': ['pkg1', 'pkg2', 'pkg3'], 'repo': 'rawhide',
+                           'prefix': '', 'koji_tag': None, 'history_db': ':memory:',
+                           'analysis_cache': cache.path, 'analysis_only': analysis_only},
+                          container)
+        assert container.added == fetched
+        assert isinstance(container['pkg1'], CachedArchive) == (fetched == {'pkg3'})
+        with pytest.raises(MissingRecipeException):
+            builder.get_relations()
+        assert builder.circular_deps == [{'pkg1', 'pkg2'}]
+        assert ('pkg3' in cache.load(snapshot, {'pkg3'})) == bool(revision and analysis_only)
+
+    @pytest.mark.parametrize(('selection', 'selected', 'fetched'), [
+        ({'only': ['pkg3']}, {'pkg3'}, {'pkg3'}),
+        ({'from_packages': ['pkg2']}, {'pkg1', 'pkg2', 'pkg3'}, {'pkg1', 'pkg2', 'pkg3'}),
+        ({'to_packages': ['pkg1']}, {'pkg1', 'pkg2'}, {'pkg1', 'pkg2'}),
+    ])
+    def test_partial_rebuild(self, cache, selection, selected, fetched):
+        container = Container()
+        snapshot = '["{}", "rawhide", "1476277245", "", null]'.format(Container.__module__)
+        cache.store(snapshot, pkg_source)
+        flexmock(builder_module).should_receive('repo_revision').and_return('1476277245')
+        flexmock(builder_module.os.path).should_receive('getsize').and_return(1)
+        builder = Builder({'packages': ['pkg1', 'pkg2', 'pkg3'], 'repo': 'rawhide',
+                           'prefix': '', 'koji_tag': None, 'history_db': ':memory:',
+                           'analysis_cache': cache.path, 'select': selection,
+                           'recipes': ['{}/test_data/recipe.yml'.format(tests_dir)]},
+                          container)
+        assert container.added == set()
+        builder.get_relations()
+        assert builder.packages == selected
+        assert set(builder.graph.G) == selected
+        assert container.added == fetched
+        assert bool(builder.recipes) == ('pkg1' in selected)
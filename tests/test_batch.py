@@ -0,0 +1,84 @@
+import time
+import pytest
+from flexmock import flexmock
+
+from rebuild_tool import builder as builder_module
+from rebuild_tool.batch import Batch, check_batch
+from rebuild_tool.metrics import registry
+from rebuild_tool.pkg_source_plugins import pkg_source_loader
+from rebuild_tool.exceptions import IncompleteMetadataException
+
+
+class Container(dict):
+    '''
+    Packages source counting added packages, pkgN-sub requires
+    pkg(N-10)-sub
+    '''
+    added = []
+
+    def add(self, package, pkg_dir, repo, prefix, koji_tag):
+        Container.added.append(package)
+        number = int(package[3:])
+        self[package] = flexmock(package=package, rpms={package + '-sub'},
+                                 dependencies={'pkg{}-sub'.format(number - 10)},
+                                 full_path_srpm='/tmp/{}-1.0-1.fc24.src.rpm'.format(package))
+
+
+def metadata(packages, **kwargs):
+    return dict({'build_system': 'local', 'packages_source': 'dnf', 'repo': 'rawhide',
+                 'prefix': '', 'koji_tag': None, 'history_db': ':memory:',
+                 'local_build_latency': 0, 'packages': packages}, **kwargs)
+
+
+@pytest.fixture
+def batch(monkeypatch):
+    Container.added = []
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    flexmock(pkg_source_loader).should_receive('load_plugin').and_return(
+        flexmock(PkgsContainer=Container))
+    flexmock(builder_module).should_receive('repo_revision').and_return(None)
+    flexmock(builder_module.os.path).should_receive('getsize').and_return(1)
+
+
+class TestBatch(object):
+
+    @pytest.mark.parametrize(('batch_metadata', 'valid'), [
+        ([metadata(['pkg1']), metadata(['pkg2'], koji_tag='f24', packages_source='koji')], True),
+        ([metadata(['pkg1']), metadata(['pkg2'], prefix='rh-python35-')], False),
+        ([metadata(['pkg1'], koji_tag='f24'), metadata(['pkg2'], koji_tag='f25')], False),
+    ])
+    def test_check_batch(self, batch_metadata, valid):
+        if valid:
+            check_batch(batch_metadata)
+        else:
+            with pytest.raises(IncompleteMetadataException):
+                check_batch(batch_metadata)
+
+    @pytest.mark.parametrize('chroot_scheduling', ['together', 'independent'])
+    def test_shared_packages(self, batch, chroot_scheduling):
+        first = ['pkg{}'.format(x) for x in range(1, 30)]
+        second = ['pkg{}'.format(x) for x in range(20, 50)]
+        batch = Batch([metadata(first, chroot_scheduling=chroot_scheduling),
+                       metadata(second, chroot_scheduling=chroot_scheduling)], build_slots=3)
+        batch.create_builders()
+        assert sorted(Container.added) == sorted(set(first + second))
+        assert set(batch.builders[0].graph.G) == set(first)
+        assert set(batch.builders[1].graph.G) == set(second)
+        assert batch.builders[0].pkg_source is batch.builders[1].pkg_source
+        assert batch.run_building()
+        assert batch.builders[0].built_packages == set(first)
+        assert batch.builders[1].built_packages == set(second)
+        assert batch.slots.used == 0
+        assert batch.slots.peak == 3
+        # gauges of each Rebuild file are kept apart
+        text = registry.render()
+        assert 'rebuild_packages{{rebuild="0",state="succeeded"}} {}'.format(len(first)) in text
+        assert 'rebuild_packages{{rebuild="1",state="succeeded"}} {}'.format(len(second)) in text
+
+    def test_failed_rebuild(self, batch):
+        batch = Batch([metadata(['pkg1', 'pkg2']),
+                       metadata(['pkg3'], local_fail_packages=['pkg3'])])
+        batch.create_builders()
+        assert not batch.run_building()
+        assert batch.builders[0].built_packages == {'pkg1', 'pkg2'}
+        assert batch.builders[1].failed_packages == {'pkg3'}
@@ -0,0 +1,75 @@
+import os
+import sys
+import pytest
+import subprocess
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code, *args):
+    return subprocess.run([sys.executable, '-c', code] + list(args), cwd=project_dir,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+class TestStartup(object):
+
+    @pytest.mark.parametrize('module', ['copr', 'matplotlib', 'networkx'])
+    def test_lazy_imports(self, module):
+        proc = run_python("import sys, rebuild_tool.bin\n"
+                          "print(' '.join(x.split('.')[0] for x in sys.modules))")
+        assert module not in proc.stdout.split()
+
+    def test_printer_plugin_without_copr(self):
+        proc = run_python("import sys\n"
+                          "from rebuild_tool.builder_plugins import builder_loader\n"
+                          "builder_loader.load_plugin('printer')\n"
+                          "print('copr' in sys.modules)")
+        assert proc.stdout.strip() == 'False'
+
+    def test_help_imports(self):
+        proc = run_python("import sys\n"
+                          "from rebuild_tool.bin import main\n"
+                          "try:\n"
+                          "    main()\n"
+                          "except SystemExit:\n"
+                          "    print(' '.join(x.split('.')[0] for x in sys.modules))",
+                          '--help')
+        assert 'REBUILD_FILE' in proc.stdout
+        assert not {'copr', 'matplotlib', 'networkx'} & set(proc.stdout.split())
+
+
+class TestHistory(object):
+
+    @pytest.fixture
+    def history_db(self, tmpdir):
+        from rebuild_tool.history import BuildHistory
+        history = BuildHistory(str(tmpdir.join('history.db')))
+        history.record('configured', 'f24', 'succeeded', 0, 0, 100)
+        history.close()
+        return str(tmpdir.join('history.db'))
+
+    def test_history_db_option(self, history_db):
+        proc = run_python("from rebuild_tool.bin import main; main()",
+                          '--history', '--history-db', history_db)
+        assert 'configured' in proc.stdout
+
+    def test_history_db_of_rebuild_file(self, tmpdir, history_db):
+        tmpdir.join('Rebuild.yml').write("build_system: copr\npackages_source: dnf\n"
+                                         "repo: rawhide\npackages: [pkg1]\n"
+                                         "history_db: {}\n".format(history_db))
+        proc = run_python("from rebuild_tool.bin import main; main()",
+                          '--history', str(tmpdir.join('Rebuild.yml')))
+        assert 'configured' in proc.stdout
+
+
+class TestOptions(object):
+
+    @pytest.mark.parametrize('slots', ['0', '-1'])
+    def test_build_slots_range(self, tmpdir, slots):
+        from click.testing import CliRunner
+        from rebuild_tool.bin import main
+        tmpdir.join('Rebuild.yml').write("build_system: copr\n")
+        result = CliRunner().invoke(main, ['--build-slots', slots, str(tmpdir.join('Rebuild.yml'))])
+        assert result.exit_code == 2
+        assert '--build-slots' in result.output
@@ -0,0 +1,129 @@
+import os
+import json
+import pytest
+import networkx as nx
+from flexmock import flexmock
+
+from rebuild_tool import builder as builder_module
+from rebuild_tool import utils
+from rebuild_tool.builder import check_build
+from rebuild_tool.builder_plugins import printer
+from rebuild_tool.build_plan import plan_order, write_plan, read_plan
+from rebuild_tool.pkg_source import PkgSrcArchive
+from rebuild_tool.pkg_source_plugins import dnf
+from rebuild_tool.pkg_source_plugins.dnf import DnfArchive
+from rebuild_tool.exceptions import BuildPlanException
+
+# package: packages it requires, pkg5 and pkg6 depend on each other
+DEPS = {'pkg1': [], 'pkg2': ['pkg1'], 'pkg3': ['pkg1'], 'pkg4': ['pkg3'],
+        'pkg5': ['pkg2', 'pkg6'], 'pkg6': ['pkg5']}
+
+
+def download(self):
+    self.srpm_file = '{}-1.0-1.fc24.src.rpm'.format(self.package)
+    with open(self.full_path_srpm, 'w') as fo:
+        fo.write(self.package)
+
+
+def unpack(self):
+    self.spec_file = self.package + '.spec'
+    with open(self.full_path_spec, 'w') as fo:
+        fo.write('%global bootstrap 1\n')
+    self.spec_digest = 'digest'
+    self.sources_extracted = False
+    self._dependencies = frozenset(x + '-sub' for x in DEPS[self.package])
+
+
+class RecordingBuilder(printer.RealBuilder):
+
+    @check_build
+    def build(self, pkgs, verbose=True):
+        self.order.append(list(pkgs))
+        return True
+
+
+@pytest.fixture
+def plan_builder(monkeypatch, tmpdir):
+    monkeypatch.setattr(DnfArchive, 'download', download)
+    monkeypatch.setattr(DnfArchive, 'unpack', unpack)
+    monkeypatch.setattr(DnfArchive, 'pack', lambda self: None)
+    monkeypatch.setattr(dnf.PkgsContainer, 'prefetch', lambda self, *args, **kwargs: None)
+    monkeypatch.setattr(DnfArchive, 'rpms_from_spec',
+                        property(lambda self: {self.package, self.package + '-sub'}))
+    monkeypatch.setattr(PkgSrcArchive, 'repo', 'rawhide')
+    monkeypatch.setattr(PkgSrcArchive, 'prefix', '')
+    flexmock(builder_module).should_receive('repo_revision').and_return(None)
+    recipe = tmpdir.join('recipe.yml')
+    recipe.write("- ['pkg5', 'bootstrap 0']\n- ['pkg6']\n- ['pkg5', 'bootstrap 1']\n")
+
+    def create(**kwargs):
+        builder = RecordingBuilder(dict({'packages': sorted(DEPS), 'packages_source': 'dnf',
+                                         'repo': 'rawhide', 'prefix': '', 'koji_tag': None,
+                                         'history_db': ':memory:', 'recipes': [str(recipe)]},
+                                        **kwargs),
+                                   dnf.PkgsContainer())
+        builder.order = []
+        return builder
+    return create
+
+
+class TestBuildPlan(object):
+
+    @pytest.mark.parametrize(('edges', 'layers', 'priorities'), [
+        ([('a', 'b'), ('b', 'c')], [['c'], ['b'], ['a']], {'a': 0, 'b': 1, 'c': 2}),
+        ([('a', 'c'), ('b', 'c'), ('a', 'd')], [['c', 'd'], ['a', 'b']],
+         {'a': 0, 'b': 0, 'c': 1, 'd': 1}),
+        ([('a', 'b'), ('b', 'a'), ('b', 'c'), ('d', 'a')], [['c'], ['a', 'b'], ['d']],
+         {'a': 1, 'b': 1, 'c': 2, 'd': 0}),
+        ([], [], {}),
+    ])
+    def test_plan_order(self, edges, layers, priorities):
+        G = nx.DiGraph()
+        G.add_edges_from(edges)
+        assert plan_order(G) == (layers, priorities)
+
+    def test_write_and_execute(self, plan_builder, tmpdir):
+        path = str(tmpdir.join('plan.json'))
+        builder = plan_builder()
+        builder.get_relations()
+        write_plan(path, builder)
+        with open(path) as fi:
+            plan = json.load(fi)
+        assert plan['layers'] == [['pkg1'], ['pkg2', 'pkg3'], ['pkg4', 'pkg5', 'pkg6']]
+        assert plan['recipes'] == [{'steps': [['pkg5', 'bootstrap 0'], ['pkg6'],
+                                              ['pkg5', 'bootstrap 1']],
+                                    'requires': ['pkg2']}]
+        assert plan['packages']['pkg5']['requires'] == ['pkg2', 'pkg6']
+        assert plan['packages']['pkg1']['priority'] == 2
+        assert os.path.isfile(str(tmpdir.join('plan_files', 'pkg4', 'pkg4.spec')))
+
+        flexmock(DnfArchive).should_receive('__init__').never()
+        flexmock(utils).should_receive('check_bootstrap_macro').times(2)
+        flexmock(utils).should_receive('edit_bootstrap').times(2)
+        builder = plan_builder(build_plan=path, packages=[])
+        builder.get_relations()
+        assert set(builder.graph.G.edges()) == {(pkg, dep) for pkg, deps in DEPS.items()
+                                                for dep in deps}
+        assert builder.pkg_source['pkg5'].pkg_dir.startswith(builder.path)
+        assert builder.pkg_source['pkg4'].pkg_dir == str(tmpdir.join('plan_files', 'pkg4')) + '/'
+        builder.run_building()
+        assert builder.order == [['pkg1'], ['pkg2', 'pkg3'], ['pkg4'],
+                                 ['pkg5'], ['pkg6'], ['pkg5']]
+        assert builder.built_packages == set(DEPS)
+
+    def test_changed_srpm(self, plan_builder, tmpdir):
+        path = str(tmpdir.join('plan.json'))
+        builder = plan_builder()
+        builder.get_relations()
+        write_plan(path, builder)
+        tmpdir.join('plan_files', 'pkg2', 'pkg2-1.0-1.fc24.src.rpm').write('changed')
+        with pytest.raises(BuildPlanException):
+            read_plan(path)
+
+    def test_other_repo(self, plan_builder, tmpdir):
+        path = str(tmpdir.join('plan.json'))
+        builder = plan_builder()
+        builder.get_relations()
+        write_plan(path, builder)
+        with pytest.raises(BuildPlanException):
+            plan_builder(build_plan=path, repo='f25')
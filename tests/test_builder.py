@@ -2,13 +2,17 @@ import pytest
 from flexmock import flexmock
 import os
 import sys
+import time
+import threading
 from copr.client import CoprClient
+from copr.exceptions import CoprRequestException
 
-from rebuild_tool.builder_plugins.copr import RealBuilder
-from rebuild_tool.builder import Builder
+from rebuild_tool.builder_plugins.copr import RealBuilder, CoprApi
+from rebuild_tool.builder import Builder, PackageStates, check_build
 from rebuild_tool.graph import PackageGraph
 from rebuild_tool.pkg_source_plugins.dnf import DnfArchive
-from rebuild_tool.exceptions import MissingRecipeException
+from rebuild_tool.exceptions import MissingRecipeException, BuildSystemException
+from rebuild_tool.slots import SlotPool
 from rebuild_tool import utils 
 
 tests_dir = os.path.split(os.path.abspath(__file__))[0]
@@ -84,11 +88,281 @@ class TestBuilder(object):
             assert builder.find_recipe(pkg).packages == expected
        
 
+    def test_recipe_readiness(self, tmpdir):
+        builder = create_mocked_builder()
+        second = tmpdir.join('second.yml')
+        second.write("- ['pkg3', 'bootstrap 0']\n- ['pkg4']\n- ['pkg3', 'bootstrap 1']\n")
+        builder.recipes = metadata['recipes'] + [str(second)]
+        builder.packages = {'pkg1', 'pkg2', 'pkg3', 'pkg4', 'pkg5', 'pkg6'}
+        # recipe of pkg1 and pkg2 requires pkg3 and pkg5, recipe of pkg3 and pkg4 requires pkg6
+        builder.graph.G.add_edges_from([('pkg1', 'pkg2'), ('pkg2', 'pkg1'), ('pkg1', 'pkg3'),
+                                        ('pkg2', 'pkg5'), ('pkg3', 'pkg4'), ('pkg4', 'pkg3'),
+                                        ('pkg4', 'pkg6')])
+        (first, second) = builder.recipes
+        assert builder.find_recipe('pkg4') is second
+        assert builder.next_recipe() is None
+        builder.mark_built('pkg5')
+        builder.mark_built('pkg6')
+        assert builder.next_recipe() is second
+        assert builder.next_recipe() is None
+        builder.remove_recipe(second)
+        builder.mark_built('pkg3', remove_node=False)
+        builder.mark_built('pkg4', remove_node=False)
+        assert builder.next_recipe() is first
+        assert builder.recipes == [first]
+        with pytest.raises(MissingRecipeException):
+            builder.find_recipe('pkg4')
+
     def test_build_following_recipe(self):
         builder = create_mocked_builder()
-        flexmock(RealBuilder).should_receive('build').times(3)
+        flexmock(RealBuilder).should_receive('build').times(3).and_return(True)
         flexmock(utils).should_receive('check_bootstrap_macro').twice()
         flexmock(utils).should_receive('edit_bootstrap').twice()
         flexmock(builder.graph.G).should_receive('remove_node').times(2)
         builder.build_following_recipe(builder.recipes[0])
 
+    def test_run_building_per_chroot(self):
+        builder = create_mocked_builder()
+        builder.chroots = ['fast', 'slow']
+        builder.chroot_scheduling = 'independent'
+        builder.recipes = None
+        builder.packages = {'pkg1', 'pkg2'}
+        builder.graph.G.add_edge('pkg1', 'pkg2')
+        submitted = []
+        polls = {}
+
+        def submit(pkg, chroots):
+            submitted.append((pkg, chroots[0]))
+            return [flexmock(build_id=len(submitted), chroot=chroots[0])]
+
+        def poll(bw):
+            polls[bw] = polls.get(bw, 0) + 1
+            if bw.chroot == 'slow' and polls[bw] < 3:
+                return None
+            return flexmock(status='succeeded', data={})
+
+        flexmock(time).should_receive('sleep')
+        flexmock(builder).should_receive('submit').replace_with(submit)
+        flexmock(builder).should_receive('poll').replace_with(poll)
+        flexmock(builder.history).should_receive('record')
+        builder.run_building()
+        assert submitted == [('pkg2', 'fast'), ('pkg2', 'slow'), ('pkg1', 'fast'), ('pkg1', 'slow')]
+        assert builder.built_packages == {'pkg1', 'pkg2'}
+
+    @pytest.mark.parametrize('fail_submit', [False, True])
+    def test_run_building_per_chroot_slots(self, fail_submit):
+        builder = create_mocked_builder()
+        builder.chroots = ['f23', 'f24']
+        builder.chroot_scheduling = 'independent'
+        builder.recipes = None
+        builder.packages = {'pkg1', 'pkg2'}
+        builder.slots = SlotPool(1)
+        builder.graph.G.add_edge('pkg1', 'pkg2')
+        submitted = []
+
+        def submit(pkg, chroots):
+            if fail_submit and submitted:
+                raise BuildSystemException("Copr is not available")
+            submitted.append((pkg, chroots[0]))
+            return [flexmock(build_id=len(submitted), chroot=chroots[0])]
+
+        flexmock(time).should_receive('sleep')
+        flexmock(builder).should_receive('submit').replace_with(submit)
+        flexmock(builder).should_receive('poll').and_return(
+            flexmock(status='succeeded', data={}))
+        flexmock(builder.history).should_receive('record')
+        if fail_submit:
+            with pytest.raises(BuildSystemException):
+                builder.run_building()
+        else:
+            builder.run_building()
+            # one slot covers builds of a package in all chroots
+            assert submitted == [('pkg2', 'f23'), ('pkg2', 'f24'),
+                                 ('pkg1', 'f23'), ('pkg1', 'f24')]
+        assert builder.slots.peak == 1
+        assert builder.slots.used == 0
+
+    def test_run_building_per_chroot_recipe_slots(self):
+        builder = create_mocked_builder()
+        builder.chroots = ['f23']
+        builder.chroot_scheduling = 'independent'
+        builder.packages = {'pkg1', 'pkg2', 'pkg3'}
+        builder.slots = SlotPool(1)
+        builder.graph.G.add_edges_from([('pkg1', 'pkg2'), ('pkg2', 'pkg1')])
+        builder.graph.G.add_node('pkg3')
+        # recipe of pkg1 and pkg2 is ready while pkg3 holds the only slot
+        built = check_build(lambda self, pkgs, verbose: True)
+        polls = []
+
+        def poll(bw):
+            polls.append(bw)
+            return flexmock(status='succeeded', data={}) if len(polls) > 3 else None
+
+        flexmock(time).should_receive('sleep')
+        flexmock(utils).should_receive('check_bootstrap_macro')
+        flexmock(utils).should_receive('edit_bootstrap')
+        flexmock(builder).should_receive('build').replace_with(
+            lambda pkgs, verbose=True: built(builder, pkgs, verbose))
+        flexmock(builder).should_receive('submit').replace_with(
+            lambda pkg, chroots: [flexmock(build_id=1)])
+        flexmock(builder).should_receive('poll').replace_with(poll)
+        flexmock(builder.history).should_receive('record')
+        thread = threading.Thread(target=builder.run_building, daemon=True)
+        thread.start()
+        thread.join(10)
+        assert not thread.is_alive()
+        assert builder.built_packages == {'pkg1', 'pkg2', 'pkg3'}
+        assert builder.slots.used == 0
+
+    def test_build_following_recipe_failure(self):
+        builder = create_mocked_builder()
+        results = iter([True, False])
+
+        def build(pkgs, verbose):
+            if next(results):
+                builder.mark_built(pkgs[0], remove_node=False)
+                return True
+            return False
+
+        flexmock(RealBuilder).should_receive('build').replace_with(build).twice()
+        flexmock(utils).should_receive('check_bootstrap_macro')
+        flexmock(utils).should_receive('edit_bootstrap')
+        builder.graph.G.add_edge('pkg1', 'pkg2')
+        builder.graph.G.add_edge('pkg2', 'pkg1')
+        builder.build_following_recipe(builder.recipes[0])
+        assert builder.failed_packages == {'pkg1', 'pkg2'}
+        assert builder.built_packages == set()
+        assert builder.recipes == []
+
+    @pytest.mark.parametrize(('results', 'retries', 'built', 'failed'), [
+        ([{'pkg1'}, set()], 1, {'pkg1', 'pkg2'}, set()),
+        ([{'pkg1'}, {'pkg1'}], 1, {'pkg2'}, {'pkg1'}),
+        ([False], 0, set(), {'pkg1', 'pkg2'}),
+    ])
+    def test_check_build_retry(self, results, retries, built, failed):
+        builder = create_mocked_builder()
+        builder.retries = retries
+        builder.retry_backoff = 10
+        builder.graph.G.add_nodes_from(['pkg1', 'pkg2'])
+        calls = []
+
+        def build(self, pkgs, verbose=True):
+            calls.append(pkgs)
+            return results[len(calls) - 1]
+
+        flexmock(time).should_receive('sleep').with_args(10).times(len(results) - 1)
+        check_build(build)(builder, ['pkg1', 'pkg2'])
+        assert calls[1:] == [['pkg1']] * (len(results) - 1)
+        assert builder.built_packages == built
+        assert builder.failed_packages == failed
+
+    def test_run_building_isolates_failure(self):
+        builder = create_mocked_builder()
+        builder.recipes = None
+        builder.packages = {'pkg1', 'pkg2', 'pkg3', 'pkg4'}
+        # pkg1 requires pkg2, pkg2 and pkg3 require pkg4
+        builder.graph.G.add_edges_from([('pkg1', 'pkg2'), ('pkg2', 'pkg4'), ('pkg3', 'pkg4')])
+        flexmock(RealBuilder).should_receive('build').replace_with(
+            check_build(lambda self, pkgs, verbose: set(pkgs) & {'pkg2'}).__get__(builder))
+        builder.run_building()
+        assert builder.built_packages == {'pkg3', 'pkg4'}
+        assert builder.failed_packages == {'pkg2'}
+        assert builder.blocked_packages == {'pkg1': 'pkg2'}
+        assert 'pkg1 (blocked by pkg2)' in builder.failure_report()
+
+    def test_publish_state(self):
+        builder = create_mocked_builder()
+        builder.recipes = None
+        builder.packages = {'pkg1', 'pkg2', 'pkg3', 'pkg4'}
+        # pkg1 requires pkg2, pkg2 and pkg3 require pkg4
+        builder.graph.G.add_edges_from([('pkg1', 'pkg2'), ('pkg2', 'pkg4'), ('pkg3', 'pkg4')])
+        flexmock(builder.graph).should_receive('make_graph')
+        flexmock(builder.graph).should_receive('get_cycles').and_return([])
+        builder.get_relations()
+        flexmock(RealBuilder).should_receive('build').replace_with(
+            check_build(lambda self, pkgs, verbose: set(pkgs) & {'pkg2'}).__get__(builder))
+        published = []
+        builder.subscribe(published.append)
+        builder.run_building()
+        assert [x.version for x in published] == \
+            list(range(published[0].version, published[-1].version + 1))
+        for state in published:
+            assert set(state.states) == builder.packages
+            assert sum(state.counts.values()) == len(builder.packages)
+            assert state.graph is builder.full_graph
+        assert 'in_flight' in published[0].states.values()
+        assert dict(builder.state.states) == {'pkg1': 'blocked', 'pkg2': 'failed',
+                                              'pkg3': 'succeeded', 'pkg4': 'succeeded'}
+        with pytest.raises(TypeError):
+            builder.state.states['pkg1'] = 'pending'
+
+    @pytest.mark.parametrize(('hard_requires', 'expected'), [
+        (set(), []),
+        ({'pkg4'}, ['pkg1']),
+    ])
+    def test_speculative_candidates(self, hard_requires, expected):
+        builder = create_mocked_builder()
+        builder.recipes = None
+        builder.packages = {'pkg1', 'pkg2', 'pkg4'}
+        builder.graph.G.add_edges_from([('pkg1', 'pkg2'), ('pkg2', 'pkg4')])
+        builder.speculative = True
+        builder.speculative_packages = ['pkg1']
+        builder.speculative_history = 0
+        builder.hard_requires = hard_requires
+        builder.built_packages = {'pkg4'}
+        assert builder.speculative_candidates() == expected
+
+    def test_package_states(self):
+        states = PackageStates({'pkg{}'.format(x): 'pending' for x in range(100)})
+        versions = [states]
+        for x in range(20):
+            versions.append(versions[-1].updated({'pkg{}'.format(x): 'succeeded'}))
+        for x, version in enumerate(versions):
+            assert len(version) == 100
+            assert sum(1 for state in version.values() if state == 'succeeded') == x
+        # changes are merged into a new base when they outgrow it
+        assert versions[10]._base is versions[1]._base
+        assert versions[11]._base is not versions[10]._base
+        assert not versions[11]._changes
+
+    def test_run_building_per_chroot_retry(self):
+        builder = create_mocked_builder()
+        builder.chroots = ['f23', 'f24']
+        builder.chroot_scheduling = 'independent'
+        builder.recipes = None
+        builder.retries = 1
+        builder.retry_backoff = 0
+        builder.packages = {'pkg1', 'pkg2', 'pkg3'}
+        builder.graph.G.add_edges_from([('pkg1', 'pkg2')])
+        builder.graph.G.add_node('pkg3')
+        submitted = []
+
+        def submit(pkg, chroots):
+            submitted.append((pkg, chroots[0]))
+            return [flexmock(build_id=len(submitted), pkg=pkg, chroot=chroots[0])]
+
+        def poll(bw):
+            # pkg3 fails once in f24, pkg2 always fails in f23
+            failed = (bw.pkg, bw.chroot) == ('pkg2', 'f23') or \
+                (bw.pkg, bw.chroot) == ('pkg3', 'f24') and submitted.count(('pkg3', 'f24')) == 1
+            return flexmock(status='failed' if failed else 'succeeded', data={})
+
+        flexmock(time).should_receive('sleep')
+        flexmock(builder).should_receive('submit').replace_with(submit)
+        flexmock(builder).should_receive('poll').replace_with(poll)
+        flexmock(builder.history).should_receive('record')
+        builder.run_building()
+        assert submitted.count(('pkg2', 'f23')) == 2
+        assert submitted.count(('pkg3', 'f24')) == 2
+        assert ('pkg1', 'f23') not in submitted
+        assert builder.built_packages == {'pkg3'}
+        assert builder.failed_packages == {'pkg2'}
+        assert builder.blocked_packages == {'pkg1': 'pkg2'}
+
+    def test_copr_api_errors(self):
+        def fail(*args):
+            raise CoprRequestException('Not found')
+        api = CoprApi(flexmock(get_build_details=fail, api_url='url'))
+        assert api.api_url == 'url'
+        with pytest.raises(BuildSystemException):
+            api.get_build_details(1)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import socket
+import threading
+import pytest
+from flexmock import flexmock
+
+from rebuild_tool import builder as builder_module
+from rebuild_tool.builder_plugins import local
+from rebuild_tool.distributed import Coordinator, run_worker, parse_address, receive
+from rebuild_tool.pkg_source import PkgSrcArchive
+from rebuild_tool.pkg_source_plugins import dnf
+from rebuild_tool.pkg_source_plugins.dnf import DnfArchive
+from rebuild_tool.exceptions import DownloadFailException, IncompleteMetadataException
+
+
+def download(self):
+    if self.package == 'broken':
+        raise DownloadFailException('No package broken available.')
+    self.srpm_file = '{}-1.0-1.fc24.src.rpm'.format(self.package)
+    with open(self.full_path_srpm, 'w') as fo:
+        fo.write(self.package)
+
+
+def unpack(self):
+    self.spec_file = self.package + '.spec'
+    self.spec_digest = 'digest'
+    self.sources_extracted = False
+    number = int(self.package[3:])
+    self._dependencies = frozenset({'pkg{}-sub'.format(number - 1)})
+
+
+@pytest.fixture
+def archives(monkeypatch):
+    monkeypatch.setattr(DnfArchive, 'download', download)
+    monkeypatch.setattr(DnfArchive, 'unpack', unpack)
+    monkeypatch.setattr(DnfArchive, 'pack', lambda self: None)
+    monkeypatch.setattr(DnfArchive, 'rpms_from_spec',
+                        property(lambda self: {self.package, self.package + '-sub'}))
+    monkeypatch.setattr(PkgSrcArchive, 'repo', 'rawhide')
+    monkeypatch.setattr(PkgSrcArchive, 'prefix', '')
+
+
+def free_address():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return '127.0.0.1:{}'.format(sock.getsockname()[1])
+
+
+def start_workers(address, number):
+    '''
+    Starts workers in threads, workers wait until coordinator listens
+    '''
+    def worker():
+        for attempt in range(100):
+            try:
+                return run_worker(address)
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+
+    threads = [threading.Thread(target=worker, daemon=True) for x in range(number)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def jobs(packages, tmpdir):
+    return [{'type': 'fetch', 'id': number, 'package': package,
+             'pkg_dir': str(tmpdir.join(package + '_files')) + '/',
+             'packages_source': 'dnf', 'repo': 'rawhide', 'prefix': '', 'koji_tag': None}
+            for number, package in enumerate(packages)]
+
+
+class TestDistributed(object):
+
+    @pytest.mark.parametrize(('address', 'expected'), [
+        ('localhost:7000', ('localhost', 7000)),
+        ('0.0.0.0:0', ('0.0.0.0', 0)),
+    ])
+    def test_parse_address(self, address, expected):
+        assert parse_address(address) == expected
+
+    def test_state(self, archives, tmpdir):
+        archive = DnfArchive('pkg1', str(tmpdir))
+        state = json.loads(json.dumps(archive.state()))
+        restored = DnfArchive.from_state(state)
+        for attr in ['package', 'pkg_dir', 'srpm_file', 'spec_file', 'spec_digest',
+                     'sources_extracted', 'rpms', 'dependencies', 'full_path_srpm']:
+            assert getattr(restored, attr) == getattr(archive, attr)
+        assert isinstance(restored.rpms, frozenset)
+        # archives kept in the graph store attributes in slots
+        assert not hasattr(restored, '__dict__')
+
+    def test_fetch(self, archives, tmpdir):
+        coordinator = Coordinator('127.0.0.1:0')
+        workers = start_workers(coordinator.address, 3)
+        packages = ['pkg{}'.format(x) for x in range(1, 20)]
+        results = coordinator.fetch(jobs(packages, tmpdir))
+        coordinator.stop()
+        for worker in workers:
+            worker.join(5)
+            assert not worker.is_alive()
+        assert [x['package'] for x in results] == packages
+        container = dnf.PkgsContainer()
+        for package, result in zip(packages, results):
+            container.restore(package, result['state']['pkg_dir'], 'rawhide', '', None,
+                              result['state'])
+            assert container[package].rpms == {package, package + '-sub'}
+            assert os.path.isfile(container[package].full_path_srpm)
+
+    def test_failed_fetch(self, archives, tmpdir):
+        coordinator = Coordinator('127.0.0.1:0')
+        start_workers(coordinator.address, 2)
+        with pytest.raises(DownloadFailException):
+            coordinator.fetch(jobs(['pkg1', 'broken', 'pkg2'], tmpdir))
+        coordinator.stop()
+
+    def test_disconnected_worker(self, archives, tmpdir):
+        coordinator = Coordinator('127.0.0.1:0')
+        with socket.create_connection(parse_address(coordinator.address)) as sock:
+            # Worker which takes a job and disconnects without result
+            coordinator.jobs.put(jobs(['pkg1'], tmpdir)[0])
+            assert receive(sock.makefile('rb'))['package'] == 'pkg1'
+        start_workers(coordinator.address, 1)
+        result = coordinator.results.get(timeout=5)
+        coordinator.stop()
+        assert result['package'] == 'pkg1'
+        assert 'state' in result
+
+    def test_no_worker(self, tmpdir):
+        coordinator = Coordinator('127.0.0.1:0', connect_timeout=0.5)
+        with pytest.raises(DownloadFailException) as e:
+            coordinator.fetch(jobs(['pkg1'], tmpdir))
+        coordinator.stop()
+        assert 'No fetch worker' in str(e.value)
+
+    def test_all_workers_disconnected(self, tmpdir):
+        coordinator = Coordinator('127.0.0.1:0')
+
+        def worker():
+            # Worker which takes a job and disconnects without result
+            with socket.create_connection(parse_address(coordinator.address)) as sock:
+                receive(sock.makefile('rb'))
+
+        threading.Thread(target=worker, daemon=True).start()
+        with pytest.raises(DownloadFailException) as e:
+            coordinator.fetch(jobs(['pkg1'], tmpdir))
+        coordinator.stop()
+        assert 'disconnected' in str(e.value)
+
+    def test_idle_workers(self, tmpdir):
+        coordinator = Coordinator('127.0.0.1:0', idle_timeout=0.5)
+        with socket.create_connection(parse_address(coordinator.address)):
+            with pytest.raises(DownloadFailException) as e:
+                coordinator.fetch(jobs(['pkg1'], tmpdir))
+        coordinator.stop()
+        assert 'no result' in str(e.value)
+
+    def test_builder(self, archives, tmpdir):
+        flexmock(builder_module).should_receive('repo_revision').and_return(None)
+        address = free_address()
+        start_workers(address, 2)
+        packages = ['pkg{}'.format(x) for x in range(1, 6)]
+        builder = local.RealBuilder({'packages': packages, 'packages_source': 'dnf',
+                                     'repo': 'rawhide', 'prefix': '', 'koji_tag': None,
+                                     'history_db': ':memory:', 'local_build_latency': 0,
+                                     'fetch_coordinator': address,
+                                     'shared_dir': str(tmpdir)},
+                                    dnf.PkgsContainer())
+        builder.get_relations()
+        assert set(builder.pkg_source) == set(packages)
+        assert builder.pkg_source['pkg3'].pkg_dir == str(tmpdir.join('pkg3_files')) + '/'
+        assert set(builder.graph.G.edges()) == {('pkg{}'.format(x), 'pkg{}'.format(x - 1))
+                                                for x in range(2, 6)}
+
+    def test_missing_shared_dir(self):
+        with pytest.raises(IncompleteMetadataException):
+            local.RealBuilder({'packages': ['pkg1'], 'packages_source': 'dnf',
+                               'repo': 'rawhide', 'prefix': '', 'koji_tag': None,
+                               'history_db': ':memory:', 'fetch_coordinator': 'localhost:0'},
+                              dnf.PkgsContainer())
@@ -2,6 +2,8 @@ import pytest
 from flexmock import flexmock
 
 from rebuild_tool.graph import PackageGraph
+from rebuild_tool.pkg_source import CachedArchive
+from rebuild_tool.exceptions import IncompleteMetadataException
 
 class TestGraph(object):
     fake_python = flexmock(
@@ -98,4 +100,52 @@ class TestGraph(object):
         graph.make_graph()
         assert graph.get_cycles() == expected
 
+    # a requires b, b and c require d, d and e require each other, e requires f
+    @pytest.mark.parametrize(('selection', 'expected'), [
+        ({'only': ['b']}, {'b'}),
+        ({'only': ['d']}, {'d', 'e'}),
+        ({'from_packages': ['d']}, {'a', 'b', 'c', 'd', 'e'}),
+        ({'to_packages': ['b']}, {'b', 'd', 'e', 'f'}),
+        ({'from_packages': ['f'], 'to_packages': ['b']}, {'b', 'd', 'e', 'f'}),
+        ({'from_packages': ['b'], 'to_packages': ['c']}, set()),
+        ({'only': ['c'], 'from_packages': ['b']}, {'a', 'b', 'c'}),
+    ])
+    def test_select(self, selection, expected):
+        graph = PackageGraph("rawhide", {})
+        graph.G.add_edges_from([('a', 'b'), ('b', 'd'), ('c', 'd'), ('d', 'e'),
+                                ('e', 'd'), ('e', 'f')])
+        assert graph.select(**selection) == expected
+
+    def test_select_unknown(self):
+        graph = PackageGraph("rawhide", {})
+        graph.G.add_node('a')
+        with pytest.raises(IncompleteMetadataException):
+            graph.select(to_packages=['b'])
+
+
+def distro_records(packages, subpackages, requires):
+    '''
+    Returns dictionary of CachedArchive records with names of rpms
+    created separately for each record like names parsed from output
+    of rpm and dnf
+    '''
+    records = {}
+    for x in range(packages):
+        rpms = ['pkg{}-sub{}'.format(x, y) for y in range(subpackages)]
+        deps = ['pkg{}-sub{}'.format((x * 7 + y) % packages, y % subpackages)
+                for y in range(requires)]
+        records['pkg{}'.format(x)] = CachedArchive('pkg{}'.format(x), None, rpms, deps)
+    return records
 
+
+class TestGraphMemory(object):
+
+    def test_shared_names(self):
+        records = distro_records(10, 2, 20)
+        graph = PackageGraph("rawhide", records)
+        graph.make_graph()
+        dep = next(iter(records['pkg1'].dependencies))
+        rpm = next(x for x in records[graph.rpm_index[dep]].rpms if x == dep)
+        assert dep is rpm
+        assert isinstance(records['pkg1'].rpms, frozenset)
+        assert not hasattr(records['pkg1'], '__dict__')
@@ -0,0 +1,60 @@
+import pytest
+
+from rebuild_tool.history import BuildHistory, percentile
+
+
+@pytest.fixture
+def history(tmpdir):
+    history = BuildHistory(str(tmpdir.join('cache', 'history.db')))
+    for duration in [10, 20, 30, 40, 100]:
+        history.record('slow', 'f24', 'succeeded', 0, 100, 100 + duration, 'copr', 1)
+    history.record('slow', 'f23', 'succeeded', 0, 0, 1000)
+    history.record('fast', 'f24', 'succeeded', 0, 0, 5)
+    history.record('flaky', 'f24', 'failed', 0, 0, 5)
+    history.record('flaky', 'f24', 'succeeded', 0, 0, 8)
+    yield history
+    history.close()
+
+
+class TestBuildHistory(object):
+
+    @pytest.mark.parametrize(('values', 'fraction', 'expected'), [
+        ([3], 0.9, 3),
+        ([4, 1, 3, 2], 0.5, 2.5),
+        ([10, 20, 30, 40, 100], 0.9, 76),
+    ])
+    def test_percentile(self, values, fraction, expected):
+        assert percentile(values, fraction) == pytest.approx(expected)
+
+    def test_percentile_empty(self):
+        assert percentile([], 0.5) is None
+
+    @pytest.mark.parametrize(('package', 'chroot', 'median', 'p90'), [
+        ('slow', 'f24', 30, 76),
+        ('slow', None, 35, 550),
+        ('fast', None, 5, 5),
+        ('missing', None, None, None),
+    ])
+    def test_median_p90(self, history, package, chroot, median, p90):
+        assert history.median(package, chroot) == median
+        assert history.p90(package, chroot) == (pytest.approx(p90) if p90 else None)
+
+    def test_slowest(self, history):
+        assert [x[0] for x in history.slowest()] == ['slow', 'flaky', 'fast']
+        assert history.slowest(1)[0][3] == 6
+
+    def test_flakiest(self, history):
+        assert history.flakiest() == [('flaky', 1, 2)]
+
+    @pytest.mark.parametrize(('min_builds', 'expected'), [
+        (1, {'slow', 'fast'}),
+        (3, {'slow'}),
+        (10, set()),
+    ])
+    def test_reliable(self, history, min_builds, expected):
+        assert history.reliable(min_builds) == expected
+
+    def test_report(self, history):
+        report = history.report()
+        assert 'Slowest packages:' in report
+        assert 'Flakiest packages:' in report
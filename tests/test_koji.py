@@ -0,0 +1,128 @@
+import pytest
+import os
+import socket
+import hashlib
+import threading
+from xmlrpc.server import SimpleXMLRPCServer
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+from test_srpm import make_srpm
+from rebuild_tool.srpm import SrpmReader
+from rebuild_tool.pkg_source_plugins.koji import KojiFetcher, PkgsContainer
+from rebuild_tool.exceptions import DownloadFailException
+
+
+class FakeHub(object):
+    '''
+    Implements koji hub calls used by KojiFetcher
+    '''
+    def __init__(self, builds):
+        self.builds = builds
+        self.requests = 0
+
+    def getLatestBuilds(self, tag, event=None, package=None):
+        return [x for x in self.builds if x['tag'] == tag and x['name'] == package][:1]
+
+    def listRPMs(self, build_id, buildroot_id=None, image_id=None,
+                 component_buildroot_id=None, host_id=None, arches=None):
+        return [x['srpm'] for x in self.builds if x['build_id'] == build_id]
+
+    def multiCall(self, calls):
+        self.requests += 1
+        results = []
+        for call in calls:
+            try:
+                results.append([getattr(self, call['methodName'])(*call['params'])])
+            except Exception as e:
+                results.append({'faultCode': 1, 'faultString': str(e)})
+        return results
+
+
+class FileHandler(SimpleHTTPRequestHandler):
+    '''
+    Serves files from root directory
+    '''
+    root = None
+
+    def translate_path(self, path):
+        return os.path.join(self.root, path.split('?')[0].lstrip('/'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def koji(tmpdir):
+    builds = []
+    for build_id, name in enumerate(['pkg1', 'pkg2', 'pkg3']):
+        srpm_dir = tmpdir.join('packages', name, '1.0', '1.fc24', 'src').ensure(dir=True)
+        path = make_srpm(str(srpm_dir.join('{}-1.0-1.fc24.src.rpm'.format(name))),
+                         [('{}.spec'.format(name), b'Name: ' + name.encode())])
+        with open(path, 'rb') as fi:
+            payloadhash = hashlib.md5(fi.read()[SrpmReader(path).header_offset:]).hexdigest()
+        builds.append({'build_id': build_id, 'name': name, 'tag': 'f24',
+                       'srpm': {'name': name, 'version': '1.0', 'release': '1.fc24',
+                                'arch': 'src', 'size': os.path.getsize(path),
+                                'payloadhash': payloadhash}})
+    hub = FakeHub(builds)
+    hub_server = SimpleXMLRPCServer(('127.0.0.1', 0), allow_none=True, logRequests=False)
+    hub_server.register_instance(hub)
+    file_server = HTTPServer(('127.0.0.1', 0), type('Handler', (FileHandler,),
+                                                    {'root': str(tmpdir)}))
+    serve(hub_server)
+    serve(file_server)
+    yield (hub, 'http://127.0.0.1:{}'.format(hub_server.server_address[1]),
+           'http://127.0.0.1:{}'.format(file_server.server_address[1]))
+    hub_server.shutdown()
+    file_server.shutdown()
+    hub_server.server_close()
+    file_server.server_close()
+
+
+class TestKojiFetcher(object):
+
+    def test_fetch(self, koji, tmpdir):
+        (hub, hub_url, topurl) = koji
+        pkg_dirs = {x: str(tmpdir.join(x + '_files').ensure(dir=True)) for x in ['pkg1', 'pkg2']}
+        files = KojiFetcher(hub_url, topurl, jobs=2).fetch(pkg_dirs, 'f24')
+        assert files == {'pkg1': 'pkg1-1.0-1.fc24.src.rpm', 'pkg2': 'pkg2-1.0-1.fc24.src.rpm'}
+        assert os.path.exists(os.path.join(pkg_dirs['pkg2'], files['pkg2']))
+        assert hub.requests == 2
+
+    @pytest.mark.parametrize(('packages', 'tag'), [
+        (['pkg1', 'missing'], 'f24'),
+        (['pkg1'], 'f25'),
+    ])
+    def test_missing_build(self, koji, tmpdir, packages, tag):
+        (hub, hub_url, topurl) = koji
+        with pytest.raises(DownloadFailException):
+            KojiFetcher(hub_url, topurl).latest_srpms(packages, tag)
+
+    def test_checksum_mismatch(self, koji, tmpdir):
+        (hub, hub_url, topurl) = koji
+        hub.builds[0]['srpm']['payloadhash'] = '0' * 32
+        with pytest.raises(DownloadFailException):
+            KojiFetcher(hub_url, topurl).fetch({'pkg1': str(tmpdir)}, 'f24')
+
+    def test_download_timeout(self, koji, tmpdir):
+        (hub, hub_url, topurl) = koji
+        # server accepting connections which never answers
+        with socket.socket() as server:
+            server.bind(('127.0.0.1', 0))
+            server.listen(2)
+            fetcher = KojiFetcher(hub_url, 'http://127.0.0.1:{}'.format(
+                server.getsockname()[1]), timeout=0.1)
+            with pytest.raises(DownloadFailException):
+                fetcher.download(hub.builds[0]['srpm'], str(tmpdir))
+
+    def test_prefetch(self, koji, tmpdir):
+        (hub, hub_url, topurl) = koji
+        PkgsContainer().prefetch({'pkg3': str(tmpdir)}, 'f24', hub_url, topurl)
+        assert tmpdir.join('pkg3-1.0-1.fc24.src.rpm').exists()
@@ -0,0 +1,312 @@
+import pytest
+import random
+import networkx as nx
+import time
+import threading
+from flexmock import flexmock
+from copr.client import CoprClient
+
+from rebuild_tool.builder import Builder
+from rebuild_tool.builder_plugins import copr, local
+from rebuild_tool.builder_plugins.local import BuildService, package_name
+from rebuild_tool.slots import HostSlotPool
+from rebuild_tool.exceptions import BuildSystemException
+from fake_copr import FakeCopr
+
+
+class Clock(object):
+    '''
+    Fake time.time advanced by mocked time.sleep
+    '''
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def random_graph(builder, size, seed=0):
+    '''
+    Adds packages to builder, each package depends on up to three
+    randomly selected packages with lower number
+    '''
+    generator = random.Random(seed)
+    builder.packages = {'pkg{}'.format(x) for x in range(size)}
+    builder.graph.G.add_nodes_from(builder.packages)
+    for x in range(1, size):
+        for dep in generator.sample(range(x), min(x, generator.randint(0, 3))):
+            builder.graph.G.add_edge('pkg{}'.format(x), 'pkg{}'.format(dep))
+    return builder.graph.G.copy()
+
+
+def check_order(service, graph):
+    '''
+    Checks that every package was submitted after successful
+    builds of all its dependencies finished
+    '''
+    finished = {}
+    for build in service.builds.values():
+        if build.status == 'succeeded':
+            finished[build.package] = min(finished.get(build.package, build.ended), build.ended)
+    for build in service.builds.values():
+        for dep in graph.successors(build.package):
+            assert finished[dep] <= build.submitted
+
+
+def create_local_builder(metadata, clock, pkg_source=None):
+    flexmock(Builder).should_receive('get_files')
+    builder = local.RealBuilder(dict({'packages': [], 'repo': 'rawhide', 'prefix': '',
+                                      'koji_tag': None, 'history_db': ':memory:'},
+                                     **metadata),
+                                pkg_source or Srpms())
+    builder.cl.service.clock = clock
+    return builder
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'time', clock)
+    monkeypatch.setattr(time, 'sleep', clock.sleep)
+    return clock
+
+
+class Srpms(dict):
+    def __missing__(self, package):
+        return flexmock(full_path_srpm='/tmp/{}-1.0-1.fc24.src.rpm'.format(package))
+
+
+class TestBuildService(object):
+
+    @pytest.mark.parametrize(('srpm', 'expected'), [
+        ('/path/python-six-1.10.0-1.fc24.src.rpm', 'python-six'),
+        ('gdb-7.11-1.fc24.src.rpm', 'gdb'),
+    ])
+    def test_package_name(self, srpm, expected):
+        assert package_name(srpm) == expected
+
+    def test_states(self):
+        clock = Clock()
+        service = BuildService(workers=1, queue_latency=5, build_latency=10, clock=clock)
+        first = service.submit('pkg1-1.0-1.src.rpm', ['f23', 'f24'])
+        second = service.submit('pkg2-1.0-1.src.rpm', ['f23'])
+        assert service.details(first)['status'] == 'pending'
+        clock.sleep(5)
+        assert service.details(first)['status'] == 'running'
+        assert service.details(second)['status'] == 'pending'
+        clock.sleep(10)
+        details = service.details(first)
+        assert details['status'] == 'succeeded'
+        assert details['chroots'] == {'f23': 'succeeded', 'f24': 'succeeded'}
+        assert (details['started_on'], details['ended_on']) == (1005, 1015)
+        assert service.details(second)['status'] == 'running'
+
+    @pytest.mark.parametrize(('failure_rate', 'fail_packages', 'expected'), [
+        (0, ['pkg1'], 'failed'),
+        (0, ['pkg2'], 'succeeded'),
+        (1, [], 'failed'),
+    ])
+    def test_failures(self, failure_rate, fail_packages, expected):
+        service = BuildService(build_latency=0, failure_rate=failure_rate,
+                               fail_packages=fail_packages)
+        build_id = service.submit('pkg1-1.0-1.src.rpm', ['f24'])
+        assert service.details(build_id)['status'] == expected
+
+
+class TestLocalBuilder(object):
+
+    @pytest.mark.parametrize('chroot_scheduling', ['together', 'independent'])
+    def test_run_building(self, clock, chroot_scheduling):
+        builder = create_local_builder({'chroots': ['f23', 'f24'], 'local_workers': 50,
+                                        'local_build_latency': [1, 30],
+                                        'local_seed': 1,
+                                        'chroot_scheduling': chroot_scheduling}, clock)
+        graph = random_graph(builder, 1000)
+        builder.run_building()
+        assert builder.built_packages == builder.packages
+        check_order(builder.cl.service, graph)
+
+    def test_concurrent_readers(self, clock):
+        builder = create_local_builder({'local_build_latency': [1, 30], 'local_seed': 3,
+                                        'local_fail_packages': ['pkg7']}, clock)
+        random_graph(builder, 300)
+        builder.get_relations()
+        finished = threading.Event()
+        states = []
+
+        def read():
+            while not finished.is_set():
+                state = builder.state
+                assert sum(state.counts.values()) == len(state.states) == 300
+                states.append(state.version)
+
+        readers = [threading.Thread(target=read) for x in range(2)]
+        for reader in readers:
+            reader.start()
+        try:
+            builder.run_building()
+        finally:
+            finished.set()
+            for reader in readers:
+                reader.join()
+        assert states
+        assert builder.state.counts['failed'] == 1
+
+    @pytest.mark.parametrize('chroot_scheduling', ['together', 'independent'])
+    def test_failures(self, clock, chroot_scheduling):
+        builder = create_local_builder({'chroots': ['f23', 'f24'], 'local_failure_rate': 0.01,
+                                        'local_fail_packages': ['pkg10'], 'local_seed': 2, 'retries': 1, 'retry_backoff': 60,
+                                        'chroot_scheduling': chroot_scheduling}, clock)
+        graph = random_graph(builder, 500)
+        builder.run_building()
+        assert 'pkg10' in builder.failed_packages
+        assert builder.built_packages | builder.failed_packages | \
+            set(builder.blocked_packages) == builder.packages
+        for package in builder.blocked_packages:
+            assert not graph.successors(package) or \
+                set(graph.successors(package)) - builder.built_packages
+        check_order(builder.cl.service, graph)
+
+
+@pytest.fixture
+def fake_copr():
+    server = FakeCopr().start()
+    yield server
+    server.stop()
+
+
+class TestFakeCopr(object):
+
+    @pytest.mark.parametrize('chroot_scheduling', ['together', 'independent'])
+    def test_copr_builder(self, fake_copr, tmpdir, clock, chroot_scheduling):
+        fake_copr.service.clock = clock
+        fake_copr.service.fail_packages = {'pkg3'}
+        srpms = {}
+        for package in ['pkg1', 'pkg2', 'pkg3', 'pkg4']:
+            srpm = tmpdir.join('{}-1.0-1.fc24.src.rpm'.format(package))
+            srpm.write('srpm')
+            srpms[package] = flexmock(full_path_srpm=str(srpm))
+        flexmock(CoprClient).should_receive('create_from_file_config').and_return(
+            CoprClient(username='user', login='login', token='token', copr_url=fake_copr.url))
+        flexmock(Builder).should_receive('get_files')
+        builder = copr.RealBuilder({'packages': list(srpms), 'repo': 'rawhide', 'prefix': '',
+                                    'koji_tag': None, 'history_db': ':memory:',
+                                    'copr_project': 'project', 'chroots': ['f23', 'f24'],
+                                    'chroot_pkgs': ['pkg0'],
+                                    'chroot_scheduling': chroot_scheduling}, srpms)
+        assert fake_copr.projects == {'project'}
+        # pkg2 requires pkg1, pkg4 requires pkg3
+        builder.graph.G.add_edges_from([('pkg2', 'pkg1'), ('pkg4', 'pkg3')])
+        builder.run_building()
+        assert builder.built_packages == {'pkg1', 'pkg2'}
+        assert builder.failed_packages == {'pkg3'}
+        assert builder.blocked_packages == {'pkg4': 'pkg3'}
+
+    @pytest.mark.parametrize('chroot_scheduling', ['together', 'independent'])
+    def test_speculative(self, clock, chroot_scheduling):
+        builder = create_local_builder({'local_build_latency': 10, 'speculative': True,
+                                        'speculative_packages': ['pkg2', 'pkg3', 'pkg4'],
+                                        'hard_requires': ['pkg5'],
+                                        'chroot_scheduling': chroot_scheduling}, clock)
+        builder.packages = {'pkg1', 'pkg2', 'pkg3', 'pkg4', 'pkg5'}
+        # pkg4 requires pkg2, pkg2 requires pkg1, pkg3 requires pkg5 needed to build anything
+        builder.graph.G.add_edges_from([('pkg2', 'pkg1'), ('pkg4', 'pkg2'), ('pkg3', 'pkg5')])
+        service = builder.cl.service
+        service.fail_packages = {'pkg2'}
+        submit = service.submit
+
+        def submit_once_failing(srpm, chroots):
+            build_id = submit(srpm, chroots)
+            # only the first, speculative build of pkg2 fails
+            if package_name(srpm) == 'pkg2':
+                service.fail_packages = set()
+            return build_id
+
+        service.submit = submit_once_failing
+        builder.run_building()
+        builds = {}
+        for build in service.builds.values():
+            builds.setdefault(build.package, []).append(build)
+        assert builder.built_packages == builder.packages
+        assert not builder.failed_packages
+        assert builder.speculatively_failed == {'pkg2'}
+        assert [x.status for x in builds['pkg2']] == ['failed', 'succeeded']
+        assert builds['pkg4'][0].submitted == builds['pkg1'][0].submitted
+        assert builds['pkg2'][1].submitted >= builds['pkg1'][0].ended
+        assert builds['pkg3'][0].submitted >= builds['pkg5'][0].ended
+
+    @pytest.mark.parametrize('chroot_scheduling', ['together', 'independent'])
+    def test_host_slots(self, clock, tmpdir, chroot_scheduling):
+        path = str(tmpdir.join('slots.json'))
+        builder = create_local_builder({'local_build_latency': [1, 30], 'local_seed': 2,
+                                        'copr_slots': 3, 'copr_slots_file': path,
+                                        'chroot_scheduling': chroot_scheduling}, clock)
+        assert isinstance(builder.slots, HostSlotPool)
+        graph = random_graph(builder, 30)
+        builder.run_building()
+        assert builder.built_packages == builder.packages
+        check_order(builder.cl.service, graph)
+        builds = builder.cl.service.builds.values()
+        for build in builds:
+            assert len([x for x in builds
+                        if x.submitted <= build.submitted < x.ended]) <= 3
+        assert tmpdir.join('slots.json').read() == '{}'
+
+    def test_host_slots_file_error(self, tmpdir):
+        tmpdir.join('file').write('')
+        path = str(tmpdir.join('file', 'slots.json'))
+        with pytest.raises(BuildSystemException) as e:
+            copr.host_slots({'copr_slots': 3, 'copr_slots_file': path})
+        assert path in str(e.value)
+
+    @pytest.mark.parametrize(('edges', 'nodes', 'shards', 'expected'), [
+        ([('a', 'b'), ('c', 'd'), ('d', 'e')], ['f'], 1,
+         {'a': 'p', 'b': 'p', 'c': 'p', 'd': 'p', 'e': 'p', 'f': 'p'}),
+        ([('a', 'b'), ('c', 'd'), ('d', 'e')], ['f'], 2,
+         {'a': 'p-shard1', 'b': 'p-shard1', 'c': 'p', 'd': 'p', 'e': 'p', 'f': 'p-shard1'}),
+        ([('a', 'b'), ('b', 'a')], ['c', 'd'], 3,
+         {'a': 'p', 'b': 'p', 'c': 'p-shard1', 'd': 'p-shard2'}),
+    ])
+    def test_assign_shards(self, edges, nodes, shards, expected):
+        G = nx.DiGraph()
+        G.add_edges_from(edges)
+        G.add_nodes_from(nodes)
+        assert copr.assign_shards(G, copr.shard_projects('p', shards)) == expected
+
+    @pytest.mark.parametrize('chroot_scheduling', ['together', 'independent'])
+    def test_shards(self, fake_copr, tmpdir, clock, chroot_scheduling):
+        fake_copr.projects.add('project')
+        fake_copr.service.clock = clock
+        fake_copr.service.fail_packages = {'pkg4'}
+        srpms = {}
+        for package in ['pkg{}'.format(x) for x in range(1, 7)]:
+            srpm = tmpdir.join('{}-1.0-1.fc24.src.rpm'.format(package))
+            srpm.write('srpm')
+            srpms[package] = flexmock(full_path_srpm=str(srpm))
+        flexmock(CoprClient).should_receive('create_from_file_config').and_return(
+            CoprClient(username='user', login='login', token='token', copr_url=fake_copr.url))
+        flexmock(Builder).should_receive('get_files')
+        builder = copr.RealBuilder({'packages': list(srpms), 'repo': 'rawhide', 'prefix': '',
+                                    'koji_tag': None, 'history_db': ':memory:',
+                                    'copr_project': 'project', 'chroots': ['f24'],
+                                    'copr_shards': 2,
+                                    'chroot_scheduling': chroot_scheduling}, srpms)
+        assert fake_copr.projects == {'project', 'project-shard1'}
+        assert fake_copr.repos == {'project': ['copr://user/project-shard1'],
+                                   'project-shard1': ['copr://user/project']}
+        # independent subgraphs pkg1 <- pkg2, pkg3 <- pkg4 <- pkg5 and pkg6
+        builder.graph.G.add_edges_from([('pkg2', 'pkg1'), ('pkg4', 'pkg3'), ('pkg5', 'pkg4')])
+        builder.graph.G.add_node('pkg6')
+        builder.run_building()
+        assert builder.built_packages == {'pkg1', 'pkg2', 'pkg3', 'pkg6'}
+        assert builder.failed_packages == {'pkg4'}
+        projects = {fake_copr.service.builds[build_id].package: project
+                    for build_id, project in fake_copr.build_projects.items()}
+        assert projects == {'pkg1': 'project-shard1', 'pkg2': 'project-shard1',
+                            'pkg3': 'project', 'pkg4': 'project', 'pkg6': 'project-shard1'}
+        assert builder.shard_report().splitlines()[1:] == [
+            '    user/project: 3 packages, 1 built, 1 failed, 1 blocked',
+            '    user/project-shard1: 3 packages, 3 built, 0 failed, 0 blocked']
@@ -0,0 +1,58 @@
+import json
+import queue
+import logging
+import pytest
+
+from rebuild_tool import logger as logger_module
+from rebuild_tool.logger import (register_file_log_handler, stop_file_log_handlers,
+                                 JsonFormatter, LazyQueueHandler)
+
+
+@pytest.fixture
+def log_file(tmpdir):
+    yield tmpdir.join('logs', 'rebuild.log')
+    stop_file_log_handlers()
+
+
+class TestLogger(object):
+
+    def test_json(self, log_file):
+        assert register_file_log_handler(str(log_file), fmt=JsonFormatter())
+        log = logging.getLogger('rebuild_tool.builder')
+        log.info("Build %s of %s submitted.", 7, 'pkg1',
+                 extra={'package': 'pkg1', 'build_id': 7})
+        log.debug("Phase %s finished.", 'fetch', extra={'phase': 'fetch', 'duration': 1.5})
+        stop_file_log_handlers()
+        events = [json.loads(line) for line in log_file.read().splitlines()]
+        assert [x['message'] for x in events] == ["Build 7 of pkg1 submitted.",
+                                                  "Phase fetch finished."]
+        assert (events[0]['package'], events[0]['build_id'], events[0]['level']) == \
+            ('pkg1', 7, 'INFO')
+        assert 'phase' not in events[0]
+        assert (events[1]['phase'], events[1]['duration']) == ('fetch', 1.5)
+
+    def test_lazy_formatting(self):
+        records = queue.Queue()
+        deps = frozenset({'python3-devel', 'gcc'})
+        record = logging.LogRecord('rebuild_tool.graph', logging.DEBUG, __file__, 1,
+                                   "Dependencies: %s", (deps,), None)
+        LazyQueueHandler(records).handle(record)
+        queued = records.get_nowait()
+        assert (queued.msg, queued.args) == ("Dependencies: %s", (deps,))
+        assert not hasattr(queued, 'message')
+
+    def test_stop(self, log_file):
+        assert register_file_log_handler(str(log_file))
+        logging.getLogger('rebuild_tool').info("Written before exit.")
+        stop_file_log_handlers()
+        assert log_file.read() == 'rebuild_tool::INFO::Written before exit.\n'
+        assert not logger_module.logger.handlers
+
+    def test_rotation(self, log_file):
+        assert register_file_log_handler(str(log_file), max_bytes=100, backup_count=2)
+        for x in range(20):
+            logging.getLogger('rebuild_tool').info("Message number %d.", x)
+        stop_file_log_handlers()
+        assert sorted(x.basename for x in log_file.dirpath().listdir()) == \
+            ['rebuild.log', 'rebuild.log.1', 'rebuild.log.2']
+        assert 'Message number 19.' in log_file.read()
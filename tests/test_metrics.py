@@ -0,0 +1,52 @@
+import pytest
+from urllib.request import urlopen
+
+from rebuild_tool import metrics
+
+
+class TestMetrics(object):
+
+    @pytest.mark.parametrize(('labels', 'expected'), [
+        ((), ''),
+        ((('phase', 'build'),), '{phase="build"}'),
+        ((('a', 1), ('b', 'x"y')), '{a="1",b="x\\"y"}'),
+    ])
+    def test_format_labels(self, labels, expected):
+        assert metrics.format_labels(labels) == expected
+
+    def test_render(self):
+        registry = metrics.Metrics()
+        registry.set_package_states(pending=3, succeeded=2)
+        registry.inc('rebuild_fetched_packages_total')
+        registry.inc('rebuild_fetched_packages_total')
+        registry.observe('rebuild_copr_poll_seconds', 0.5)
+        registry.observe('rebuild_copr_poll_seconds', 1.5)
+        text = registry.render()
+        assert '# TYPE rebuild_packages gauge' in text
+        assert 'rebuild_packages{state="pending"} 3' in text
+        assert 'rebuild_packages{state="failed"} 0' in text
+        assert 'rebuild_fetched_packages_total 2' in text
+        assert 'rebuild_copr_poll_seconds_count 2' in text
+        assert 'rebuild_copr_poll_seconds_sum 2.0' in text
+        assert 'rebuild_build_slots_in_use' not in text
+
+    def test_phase(self):
+        registry = metrics.Metrics()
+        with registry.phase('fetch'):
+            assert 'rebuild_phase_duration_seconds{phase="fetch"}' in registry.render()
+        assert registry.running_phases == {}
+        assert ('rebuild_phase_duration_seconds', (('phase', 'fetch'),)) in registry.values
+
+    def test_unknown_metric(self):
+        with pytest.raises(KeyError):
+            metrics.Metrics().set('unknown', 1)
+
+    def test_server(self):
+        metrics.registry.set('rebuild_build_slots_in_use', 4)
+        server = metrics.start_metrics_server(0)
+        try:
+            response = urlopen('http://127.0.0.1:{}/metrics'.format(server.server_port))
+            assert 'rebuild_build_slots_in_use 4' in response.read().decode('utf-8')
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,97 @@
+import pytest
+import os
+from flexmock import flexmock
+
+from rebuild_tool.builder import Builder
+from rebuild_tool.builder_plugins import mock
+from rebuild_tool.exceptions import IncompleteMetadataException
+
+metadata = {'packages': ['pkg1', 'pkg2', 'pkg3'],
+            'repo': 'rawhide',
+            'prefix': '',
+            'koji_tag': None,
+            'history_db': ':memory:',
+            'mock_config': 'fedora-rawhide-x86_64',
+            'mock_roots': 2}
+
+pkg_source = {x: flexmock(full_path_srpm='/srpms/{}-1.0-1.src.rpm'.format(x))
+              for x in ['pkg1', 'pkg2', 'pkg3']}
+
+
+def create_mock_builder(**attrs):
+    flexmock(Builder).should_receive('get_files')
+    flexmock(mock).should_receive('subprocess_popen_call').replace_with(fake_build())
+    return mock.RealBuilder(dict(metadata, **attrs), pkg_source)
+
+
+def fake_build(fail=()):
+    '''
+    Returns function replacing subprocess_popen_call, which creates
+    rpm in result directory of the root
+    '''
+    def call(command, timeout=None):
+        if command[0] == 'createrepo_c':
+            return {'returncode': 0, 'stderr': ''}
+        srpm = command[-1]
+        package = os.path.basename(srpm).split('-')[0]
+        if command[0] == 'rpmbuild':
+            result_dir = command[3].split(' ')[1] + 'RPMS/noarch/'
+        else:
+            result_dir = [x for x in command if x.startswith('--resultdir=')][0][12:]
+        os.makedirs(result_dir, exist_ok=True)
+        for rpm in [package + '-1.0-1.noarch.rpm', package + '-1.0-1.src.rpm']:
+            open(os.path.join(result_dir, rpm), 'w').close()
+        return {'returncode': int(package in fail), 'stderr': 'error'}
+    return call
+
+
+class TestMockBuilder(object):
+
+    @pytest.mark.parametrize(('attrs'), [
+        {'mock_mode': 'docker'},
+        {'mock_config': None},
+    ])
+    def test_check_metadata(self, attrs):
+        data = dict(metadata, **attrs)
+        if data['mock_config'] is None:
+            del data['mock_config']
+        with pytest.raises(IncompleteMetadataException):
+            mock.check_metadata(data)
+
+    @pytest.mark.parametrize(('mode', 'expected'), [
+        ('mock', ['mock', '-r', 'fedora-rawhide-x86_64', '--uniqueext=rebuild1',
+                  '--resultdir={root}', '--addrepo=file://{repo}',
+                  '--additional-package=scl-utils-build', '--rebuild', 'pkg.src.rpm']),
+        ('rpmbuild', ['rpmbuild', '--rebuild', '--define', '_topdir {root}', 'pkg.src.rpm']),
+    ])
+    def test_build_command(self, mode, expected):
+        builder = create_mock_builder(mock_mode=mode, chroot_pkgs=['scl-utils-build'])
+        expected = [x.format(root=builder.root_dir(1), repo=builder.repo_dir) for x in expected]
+        assert builder.build_command('pkg.src.rpm', 1) == expected
+
+    @pytest.mark.parametrize('mode', ['mock', 'rpmbuild'])
+    def test_build(self, mode):
+        builder = create_mock_builder(mock_mode=mode)
+        builder.graph.G.add_nodes_from(['pkg1', 'pkg2', 'pkg3'])
+        flexmock(mock).should_receive('subprocess_popen_call').replace_with(fake_build({'pkg2'}))
+        flexmock(builder.history).should_receive('record').with_args(
+            str, builder.chroot, str, float, float, float, 'mock').times(3)
+        assert not builder.build(['pkg1', 'pkg2', 'pkg3'])
+        assert builder.built_packages == {'pkg1', 'pkg3'}
+        assert builder.failed_packages == {'pkg2'}
+        assert sorted(os.listdir(builder.repo_dir)) == ['pkg1-1.0-1.noarch.rpm',
+                                                        'pkg3-1.0-1.noarch.rpm']
+        assert builder.free_roots.qsize() == 2
+
+    def test_refresh_repo(self):
+        builder = create_mock_builder()
+        builder.graph.G.add_nodes_from(['pkg1'])
+        calls = []
+
+        def call(command, timeout=None):
+            calls.append(command[0])
+            return fake_build()(command, timeout)
+
+        flexmock(mock).should_receive('subprocess_popen_call').replace_with(call)
+        builder.build(['pkg1'])
+        assert calls == ['mock', 'createrepo_c']
@@ -6,7 +6,9 @@ import shutil
 
 
 from rebuild_tool import utils
+from rebuild_tool.pkg_source_plugins import dnf
 from rebuild_tool.pkg_source_plugins.dnf import DnfArchive
+from rebuild_tool.exceptions import UnknownRepoException
 
 tests_dir = os.path.split(os.path.abspath(__file__))[0]
 
@@ -36,8 +38,65 @@ class TestPkgSource(object):
         flexmock(DnfArchive).should_receive('download').once()
         flexmock(DnfArchive).should_receive('pack').once()
         flexmock(DnfArchive).should_receive('unpack').once()
-        flexmock(utils).should_receive('subprocess_popen_call')\
-        .and_return({'stdout' : srpms,
-                     'returncode' : 0})
+        flexmock(utils).should_receive('stream_lines')\
+        .replace_with(lambda command: iter(srpms.splitlines()))
         pkg_source = DnfArchive('pkg', 'dir', spec_file='pkg.spec')
         assert pkg_source.rpms_from_spec == expected
+
+    @pytest.mark.parametrize(('stdout', 'stderr', 'returncode', 'expected'), [
+        ('Last metadata expiration check\npython3-devel\npytest\n', '', 0,
+         {'python3-devel', 'pytest'}),
+        ('Last metadata expiration check\npytest\n', 'Error: timeout\n', 1, {'pytest'}),
+    ])
+    def test_dependencies(self, stdout, stderr, returncode, expected):
+        DnfArchive.repo = 'rawhide'
+        flexmock(DnfArchive).should_receive('download').once()
+        flexmock(DnfArchive).should_receive('pack').once()
+        flexmock(DnfArchive).should_receive('unpack').once()
+        flexmock(DnfArchive, rpms_from_spec=['pkg1'])
+        flexmock(dnf).should_receive('stream_lines').and_return(
+            utils.stream_lines(['sh', '-c', 'printf "{}"; printf "{}" >&2; exit {}'.format(
+                stdout, stderr, returncode)])).once()
+        pkg_source = DnfArchive('pkg', tests_dir + '/test/')
+        assert pkg_source.dependencies == expected
+        assert pkg_source.dependencies == expected
+        shutil.rmtree(tests_dir + '/test/')
+
+    def test_dependencies_unknown_repo(self):
+        DnfArchive.repo = 'unknown'
+        flexmock(DnfArchive).should_receive('download').once()
+        flexmock(DnfArchive).should_receive('pack').once()
+        flexmock(DnfArchive).should_receive('unpack').once()
+        flexmock(DnfArchive, rpms_from_spec=['pkg1'])
+        flexmock(dnf).should_receive('stream_lines').and_return(
+            utils.stream_lines(['sh', '-c', "echo \"Error: Unknown repo: 'unknown'\" >&2; exit 1"]))
+        pkg_source = DnfArchive('pkg', tests_dir + '/test/')
+        with pytest.raises(UnknownRepoException):
+            pkg_source.dependencies
+        shutil.rmtree(tests_dir + '/test/')
+
+    def test_prefetch(self, tmpdir):
+        DnfArchive.repo = 'rawhide'
+        calls = []
+
+        def run(commands):
+            calls.append(commands)
+            return [{'returncode': 0, 'stdout': 'Last metadata expiration check\n'
+                     '{}-devel\n'.format(x[-1]), 'stderr': ''} for x in commands]
+
+        flexmock(dnf).should_receive('run_subprocess_calls').replace_with(run)
+        flexmock(DnfArchive).should_receive('pack')
+        flexmock(DnfArchive).should_receive('unpack')
+        flexmock(DnfArchive, rpms_from_spec=['pkg1'])
+        for package in ['pkg1', 'pkg2']:
+            tmpdir.mkdir(package).join(package + '-1.0-1.fc24.src.rpm').write('srpm')
+        container = dnf.PkgsContainer()
+        pkg_dirs = {x: str(tmpdir.join(x)) + '/' for x in ['pkg1', 'pkg2']}
+        container.prefetch(pkg_dirs, repo='rawhide')
+        # one batch of downloads and one batch of repoqueries
+        assert [[x[1] for x in commands] for commands in calls] == \
+            [['download', 'download'], ['repoquery', 'repoquery']]
+        flexmock(dnf).should_receive('stream_lines').never()
+        container.add('pkg2', pkg_dirs['pkg2'], 'rawhide', '')
+        assert container['pkg2'].srpm_file == 'pkg2-1.0-1.fc24.src.rpm'
+        assert container['pkg2'].dependencies == {'pkg2-devel'}
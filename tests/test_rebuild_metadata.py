@@ -47,6 +47,48 @@ class TestRebuildMetadata(object):
         metadata = rebuild_metadata.RebuildMetadata(yaml_data)
         assert metadata[key] == value
 
+    @pytest.mark.parametrize(('line', 'message'), [
+        ("retries: yes", "retries has to be int, not bool"),
+        ("chroots: {a: 1}", "chroots has to be str or list, not dict"),
+        ("speculative_packages: [pkg1, 2]", "speculative_packages has to contain only strings"),
+        ("speculative: true", "speculative builds need hard_requires"),
+        ("retries: -1", "retries has to be at least 0, not -1"),
+        ("copr_slots: 0", "copr_slots has to be at least 1, not 0"),
+        ("mock_roots: 0", "mock_roots has to be at least 1, not 0"),
+        ("local_failure_rate: 1.5", "local_failure_rate has to be between 0 and 1, not 1.5"),
+    ])
+    def test_schema(self, line, message):
+        yaml_data = "build_system: copr\npackages_source: dnf\nrepo: rawhide\n" \
+            "packages: [pkg1]\nretry_backoff: 1.5\n" + line
+        with pytest.raises(IncompleteMetadataException) as e:
+            rebuild_metadata.RebuildMetadata(yaml_data)
+        assert message in str(e.value)
+
+    def test_all_errors(self):
+        with pytest.raises(IncompleteMetadataException) as e:
+            rebuild_metadata.RebuildMetadata("build_system: copr\nrepo: [rawhide]")
+        assert 'missing attribute packages_source' in str(e.value)
+        assert 'missing attribute packages' in str(e.value)
+        assert 'repo has to be str, not list' in str(e.value)
+
+    def test_packages_from(self, tmpdir):
+        tmpdir.join('lists').mkdir()
+        tmpdir.join('lists', 'a.txt').write('pkg2\n# comment\n\npkg3\n')
+        tmpdir.join('lists', 'b.txt').write('pkg1\npkg4\n')
+        tmpdir.join('more.txt').write('pkg5\n')
+        tmpdir.join('Rebuild.yml').write("build_system: copr\npackages_source: dnf\n"
+                                         "repo: rawhide\npackages: [pkg1]\n"
+                                         "packages_from: [lists/*.txt, more.txt]\n")
+        metadata = rebuild_metadata.RebuildMetadata.from_file(str(tmpdir.join('Rebuild.yml')))
+        assert metadata['packages'] == ['pkg1', 'pkg2', 'pkg3', 'pkg4', 'pkg5']
+
+    def test_missing_packages_from(self, tmpdir):
+        with pytest.raises(IncompleteMetadataException):
+            rebuild_metadata.RebuildMetadata("build_system: copr\npackages_source: dnf\n"
+                                             "repo: rawhide\npackages_from: none*.txt",
+                                             str(tmpdir))
+
+
 class TestRecipe(object):
     
     @pytest.mark.parametrize(('attr', 'value'), [
@@ -56,3 +98,22 @@ class TestRecipe(object):
     def test_get_packages(self, attr, value):
         r = rebuild_metadata.Recipe("{}/test_data/recipe.yml".format(tests_dir))
         assert getattr(r, attr) == value
+
+    @pytest.mark.parametrize(('recipe', 'message'), [
+        ("- ['pkg1', 'bootstrap 0']\n- ['pkg2']\n", None),
+        ("- ['pkg1', 'bootstrap 0']\n- ['pkg3']\n", "packages pkg3 of recipe"),
+        ("- ['pkg1', 'bootstrap 0', 'x']\n", "step 1 has to be [package] or [package, macro]"),
+        ("pkg1: bootstrap", "recipe has to be a list of steps"),
+    ])
+    def test_recipes(self, tmpdir, recipe, message):
+        tmpdir.join('recipe.yml').write(recipe)
+        tmpdir.join('Rebuild.yml').write("build_system: copr\npackages_source: dnf\n"
+                                         "repo: rawhide\npackages: [pkg1, pkg2]\n"
+                                         "recipes: {}\n".format(tmpdir.join('recipe.yml')))
+        if message is None:
+            metadata = rebuild_metadata.RebuildMetadata.from_file(str(tmpdir.join('Rebuild.yml')))
+            assert metadata['recipes'][0].packages == {'pkg1', 'pkg2'}
+        else:
+            with pytest.raises(IncompleteMetadataException) as e:
+                rebuild_metadata.RebuildMetadata.from_file(str(tmpdir.join('Rebuild.yml')))
+            assert message in str(e.value)
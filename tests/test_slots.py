@@ -0,0 +1,148 @@
+import os
+import json
+import subprocess
+import threading
+import pytest
+
+from rebuild_tool import slots
+from rebuild_tool.slots import SlotPool, HostSlotPool
+
+
+class TestSlotPool(object):
+
+    @pytest.mark.parametrize(('size', 'n', 'expected'), [
+        (None, 50, 50),
+        (3, 5, 3),
+        (3, 2, 2),
+    ])
+    def test_acquire(self, size, n, expected):
+        assert SlotPool(size).acquire(n) == expected
+
+    def test_non_blocking(self):
+        pool = SlotPool(1)
+        assert pool.acquire() == 1
+        assert pool.acquire(blocking=False) == 0
+        pool.release()
+        assert pool.acquire(blocking=False) == 1
+
+    def test_wait_for_release(self):
+        pool = SlotPool(2)
+        pool.acquire(2)
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(pool.acquire(2)))
+        thread.start()
+        thread.join(0.1)
+        assert not acquired
+        pool.release(1)
+        thread.join(1)
+        assert acquired == [1]
+
+    def test_parent(self):
+        parent = SlotPool(2)
+        pool = SlotPool(5)
+        pool.attach(parent)
+        assert pool.acquire(4) == 2
+        assert (pool.used, parent.used) == (2, 2)
+        assert pool.acquire(blocking=False) == 0
+        assert pool.used == 2
+        pool.release(2)
+        assert (pool.used, parent.used) == (0, 0)
+
+
+class TestHostSlotPool(object):
+
+    def test_weights(self, tmpdir):
+        path = str(tmpdir.join('slots.json'))
+        heavy = HostSlotPool(path, 4, weight=3)
+        light = HostSlotPool(path, 4, weight=1)
+        assert heavy.acquire(4) == 4
+        assert light.acquire(blocking=False) == 0
+        heavy.release(2)
+        # light is waiting, heavy gets only its share of 3 slots
+        assert heavy.acquire(2, blocking=False) == 1
+        assert light.acquire(blocking=False) == 1
+        heavy.release(3)
+        # nobody else is waiting, light can take more than its share
+        assert light.acquire(3, blocking=False) == 3
+        light.release(4)
+        assert json.loads(tmpdir.join('slots.json').read()) == {}
+
+    def test_wait_for_release(self, tmpdir):
+        path = str(tmpdir.join('slots.json'))
+        first = HostSlotPool(path, 2, poll_interval=0.01)
+        second = HostSlotPool(path, 2, poll_interval=0.01)
+        first.acquire(2)
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(second.acquire(2)))
+        thread.start()
+        thread.join(0.1)
+        assert not acquired
+        first.release(1)
+        thread.join(1)
+        assert acquired == [1]
+
+    def test_finished_process(self, tmpdir):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        tmpdir.join('slots.json').write(json.dumps(
+            {'{}-1'.format(process.pid): {'pid': process.pid, 'weight': 1,
+                                          'used': 3, 'waiting': 0}}))
+        assert HostSlotPool(str(tmpdir.join('slots.json')), 3).acquire(3) == 3
+
+    @pytest.mark.parametrize('content', [
+        '{"pid": 1, "used"',
+        '[1, 2]',
+        '{"1-1": {"pid": 1}, "2-1": null}',
+        '{"0-1": {"pid": 0, "weight": 1, "used": 2, "waiting": 0}}',
+    ])
+    def test_corrupted_file(self, tmpdir, content):
+        tmpdir.join('slots.json').write(content)
+        pool = HostSlotPool(str(tmpdir.join('slots.json')), 2)
+        assert pool.acquire(2) == 2
+        pool.release(2)
+        assert json.loads(tmpdir.join('slots.json').read()) == {}
+
+    def test_file_mode(self, tmpdir):
+        umask = os.umask(0o022)
+        try:
+            pool = HostSlotPool(str(tmpdir.join('slots.json')), 2)
+            assert pool.acquire() == 1
+        finally:
+            os.umask(umask)
+        assert os.stat(str(tmpdir.join('slots.json'))).st_mode & 0o777 == 0o666
+
+    @pytest.mark.parametrize('link', [os.symlink, os.link])
+    def test_linked_file(self, tmpdir, link):
+        tmpdir.join('victim').write('data')
+        link(str(tmpdir.join('victim')), str(tmpdir.join('slots.json')))
+        with pytest.raises(OSError):
+            HostSlotPool(str(tmpdir.join('slots.json')), 2).acquire()
+        assert tmpdir.join('victim').read() == 'data'
+
+    def test_local_slots_first(self, tmpdir):
+        path = str(tmpdir.join('slots.json'))
+        batch = SlotPool(1)
+        pool = HostSlotPool(path, 2, poll_interval=0.01)
+        pool.attach(batch)
+        batch.acquire()
+        thread = threading.Thread(target=pool.acquire)
+        thread.start()
+        thread.join(0.1)
+        # host slots are not held while waiting for slots of the batch
+        assert pool.used == 0
+        batch.release()
+        thread.join(1)
+        assert (pool.used, batch.used) == (1, 1)
+
+    def test_stopped_waiting(self, tmpdir, monkeypatch):
+        path = str(tmpdir.join('slots.json'))
+        heavy = HostSlotPool(path, 4, weight=3)
+        light = HostSlotPool(path, 4, weight=1)
+        assert heavy.acquire(4) == 4
+        assert light.acquire(blocking=False) == 0
+        heavy.release(2)
+        assert heavy.acquire(2, blocking=False) == 1
+        assert heavy.acquire(blocking=False) == 0
+        # light didn't ask again in time, heavy can take slots over its share
+        monkeypatch.setattr(slots, 'WAITING_TIMEOUT', -1)
+        assert heavy.acquire(blocking=False) == 1
@@ -0,0 +1,119 @@
+import pytest
+import os
+import bz2
+import gzip
+import lzma
+import struct
+
+from rebuild_tool.srpm import SrpmReader, RPMTAG_PAYLOADCOMPRESSOR
+from rebuild_tool.exceptions import SrpmFormatException
+
+
+def make_header(tags):
+    '''
+    Creates rpm header with string tags
+    '''
+    index = b''
+    store = b''
+    for tag, value in sorted(tags.items()):
+        index += struct.pack('>IIII', tag, 6, len(store), 1)
+        store += value.encode('utf-8') + b'\0'
+    return b'\x8e\xad\xe8\x01\0\0\0\0' + struct.pack('>II', len(tags), len(store)) + index + store
+
+
+def make_cpio(files):
+    '''
+    Creates cpio archive in newc format from list of (name, data)
+    '''
+    archive = b''
+    for name, data in files + [('TRAILER!!!', b'')]:
+        mode = 0 if name == 'TRAILER!!!' else 0o100644
+        fields = [0, mode, 0, 0, 1, 1000, len(data), 0, 0, 0, 0, len(name) + 1, 0]
+        header = b'070701' + b''.join('{:08x}'.format(x).encode() for x in fields)
+        archive += header + name.encode() + b'\0'
+        archive += b'\0' * ((4 - len(archive) % 4) % 4)
+        archive += data
+        archive += b'\0' * ((4 - len(archive) % 4) % 4)
+    return archive
+
+
+def make_srpm(path, files, compressor='gzip'):
+    compress = {'gzip': gzip.compress, 'bzip2': bz2.compress, 'xz': lzma.compress}[compressor]
+    signature = make_header({1000: 'x'})
+    signature += b'\0' * ((8 - len(signature) % 8) % 8)
+    with open(path, 'wb') as fo:
+        fo.write(b'\xed\xab\xee\xdb' + b'\0' * 92)
+        fo.write(signature)
+        fo.write(make_header({RPMTAG_PAYLOADCOMPRESSOR: compressor}))
+        fo.write(compress(make_cpio(files)))
+    return path
+
+
+files = [('foo-1.0.tar.gz', b'tarball' * 1000),
+         ('foo.spec', b'Name: foo\n'),
+         ('patch0.patch', b'abc')]
+
+
+class TestSrpmReader(object):
+
+    @pytest.mark.parametrize('compressor', ['gzip', 'bzip2', 'xz'])
+    def test_entries(self, tmpdir, compressor):
+        reader = SrpmReader(make_srpm(str(tmpdir.join('foo.src.rpm')), files, compressor))
+        assert reader.compressor == compressor
+        assert [(x.name, x.read()) for x in reader.entries()] == files
+
+    def test_extract_spec(self, tmpdir):
+        reader = SrpmReader(make_srpm(str(tmpdir.join('foo.src.rpm')), files))
+        assert reader.extract_spec(str(tmpdir)) == 'foo.spec'
+        assert tmpdir.join('foo.spec').read() == 'Name: foo\n'
+        assert not tmpdir.join('foo-1.0.tar.gz').exists()
+
+    def test_extract(self, tmpdir):
+        reader = SrpmReader(make_srpm(str(tmpdir.join('foo.src.rpm')), files))
+        extracted = reader.extract(str(tmpdir), select=lambda name: not name.endswith('.spec'))
+        assert extracted == ['foo-1.0.tar.gz', 'patch0.patch']
+        assert tmpdir.join('patch0.patch').read() == 'abc'
+        assert os.path.getmtime(str(tmpdir.join('patch0.patch'))) == 1000
+
+    @pytest.mark.parametrize(('content', 'expected'), [
+        (b'not a rpm' * 20, SrpmFormatException),
+        (b'\xed\xab\xee\xdb' + b'\0' * 92 + b'short', SrpmFormatException),
+    ])
+    def test_bad_file(self, tmpdir, content, expected):
+        tmpdir.join('bad.src.rpm').write_binary(content)
+        with pytest.raises(expected):
+            SrpmReader(str(tmpdir.join('bad.src.rpm')))
+
+    def test_missing_spec(self, tmpdir):
+        reader = SrpmReader(make_srpm(str(tmpdir.join('foo.src.rpm')), files[:1]))
+        with pytest.raises(SrpmFormatException):
+            reader.extract_spec(str(tmpdir))
+
+    @pytest.mark.parametrize('compressor', ['gzip', 'bzip2', 'xz'])
+    @pytest.mark.parametrize('damage', [
+        lambda data: data[:len(data) // 2],
+        lambda data: data[:40] + b'\xff' * 20 + data[60:],
+    ])
+    def test_corrupted_payload(self, tmpdir, compressor, damage):
+        path = make_srpm(str(tmpdir.join('foo.src.rpm')), files, compressor)
+        reader = SrpmReader(path)
+        with open(path, 'rb') as fi:
+            data = fi.read()
+        with open(path, 'wb') as fo:
+            fo.write(data[:reader.payload_offset] + damage(data[reader.payload_offset:]))
+        with pytest.raises(SrpmFormatException):
+            reader.extract(str(tmpdir))
+
+    @pytest.mark.parametrize('extract', [
+        lambda reader, dest: reader.extract(dest),
+        lambda reader, dest: reader.extract_spec(dest),
+    ])
+    def test_write_error(self, tmpdir, extract):
+        reader = SrpmReader(make_srpm(str(tmpdir.join('foo.src.rpm')), files))
+        dest = tmpdir.join('dest').ensure(dir=True)
+        for (name, data) in files:
+            os.symlink('/dev/full', str(dest.join(name)))
+        # full disk is not an error of the srpm
+        with pytest.raises(OSError) as e:
+            extract(reader, str(dest))
+        assert not isinstance(e.value, SrpmFormatException)
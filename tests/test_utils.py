@@ -0,0 +1,101 @@
+import pytest
+import time
+import threading
+from subprocess import TimeoutExpired, CalledProcessError
+
+from rebuild_tool import utils
+
+
+class TestSubprocessCalls(object):
+
+    @pytest.mark.parametrize(('command', 'expected'), [
+        (['echo', 'foo'], {'returncode': 0, 'stdout': 'foo\n', 'stderr': ''}),
+        (['sh', '-c', 'echo bar >&2; exit 3'], {'returncode': 3, 'stdout': '', 'stderr': 'bar\n'}),
+    ])
+    def test_subprocess_popen_call(self, command, expected):
+        assert utils.subprocess_popen_call(command) == expected
+
+    def test_cwd(self, tmpdir):
+        assert utils.subprocess_popen_call(['pwd'], cwd=str(tmpdir))['stdout'] == str(tmpdir) + '\n'
+
+    def test_pipeline_call(self):
+        result = utils.pipeline_call([['printf', 'b\\na\\n'], ['sort']])
+        assert result == {'returncode': 0, 'stdout': 'a\nb\n', 'stderr': ''}
+
+    def test_pipeline_returncode(self):
+        result = utils.pipeline_call([['sh', '-c', 'echo x >&2; exit 2'], ['cat']])
+        assert result['returncode'] == 2
+        assert result['stderr'] == 'x\n'
+
+    def test_timeout(self):
+        with pytest.raises(TimeoutExpired):
+            utils.subprocess_popen_call(['sleep', '5'], timeout=0.2)
+
+    def test_run_subprocess_calls_concurrently(self, monkeypatch):
+        monkeypatch.setattr(utils, 'max_processes', 4)
+        start = time.time()
+        results = utils.run_subprocess_calls([['sleep', '0.5']] * 4)
+        assert [x['returncode'] for x in results] == [0] * 4
+        assert time.time() - start < 1.5
+
+    def test_limiter(self, monkeypatch):
+        monkeypatch.setattr(utils, 'max_processes', 1)
+        start = time.time()
+        utils.run_subprocess_calls([['sleep', '0.3']] * 3)
+        assert time.time() - start >= 0.9
+
+    def test_limiter_threads(self, monkeypatch):
+        monkeypatch.setattr(utils, 'max_processes', 1)
+        start = time.time()
+        threads = [threading.Thread(target=utils.run_subprocess_calls,
+                                    args=([['sleep', '0.3']],)) for x in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.time() - start >= 0.9
+
+    def test_stdout_callback(self):
+        lines = []
+        result = utils.run_async(utils.async_subprocess_call(
+            ['printf', '1\\n2\\n'], stdout_callback=lines.append, capture_stdout=False))
+        assert lines == ['1\n', '2\n']
+        assert result['stdout'] == ''
+
+    def test_stream_lines(self):
+        lines = utils.stream_lines(['printf', '1\\n2\\n3'])
+        assert next(lines) == '1'
+        assert list(lines) == ['2', '3']
+
+    def test_stream_lines_failure(self):
+        with pytest.raises(CalledProcessError) as e:
+            list(utils.stream_lines(['sh', '-c', 'echo x; echo err >&2; exit 4']))
+        assert (e.value.returncode, e.value.stderr) == (4, 'err\n')
+
+    def test_stream_lines_close(self):
+        lines = utils.stream_lines(['yes'])
+        assert [next(lines) for x in range(3)] == ['y'] * 3
+        lines.close()
+
+    def test_stream_lines_timeout(self):
+        start = time.time()
+        with pytest.raises(TimeoutExpired):
+            list(utils.stream_lines(['sh', '-c', 'echo x; exec sleep 5'], timeout=0.2))
+        assert time.time() - start < 2
+
+    def test_stream_lines_limiter(self, monkeypatch):
+        monkeypatch.setattr(utils, 'max_processes', 1)
+        lines = utils.stream_lines(['yes'])
+        next(lines)
+        assert not utils.process_slots().acquire(blocking=False)
+        lines.close()
+        assert utils.process_slots().acquire(blocking=False)
+        utils.process_slots().release()
+
+    def test_call_from_thread(self):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            utils.pipeline_call([['echo', 'foo'], ['cat']])))
+        thread.start()
+        thread.join()
+        assert results == [{'returncode': 0, 'stdout': 'foo\n', 'stderr': ''}]
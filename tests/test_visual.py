@@ -0,0 +1,119 @@
+import os
+import time
+import random
+import pytest
+import networkx as nx
+import xml.etree.ElementTree as ET
+from flexmock import flexmock
+
+from rebuild_tool import visual
+from rebuild_tool.builder import BuildState
+from rebuild_tool.visual import condense, component_state, to_dot, to_svg, write_graph
+
+
+def create_graph():
+    G = nx.DiGraph()
+    # A <-> B cycle, C requires A, D standalone
+    G.add_edges_from([('A', 'B'), ('B', 'A'), ('C', 'A')])
+    G.add_node('D')
+    return G
+
+
+class TestVisual(object):
+
+    def test_condense(self):
+        (C, members) = condense(create_graph())
+        assert members == {'cycle0': ['A', 'B'], 'C': ['C'], 'D': ['D']}
+        assert set(C.edges()) == {('C', 'cycle0')}
+
+    @pytest.mark.parametrize(('states', 'expected'), [
+        ({}, 'pending'),
+        ({'A': 'succeeded', 'B': 'succeeded'}, 'succeeded'),
+        ({'A': 'succeeded'}, 'pending'),
+        ({'A': 'succeeded', 'B': 'in_flight'}, 'in_flight'),
+        ({'A': 'failed', 'B': 'blocked'}, 'failed'),
+    ])
+    def test_component_state(self, states, expected):
+        assert component_state(['A', 'B'], states) == expected
+
+    def test_to_dot(self):
+        dot = to_dot(create_graph(), {'C': 'failed'})
+        assert '"C" -> "cycle0";' in dot
+        assert 'label="2 packages"' in dot
+        assert 'tooltip="A B"' in dot
+        assert '"C" [fillcolor="{}", label="C"];'.format(visual.COLORS['failed']) in dot
+
+    def test_to_dot_not_collapsed(self):
+        dot = to_dot(create_graph(), collapse=False)
+        assert '"A" -> "B";' in dot
+        assert 'cycle' not in dot
+
+    def test_to_svg(self):
+        root = ET.fromstring(to_svg(create_graph(), {'D': 'succeeded'}))
+        assert len(root.findall('{http://www.w3.org/2000/svg}g/{http://www.w3.org/2000/svg}rect')) == 3
+        assert len(root.findall('{http://www.w3.org/2000/svg}g/{http://www.w3.org/2000/svg}line')) == 1
+
+    @pytest.mark.parametrize('extension', ['.dot', '.svg', '.html'])
+    def test_write_graph(self, tmpdir, extension):
+        path = str(tmpdir.join('graph' + extension))
+        write_graph(path, create_graph(), {})
+        assert os.path.getsize(path)
+        assert tmpdir.listdir() == [tmpdir.join('graph' + extension)]
+
+    def test_write_graph_unknown_format(self, tmpdir):
+        with pytest.raises(ValueError):
+            write_graph(str(tmpdir.join('graph.png')), create_graph())
+
+    def test_large_graph(self):
+        generator = random.Random(0)
+        G = nx.DiGraph()
+        for x in range(1, 5000):
+            for dep in generator.sample(range(x), min(x, 3)):
+                G.add_edge('pkg{}'.format(x), 'pkg{}'.format(dep))
+        G.add_edges_from([('pkg0', 'pkg4999'), ('pkg10', 'pkg20')])
+        start = time.time()
+        to_svg(G)
+        assert time.time() - start < 10
+
+    def test_graph_writer(self, tmpdir):
+        path = str(tmpdir.join('graph.dot'))
+        builder = flexmock(state=BuildState(1, create_graph(), {'A': 'in_flight'}, {}))
+        writer = visual.GraphWriter(builder, path, interval=0.01)
+        writer.start()
+        writer.stop()
+        writer.join(1)
+        assert not writer.is_alive()
+        with open(path) as fi:
+            assert visual.COLORS['in_flight'] in fi.read()
+
+    def test_draw_live(self):
+        matplotlib = pytest.importorskip('matplotlib')
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from matplotlib.backend_bases import TimerBase
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        G = create_graph()
+        observers = []
+        builder = flexmock(state=BuildState(1, G, {'A': 'in_flight'}, {}),
+                           subscribe=lambda x: observers.append(x),
+                           unsubscribe=lambda x: observers.remove(x))
+        timers = []
+        flexmock(FigureCanvasAgg).should_receive('new_timer').replace_with(
+            lambda interval: timers.append(TimerBase(interval)) or timers[-1])
+        shown = []
+
+        def show():
+            nodes = plt.gca().collections[0]
+            shown.append(nodes.get_facecolors().tolist())
+            builder.state = BuildState(2, G, {'A': 'succeeded', 'B': 'failed'}, {})
+            for observer in list(observers):
+                observer(builder.state)
+            for (fce, args, kwargs) in timers[0].callbacks:
+                fce(*args, **kwargs)
+            shown.append(nodes.get_facecolors().tolist())
+
+        flexmock(plt).should_receive('show').replace_with(show)
+        visual.draw(G, builder.state.states, builder)
+        assert shown[0] != shown[1]
+        assert observers == []
+        plt.close('all')